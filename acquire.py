@@ -0,0 +1,37 @@
+import argparse
+from src.API.Acquisition import AcquisitionPool
+from src.API.DBManager import DatabaseManager
+from src.API.Maintenance import MaintenanceJob
+from src.UTILS.config import config_instance as config
+from src.UTILS.logger import Logger
+
+logger = Logger("Acquire")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record several vehicles at once, one acquisition process per adapter")
+    parser.add_argument("adapters", nargs="+", help="Serial ports of the adapters, e.g. /dev/ttyUSB0 /dev/ttyUSB1")
+    parser.add_argument("--baudrate", type=int, default=config.get_obd_baudrate(), help="Baud rate of every adapter (default: auto-detect)")
+    parser.add_argument("--interval", type=float, default=config.get_pipeline_interval(), help="Seconds between two samples of a vehicle")
+    parser.add_argument("--db", default=config.get_db_path(), help="Database file (default: from config.ini)")
+    args = parser.parse_args()
+
+    db_manager = DatabaseManager.get_instance(args.db)
+    db_manager.create_tables()
+    pool = AcquisitionPool(args.adapters, db_manager, baudrate=args.baudrate, interval=args.interval).start()
+    maintenance = MaintenanceJob(args.db, db_manager.active_session_ids).start() if config.get_maintenance_enabled() else None
+    if maintenance:
+        db_manager.on_session_end = maintenance.session_ended
+    try:
+        pool.run()
+    except KeyboardInterrupt:
+        logger.info("Ctrl+C detected. Shutting down...")
+    finally:
+        if maintenance:
+            maintenance.stop()
+        pool.stop()
+        db_manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import argparse
+import contextlib
+import datetime
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from src.API.Replay import TRACE_VERSION
+from src.API.Rollups import percentile
+
+# CAN 11 bit / 500 kbaud, the protocol of most cars built after 2008
+SYNTHETIC_PROTOCOL = "6"
+ENGINE_HEADER = "7E8"
+# 0100 reply advertising PIDs 01-20 as supported
+SYNTHETIC_INIT = [ENGINE_HEADER + "064100BE3FA813"]
+
+DEFAULT_TRACE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "synthetic_trace.jsonl")
+
+# Metrics where a higher value is better; every other metric is a latency
+HIGHER_IS_BETTER = {"obd_samples_per_sec"}
+# Tail latencies of sub-millisecond calls are too noisy to gate on
+COMPARED_SUFFIXES = ("_per_sec", "_p50_ms", "_p95_ms")
+
+
+def can_line(data):
+    """Single frame CAN reply line carrying data bytes"""
+    return ENGINE_HEADER + "%02X" % len(data) + "".join("%02X" % byte for byte in data)
+
+
+def synthesize_trace(path, seconds=60, rate=10.0, seed=0):
+    """Write a trace of a synthetic drive: speed, rpm and throttle at rate Hz, slower PIDs at 0.2 Hz"""
+    rng = random.Random(seed)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as trace:
+        trace.write(json.dumps({"version": TRACE_VERSION, "protocol": SYNTHETIC_PROTOCOL, "init": SYNTHETIC_INIT, "recorded_at": 0}) + "\n")
+
+        def exchange(request, data, latency):
+            trace.write(json.dumps({"request": request, "lines": [can_line(data)], "latency": round(latency, 6)}) + "\n")
+
+        for i in range(int(seconds * rate)):
+            t = i / rate
+            speed = max(0.0, 60 + 50 * math.sin(t / 20) + rng.gauss(0, 2))
+            rpm = 800 + speed * 35 + rng.gauss(0, 50)
+            throttle = min(100.0, max(0.0, 15 + 10 * math.cos(t / 20) + rng.gauss(0, 2)))
+            exchange("010D", [0x41, 0x0D, int(speed)], rng.uniform(0.03, 0.06))
+            raw_rpm = int(rpm * 4)
+            exchange("010C", [0x41, 0x0C, raw_rpm >> 8 & 0xFF, raw_rpm & 0xFF], rng.uniform(0.03, 0.06))
+            exchange("0111", [0x41, 0x11, int(throttle * 255 / 100)], rng.uniform(0.03, 0.06))
+            if i % int(rate * 5) == 0:
+                coolant = min(90.0, 20 + t)
+                exchange("0105", [0x41, 0x05, int(coolant + 40)], rng.uniform(0.03, 0.06))
+                exchange("0103", [0x41, 0x03, 0x02, 0x00], rng.uniform(0.03, 0.06))
+            if i % int(rate * 60) == 0:
+                # One stored code: P0133
+                exchange("03", [0x43, 0x01, 0x01, 0x33], rng.uniform(0.05, 0.1))
+
+
+def summarize(prefix, samples):
+    """p50/p95/p99/max of latency samples in seconds, reported in milliseconds"""
+    samples = sorted(samples)
+    return {
+        f"{prefix}_p50_ms": round(percentile(samples, 50) * 1000, 4),
+        f"{prefix}_p95_ms": round(percentile(samples, 95) * 1000, 4),
+        f"{prefix}_p99_ms": round(percentile(samples, 99) * 1000, 4),
+        f"{prefix}_max_ms": round(samples[-1] * 1000, 4),
+    }
+
+
+def bench_obd_throughput(obd_manager, seconds):
+    """Samples per second the poll scheduler gets out of the adapter with every command polled flat out"""
+    for cmd in obd_manager.POLL_RATES:
+        obd_manager.scheduler.watch(cmd, 10000.0)
+
+    def total_samples():
+        return sum(obd_manager.read_snapshot(name)[2] or 0 for name in obd_manager.watched_commands())
+
+    time.sleep(0.2)
+    before = total_samples()
+    start = time.perf_counter()
+    time.sleep(seconds)
+    samples = total_samples() - before
+    elapsed = time.perf_counter() - start
+    obd_manager.scheduler.stop()
+    return {"obd_samples_per_sec": round(samples / elapsed, 1)}
+
+
+def bench_db_insert(db_manager, obd_manager, count):
+    """Latency of insert_reading with values read from the replayed snapshots, stamped 100 ms apart"""
+    db_manager.start_session("Benchmark")
+    session_id = db_manager.session_id
+    first = datetime.datetime.now()
+    latencies = []
+    for i in range(count):
+        values = (obd_manager.get_speed(), obd_manager.get_rpm(), obd_manager.get_fuel_status(), obd_manager.get_coolant_temp(), obd_manager.get_dtc())
+        timestamp = first + datetime.timedelta(seconds=i / 10)
+        start = time.perf_counter()
+        db_manager.insert_reading(*values, timestamp=timestamp)
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    db_manager.end_session()
+    results = summarize("db_insert", latencies)
+    results["db_end_session_ms"] = round((time.perf_counter() - start) * 1000, 4)
+    return session_id, results
+
+
+def bench_handle_request(server, session_id, iterations):
+    """Latency of handle_request for live values and session queries"""
+    requests = {
+        "healthcheck": "healthcheck",
+        "get_speed": "get_speed",
+        "get_dtc": "get_dtc",
+        "get_current_driving_session": json.dumps({"request": "get_current_driving_session", "session_id": session_id}),
+        "get_history": json.dumps({"request": "get_history", "session_id": session_id, "signal": "speed", "points": 100}),
+        "get_trip_metrics": json.dumps({"request": "get_trip_metrics", "session_id": session_id}),
+    }
+    results = {}
+    for name, request in requests.items():
+        latencies = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            server.handle_request(request)
+            latencies.append(time.perf_counter() - start)
+        results.update(summarize(f"request_{name}", latencies))
+    return results
+
+
+def run(trace, seconds, inserts, iterations):
+    from src.API.Replay import ReplayConnection
+    from src.API.OBDManager import OBDManager
+    from src.API.DBManager import DatabaseManager
+    from src.API.BTInteractions import BluetoothServer
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, "w") as devnull:
+        # Keep the console logging of every query out of the measurements' output
+        with contextlib.redirect_stdout(devnull):
+            obd_manager = OBDManager(connection=ReplayConnection(trace, speed=0))
+            results.update(bench_obd_throughput(obd_manager, seconds))
+            db_manager = DatabaseManager.get_instance(os.path.join(directory, "benchmark.db"))
+            db_manager.create_tables()
+            session_id, insert_results = bench_db_insert(db_manager, obd_manager, inserts)
+            results.update(insert_results)
+            results.update(bench_handle_request(BluetoothServer(start=False), session_id, iterations))
+            db_manager.close()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return the metrics that regressed by more than tolerance (a fraction) against baseline"""
+    regressions = []
+    for name, expected in baseline.items():
+        value = results.get(name)
+        if value is None or not expected or not name.endswith(COMPARED_SUFFIXES):
+            continue
+        change = (value - expected) / expected
+        if name in HIGHER_IS_BETTER:
+            change = -change
+        if change > tolerance:
+            regressions.append((name, expected, value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Open OBD against a recorded adapter trace, without hardware")
+    parser.add_argument("--trace", default=DEFAULT_TRACE, help="Trace to replay (default: the synthetic trace)")
+    parser.add_argument("--synthesize", metavar="PATH", help="Write a synthetic trace to PATH and exit")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Duration of the OBD throughput run")
+    parser.add_argument("--inserts", type=int, default=5000, help="Readings inserted in the database run")
+    parser.add_argument("--iterations", type=int, default=200, help="Calls of each BLE request")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results to compare against; exits with status 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed regression against the baseline (default: 0.25)")
+    args = parser.parse_args()
+
+    if args.synthesize:
+        synthesize_trace(args.synthesize)
+        return
+
+    results = run(args.trace, args.seconds, args.inserts, args.iterations)
+    for name, value in results.items():
+        print(f"{name:48} {value}")
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), args.tolerance)
+        for name, expected, value in regressions:
+            print(f"REGRESSION {name}: {expected} -> {value}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
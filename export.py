@@ -0,0 +1,19 @@
+import argparse
+from src.API.Exporter import FORMATS, export_sessions
+from src.UTILS.config import config_instance as config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export driving sessions from the OBD database")
+    parser.add_argument("output", help="File to write")
+    parser.add_argument("--format", choices=FORMATS, default="csv", help="Output format (default: csv)")
+    parser.add_argument("--sessions", type=int, nargs="*", help="Session ids to export (default: all)")
+    parser.add_argument("--batch-size", type=int, default=10000, help="Readings read and written at a time")
+    parser.add_argument("--db", default=config.get_db_path(), help="Database file (default: from config.ini)")
+    args = parser.parse_args()
+
+    export_sessions(args.db, args.output, args.format, args.sessions, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
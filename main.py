@@ -1,10 +1,13 @@
 import time
-import obd
-from src.API.DBManager import DatabaseManager
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from src.API.DBManager import create_tables, DatabaseManager
-from src.API.BTInteractions import BluetoothServer
 from src.UTILS.config import config_instance as config
-from src.API.OBDManager import OBDManager
+from src.API.Pipeline import Pipeline, Consumer
+from src.API.Acquisition import read_sample
+from src.API.Maintenance import MaintenanceJob
+from src.UTILS.metrics import MetricsReporter, metrics_instance as metrics
 from src.UTILS.logger import Logger
 
 logger = Logger("Car Doctor")
@@ -14,66 +17,131 @@ class OpenOBD:
     custom_portstr = config.get_obd_portstr()
 
     def __init__(self, portstr=custom_portstr, baudrate=custom_baudrate):
-        available_ports = obd.scan_serial()
-        logger.info(f"Available ports: {available_ports}")
         self.custom_portstr = portstr
         self.custom_baudrate = baudrate
         self.obd_connection = None
         self.db_connection = None
         self.bt_api = None
+        self.metrics_reporter = None
+        self.maintenance = None
         self.startup()
 
     def init_obd_connection(self):
         logger.info("Trying to connect to OBD...")
-        logger.info(f"Port: {self.custom_portstr}")
-        logger.info(f"Baudrate: {self.custom_baudrate}")
-        self.obd_connection = OBDManager(portstr=self.custom_portstr, baudrate=self.custom_baudrate)
+        logger.info(f"Port: {self.custom_portstr or 'auto'}")
+        logger.info(f"Baudrate: {self.custom_baudrate or 'auto'}")
+        # obd (and its pint unit registry) is only imported once it is needed
+        from src.API.OBDManager import OBDManager
+        obd_manager = OBDManager(portstr=self.custom_portstr, baudrate=self.custom_baudrate)
+        if not obd_manager.connect():
+            raise ConnectionError("OBD connection failed")
+        self.obd_connection = obd_manager
 
     def init_database_connection(self):
         logger.info("Trying to connect to database...")
-        self.db_connection = DatabaseManager.get_instance()
+        db_connection = DatabaseManager.get_instance()
+        create_tables()
+        self.db_connection = db_connection
 
     def init_bluetooth_connection(self):
-        self.bt_api = BluetoothServer()
+        from src.API.BTInteractions import BluetoothServer
+        bt_api = BluetoothServer()
+        if not bt_api.wait_until_running(timeout=30):
+            bt_api.shutdown()
+            raise ConnectionError("BLE server failed to start")
+        self.bt_api = bt_api
+
+    def retry(self, name, init):
+        """Call init until it succeeds, backing off exponentially between attempts"""
+        delay = config.get_startup_initial_backoff()
+        max_delay = config.get_startup_max_backoff()
+        while True:
+            started = time.monotonic()
+            try:
+                init()
+                logger.info(f"Connected to {name} in {time.monotonic() - started:.2f}s.")
+                return
+            except Exception as e:
+                logger.error(f"Connection to {name} failed: {e}. Trying again in {delay:.1f} seconds...")
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
 
     def startup(self):
-        while not self.obd_connection:
-            self.init_obd_connection()
-            if not self.obd_connection:
-                logger.error("Connection to OBD failed. Trying again in 5 seconds...")
-                time.sleep(5)
-            else:
-                logger.info("Connected to OBD.")
-        
-        while not self.db_connection:
-            self.init_database_connection()
-            if not self.db_connection:
-                logger.error("Connection to DB failed. Trying again in 5 seconds...")
-                time.sleep(5)
-            else:
-                logger.info("Connected to DB.")
-
-        while not self.bt_api:
-            self.init_bluetooth_connection()
-            if not self.bt_api:
-                logger.error("Connection to Bluetooth API failed. Trying again in 5 seconds...")
-                time.sleep(5)
-            else:
-                logger.info("Connected to Bluetooth API.")
-
-        # Use the create_tables function from your import
-        create_tables()
+        """Bring OBD, database and Bluetooth up concurrently.
+
+        Sampling only needs OBD and the database, so startup returns as soon as
+        both are up. Bluetooth keeps retrying in the background if it isn't ready yet.
+        """
+        threading.Thread(target=self.retry, args=("Bluetooth API", self.init_bluetooth_connection), name="StartupBluetooth", daemon=True).start()
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="Startup") as pool:
+            pending = [
+                pool.submit(self.retry, "OBD", self.init_obd_connection),
+                pool.submit(self.retry, "DB", self.init_database_connection),
+            ]
+            for future in pending:
+                future.result()
+        self.obd_connection.discover_pids()
 
         logger.info("Connection established...")
 
 
-    async def shutdown(self):
+    def shutdown(self):
         logger.info("Shutting down server...")
         # Bluetooth
-        await self.bt_api.shutdown()
+        if self.bt_api:
+            self.bt_api.shutdown()
+        # OBD
+        if self.obd_connection and self.obd_connection.supervisor:
+            self.obd_connection.supervisor.stop()
+        if self.metrics_reporter:
+            self.metrics_reporter.stop()
+        if self.maintenance:
+            self.maintenance.stop()
         logger.info("Server shut down successfully.")
 
 
+    def sample(self):
+        """Read the latest values from the snapshot store, without touching the serial port"""
+        return read_sample(self.obd_connection)
+
+    def store_sample(self, sample):
+        DatabaseManager.get_instance().insert_reading(
+            speed=sample["speed"],
+            rpm=sample["rpm"],
+            coolant_temp=sample["coolant_temp"],
+            fuel_status=sample["fuel_status"],
+            dtc=sample["dtc"],
+            timestamp=sample["timestamp"]
+        )
+
+    def publish_sample(self, sample):
+        if self.bt_api:
+            self.bt_api.publish(sample)
+
+    def print_sample(self, sample):
+        logger.info(
+            f"Speed: {sample['speed']} | RPM: {sample['rpm']} | Coolant Temp: {sample['coolant_temp']} | "
+            f"Fuel Status: {sample['fuel_status']} | DTC: {sample['dtc']}"
+        )
+
+    def build_pipeline(self):
+        pipeline = Pipeline(self.sample, interval=config.get_pipeline_interval())
+        consumers = [
+            ("db", self.store_sample, True),
+            ("ble", self.publish_sample, False),
+            ("console", self.print_sample, False),
+        ]
+        for name, handler, blocking in consumers:
+            pipeline.add_consumer(Consumer(
+                name,
+                handler,
+                maxsize=config.get_pipeline_queue_size(name),
+                overflow=config.get_pipeline_overflow(name),
+                blocking=blocking,
+            ))
+        return pipeline
+
+
     def run(self):
         logger.info("Server is running. Press Ctrl+C to stop.")
 
@@ -81,29 +149,18 @@ class OpenOBD:
         DatabaseManager.get_instance().start_session()
         logger.info("Session started.")
 
+        snapshot_path = config.get_metrics_snapshot_path()
+        if snapshot_path:
+            self.metrics_reporter = MetricsReporter(metrics, snapshot_path, config.get_metrics_snapshot_interval()).start()
+
+        if config.get_maintenance_enabled():
+            db_manager = DatabaseManager.get_instance()
+            self.maintenance = MaintenanceJob(db_manager.db_path, db_manager.active_session_ids).start()
+            db_manager.on_session_end = self.maintenance.session_ended
+
+        pipeline = self.build_pipeline()
         try:
-            while True:
-                logger.info("Running")
-                speed = self.obd_connection.get_speed()
-                print(f"Speed: {speed}")
-                rpm = self.obd_connection.get_rpm()
-                print(f"RPM: {rpm}")
-                coolant_temp = self.obd_connection.get_coolant_temp()
-                print(f"Coolant Temp: {coolant_temp}")
-                fuel_status = self.obd_connection.get_fuel_status()
-                print(f"Fuel Status: {fuel_status}")
-                dtc = self.obd_connection.get_dtc()
-                print(f"DTC: {dtc}")
-
-                DatabaseManager.get_instance().insert_reading(
-                    speed=speed,
-                    rpm=rpm,
-                    coolant_temp=coolant_temp,
-                    fuel_status=fuel_status,
-                    dtc=dtc
-                )
-
-                time.sleep(5)
+            asyncio.run(pipeline.run())
         except KeyboardInterrupt:
             logger.info("Ctrl+C detected. Shutting down...")
             DatabaseManager.get_instance().end_session()
@@ -0,0 +1,28 @@
+import argparse
+import contextlib
+import sqlite3
+from src.API.Maintenance import MaintenanceJob, enable_incremental_vacuum
+from src.UTILS.config import config_instance as config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run database maintenance by hand, with the app stopped")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true", help="Convert a database created without incremental vacuum (rewrites the whole file)")
+    parser.add_argument("--run-once", action="store_true", help="Archive, enforce the storage budget and vacuum once")
+    parser.add_argument("--db", default=config.get_db_path(), help="Database file (default: from config.ini)")
+    args = parser.parse_args()
+    if not (args.enable_incremental_vacuum or args.run_once):
+        parser.error("nothing to do, give --enable-incremental-vacuum and/or --run-once")
+
+    if args.enable_incremental_vacuum:
+        with contextlib.closing(sqlite3.connect(args.db)) as connection:
+            enable_incremental_vacuum(connection)
+    if args.run_once:
+        # With the app stopped, no session is being recorded
+        job = MaintenanceJob(args.db)
+        job.step_pause = 0.0
+        job.run_once()
+
+
+if __name__ == "__main__":
+    main()
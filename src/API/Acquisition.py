@@ -0,0 +1,134 @@
+import datetime
+import multiprocessing
+import queue
+import signal
+import time
+from ..UTILS.logger import Logger
+from ..UTILS.config import config_instance as config
+from ..UTILS.metrics import metrics_instance as metrics
+
+logger = Logger("Acquisition")
+
+# Messages sent by the workers, as (kind, adapter, vehicle, sample) tuples
+STARTED = "started"
+SAMPLE = "sample"
+STOPPED = "stopped"
+
+
+def read_sample(obd_manager):
+    """Latest values of an OBDManager, read from its snapshot store"""
+    return {
+        "timestamp": datetime.datetime.now(),
+        "speed": obd_manager.get_speed(),
+        "rpm": obd_manager.get_rpm(),
+        "coolant_temp": obd_manager.get_coolant_temp(),
+        "fuel_status": obd_manager.get_fuel_status(),
+        "dtc": obd_manager.get_dtc(),
+    }
+
+
+def run_worker(adapter, baudrate, interval, samples, stop):
+    """Acquisition process of one adapter: connects, then sends a sample every interval seconds"""
+    # Ctrl+C reaches every process of the group; the parent stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Each process has its own OBDManager singleton, polling its own adapter
+    from .OBDManager import OBDManager
+
+    delay = config.get_startup_initial_backoff()
+    while True:
+        obd_manager = OBDManager(portstr=adapter, baudrate=baudrate)
+        if obd_manager.connect():
+            break
+        logger.error(f"Connection to {adapter} failed. Trying again in {delay:.1f} seconds...")
+        if stop.wait(delay):
+            return
+        delay = min(delay * 2, config.get_startup_max_backoff())
+
+    vehicle = obd_manager.vehicle_key()
+    samples.put((STARTED, adapter, vehicle, None))
+    try:
+        deadline = time.monotonic()
+        while not stop.is_set():
+            samples.put((SAMPLE, adapter, vehicle, read_sample(obd_manager)))
+            deadline = max(deadline + interval, time.monotonic())
+            stop.wait(deadline - time.monotonic())
+    finally:
+        if obd_manager.supervisor:
+            obd_manager.supervisor.stop()
+        obd_manager.stop_polling()
+        samples.put((STOPPED, adapter, vehicle, None))
+
+
+class AcquisitionPool:
+    """One acquisition process per adapter, feeding a single database writer in this process.
+
+    OBD decoding happens in the workers, so adapters are polled in parallel
+    without contending for the GIL, while SQLite keeps a single writer. Each
+    vehicle gets its own session, keyed by VIN (or by adapter when the VIN
+    can't be read) and by the adapter it is recorded through, so two adapters
+    on the same vehicle never interleave their readings in one session.
+    """
+
+    def __init__(self, adapters, db_manager, baudrate=None, interval=1.0, queue_size=1000):
+        # Spawned rather than forked, so workers don't inherit the parent's threads and locks
+        context = multiprocessing.get_context("spawn")
+        self.db_manager = db_manager
+        self.samples = context.Queue(queue_size)
+        self.stop_event = context.Event()
+        self.workers = {
+            adapter: context.Process(
+                target=run_worker,
+                args=(adapter, baudrate, interval, self.samples, self.stop_event),
+                name=f"Acquisition {adapter}",
+                daemon=True,
+            )
+            for adapter in adapters
+        }
+        self.running = set()
+
+    def start(self):
+        for adapter, worker in self.workers.items():
+            worker.start()
+            logger.info(f"Started acquisition worker for {adapter} (pid {worker.pid})")
+        return self
+
+    def run(self):
+        """Write the workers' samples until stop() is called or every worker exited"""
+        while not self.stop_event.is_set():
+            if not self._drain_one(timeout=1.0) and not any(worker.is_alive() for worker in self.workers.values()):
+                logger.error("Every acquisition worker exited")
+                break
+
+    def stop(self, timeout=10.0):
+        """Stop the workers, write their last samples and end every session"""
+        self.stop_event.set()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and any(worker.is_alive() for worker in self.workers.values()):
+            self._drain_one(timeout=0.1)
+        while self._drain_one(timeout=0.1):
+            pass
+        for worker in self.workers.values():
+            worker.join(max(0.0, deadline - time.monotonic()))
+            if worker.is_alive():
+                worker.terminate()
+        for vehicle, adapter in list(self.running):
+            self.db_manager.end_session(vehicle, adapter)
+        self.running.clear()
+
+    def _drain_one(self, timeout):
+        try:
+            kind, adapter, vehicle, sample = self.samples.get(timeout=timeout)
+        except queue.Empty:
+            return False
+        key = (vehicle, adapter)
+        if kind in (STARTED, SAMPLE) and key not in self.running:
+            self.db_manager.start_session(vehicle_info=vehicle, vehicle=vehicle, adapter=adapter)
+            self.running.add(key)
+        if kind == SAMPLE:
+            self.db_manager.insert_reading(vehicle=vehicle, adapter=adapter, **sample)
+            metrics.mark("acquisition.samples")
+            metrics.increment(f"acquisition.samples.{adapter}")
+        elif kind == STOPPED and key in self.running:
+            self.db_manager.end_session(vehicle, adapter)
+            self.running.discard(key)
+        return True
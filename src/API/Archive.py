@@ -0,0 +1,367 @@
+import array
+import bisect
+import contextlib
+import datetime
+import itertools
+import json
+import lzma
+import mmap
+import os
+import struct
+import sys
+import zlib
+from ..UTILS.config import config_instance as config
+
+# Archive file layout, little endian:
+#   header  <4sBBBII  magic, version, codec, flags, reading count, block count
+#   index   one BLOCK entry per block: first id, lowest and highest timestamps
+#           (microseconds since the epoch), reading count, then the offset and
+#           length of the chunk of each column
+#   chunks  each column of each block compressed on its own, so a scan of one
+#           signal over a time range only decompresses that signal's chunks
+# Chunk contents, before compression:
+#   id, timestamp    int64 deltas, the first one from 0
+#   speed, rpm,      int32 deltas of the values quantized to 1/scale, NULL_DELTA
+#   coolant_temp     for NULL (which leaves the running value unchanged)
+#   fuel_status, dtc <I length and JSON list of the distinct values, then uint16
+#                    indexes (NULL_INDEX for NULL)
+MAGIC = b"OBDA"
+VERSION = 3
+HEADER = struct.Struct("<4sBBBII")
+# Timestamps never decrease, so time ranges are found by bisection. The clock
+# may be set back while recording (e.g. synced once the network is up), and
+# then every timestamp is compared instead.
+SORTED = 0x01
+LENGTH = struct.Struct("<I")
+NULL_INDEX = 0xFFFF
+NULL_DELTA = -2 ** 31
+
+# Columns of an archive, in reading row order
+COLUMNS = ("id", "timestamp", "speed", "rpm", "fuel_status", "coolant_temp", "dtc")
+BLOCK = struct.Struct("<qqqI" + "QI" * len(COLUMNS))
+# Quantization steps of the numeric columns, finer than their OBD encodings
+# (speed and coolant temperature are whole units, rpm quarters)
+SCALES = {"speed": 100, "rpm": 4, "coolant_temp": 100}
+STRINGS = ("fuel_status", "dtc")
+
+ZLIB = 0
+LZMA = 1
+CODECS = {"zlib": ZLIB, "lzma": LZMA}
+# Raw LZMA streams, so small chunks don't pay for the container headers
+LZMA_FILTERS = [{"id": lzma.FILTER_LZMA2, "preset": 6}]
+
+# Timestamps are stored as local time, and archived as microseconds since the Unix epoch
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+
+# Archive levels of a session, from the most to the least detailed
+ARCHIVED = "archived"
+DOWNSAMPLED = "downsampled"
+
+
+def create_archive_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS session_archives (
+            session_id INTEGER PRIMARY KEY,
+            level TEXT,
+            readings INTEGER,
+            archived_at TIMESTAMP,
+            path TEXT,
+            size INTEGER,
+            FOREIGN KEY (session_id) REFERENCES sessions (id)
+        )
+    ''')
+
+
+def archive_path(db_path, path):
+    """Absolute location of an archive file, stored relative to the database"""
+    return os.path.join(os.path.dirname(db_path), path)
+
+
+def _to_microseconds(timestamp):
+    if isinstance(timestamp, str):
+        timestamp = datetime.datetime.fromisoformat(timestamp)
+    return (timestamp.astimezone(datetime.timezone.utc) - EPOCH) // ONE_MICROSECOND
+
+
+def _from_microseconds(microseconds):
+    """Stored timestamp text of archived microseconds"""
+    return str((EPOCH + microseconds * ONE_MICROSECOND).astimezone().replace(tzinfo=None))
+
+
+def _little_endian(values):
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _read_array(typecode, data):
+    values = array.array(typecode)
+    values.frombytes(data)
+    return _little_endian(values)
+
+
+def _encode_integers(values):
+    return _little_endian(array.array("q", (value - previous for previous, value in zip([0] + values[:-1], values)))).tobytes()
+
+
+def _decode_integers(data):
+    return list(itertools.accumulate(_read_array("q", data)))
+
+
+def _encode_quantized(values, scale):
+    deltas = array.array("i")
+    previous = 0
+    for value in values:
+        if value is None:
+            deltas.append(NULL_DELTA)
+            continue
+        quantized = round(value * scale)
+        deltas.append(quantized - previous)
+        previous = quantized
+    return _little_endian(deltas).tobytes()
+
+
+def _decode_quantized(data, scale):
+    deltas = _read_array("i", data)
+    totals = itertools.accumulate(0 if delta == NULL_DELTA else delta for delta in deltas)
+    return [None if delta == NULL_DELTA else total / scale for delta, total in zip(deltas, totals)]
+
+
+def _encode_strings(values):
+    distinct = sorted({value for value in values if value is not None})
+    index = {value: i for i, value in enumerate(distinct)}
+    indexes = array.array("H", (NULL_INDEX if value is None else index[value] for value in values))
+    encoded = json.dumps(distinct).encode("utf-8")
+    return LENGTH.pack(len(encoded)) + encoded + _little_endian(indexes).tobytes()
+
+
+def _decode_strings(data):
+    (length,) = LENGTH.unpack_from(data, 0)
+    distinct = json.loads(bytes(data[LENGTH.size:LENGTH.size + length]))
+    return [None if i == NULL_INDEX else distinct[i] for i in _read_array("H", data[LENGTH.size + length:])]
+
+
+def _compress(data, codec):
+    if codec == LZMA:
+        return lzma.compress(data, format=lzma.FORMAT_RAW, filters=LZMA_FILTERS)
+    return zlib.compress(data, 6)
+
+
+def _decompress(data, codec):
+    if codec == LZMA:
+        return lzma.decompress(data, format=lzma.FORMAT_RAW, filters=LZMA_FILTERS)
+    return zlib.decompress(data)
+
+
+def encode_archive(rows, codec="zlib", block_rows=1024):
+    """Pack (id, timestamp, speed, rpm, fuel_status, coolant_temp, dtc) rows, in id order, into archive bytes"""
+    codec = CODECS[codec]
+    entries = []
+    chunks = []
+    offset = HEADER.size + BLOCK.size * -(-len(rows) // block_rows)
+    flags = SORTED
+    previous = None
+    for first in range(0, len(rows), block_rows):
+        columns = dict(zip(COLUMNS, (list(column) for column in zip(*rows[first:first + block_rows]))))
+        columns["timestamp"] = [_to_microseconds(timestamp) for timestamp in columns["timestamp"]]
+        spans = []
+        for name in COLUMNS:
+            if name in SCALES:
+                data = _encode_quantized(columns[name], SCALES[name])
+            elif name in STRINGS:
+                data = _encode_strings(columns[name])
+            else:
+                data = _encode_integers(columns[name])
+            chunk = _compress(data, codec)
+            chunks.append(chunk)
+            spans += [offset, len(chunk)]
+            offset += len(chunk)
+        timestamps = columns["timestamp"]
+        if previous is not None and timestamps[0] < previous or any(a > b for a, b in zip(timestamps, timestamps[1:])):
+            flags &= ~SORTED
+        previous = timestamps[-1]
+        entries.append(BLOCK.pack(columns["id"][0], min(timestamps), max(timestamps), len(timestamps), *spans))
+    return HEADER.pack(MAGIC, VERSION, codec, flags, len(rows), len(entries)) + b"".join(entries) + b"".join(chunks)
+
+
+class SessionArchive:
+    """Read access to the archive of one session, decoding only the blocks and columns asked for.
+
+    The file is memory-mapped, so opening an archive only reads its block
+    index, and a range query only touches the pages of the chunks it needs.
+    source may also be the archive bytes themselves.
+    """
+
+    def __init__(self, source):
+        self.file = None
+        if isinstance(source, (bytes, bytearray)):
+            self.buffer = source
+        else:
+            self.file = open(source, "rb")
+            try:
+                self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                self.file.close()
+                raise
+        magic, version, self.codec, flags, self.readings, count = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"Unsupported archive (magic {magic!r}, version {version})")
+        self.sorted = bool(flags & SORTED)
+        self.blocks = [BLOCK.unpack_from(self.buffer, HEADER.size + i * BLOCK.size) for i in range(count)]
+        self.first_ids = [block[0] for block in self.blocks]
+        self.min_timestamps = [block[1] for block in self.blocks]
+        self.max_timestamps = [block[2] for block in self.blocks]
+
+    def __len__(self):
+        return self.readings
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.file is not None:
+            self.buffer.close()
+            self.file.close()
+            self.file = None
+
+    @property
+    def start(self):
+        """Epoch seconds of the first reading, None if the archive is empty"""
+        return min(self.min_timestamps) / 1e6 if self.blocks else None
+
+    @property
+    def end(self):
+        return max(self.max_timestamps) / 1e6 if self.blocks else None
+
+    def _column(self, block, name):
+        i = COLUMNS.index(name)
+        offset, length = block[4 + 2 * i], block[5 + 2 * i]
+        data = _decompress(self.buffer[offset:offset + length], self.codec)
+        if name in SCALES:
+            return _decode_quantized(data, SCALES[name])
+        if name in STRINGS:
+            return _decode_strings(data)
+        return _decode_integers(data)
+
+    def iter_columns(self, names, start=None, end=None, after_id=0):
+        """Yield, block by block, the columns names of the readings within start..end (epoch seconds) above after_id.
+
+        Timestamps are given in epoch seconds. Blocks entirely outside the
+        range are skipped using the index, without being decompressed.
+        """
+        low_bound = None if start is None else start * 1e6
+        high_bound = None if end is None else end * 1e6
+        first = max(0, bisect.bisect_right(self.first_ids, after_id) - 1)
+        if self.sorted:
+            if low_bound is not None:
+                first = max(first, bisect.bisect_left(self.max_timestamps, low_bound))
+            last = len(self.blocks) if high_bound is None else bisect.bisect_right(self.min_timestamps, high_bound)
+            blocks = self.blocks[first:last]
+        else:
+            blocks = [
+                block for block in self.blocks[first:]
+                if (low_bound is None or block[2] >= low_bound) and (high_bound is None or block[1] <= high_bound)
+            ]
+        needed = set(names) | {"id", "timestamp"}
+        for block in blocks:
+            columns = {name: self._column(block, name) for name in COLUMNS if name in needed}
+            timestamps = columns["timestamp"]
+            low = bisect.bisect_right(columns["id"], after_id)
+            if not self.sorted:
+                kept = [
+                    i for i in range(low, len(timestamps))
+                    if (low_bound is None or timestamps[i] >= low_bound) and (high_bound is None or timestamps[i] <= high_bound)
+                ]
+                if kept:
+                    yield [[timestamps[i] / 1e6 for i in kept] if name == "timestamp" else [columns[name][i] for i in kept] for name in names]
+                continue
+            # Ids and timestamps are increasing, so the range is a slice of the block
+            if low_bound is not None:
+                low = max(low, bisect.bisect_left(timestamps, low_bound))
+            high = len(timestamps) if high_bound is None else bisect.bisect_right(timestamps, high_bound)
+            if low >= high:
+                continue
+            columns["timestamp"] = [timestamp / 1e6 for timestamp in timestamps[low:high]]
+            yield [columns[name] if name == "timestamp" else columns[name][low:high] for name in names]
+
+    def select(self, names, start=None, end=None, after_id=0):
+        """Columns names of the readings within start..end above after_id, as lists"""
+        selected = [[] for _ in names]
+        for columns in self.iter_columns(names, start, end, after_id):
+            for values, column in zip(selected, columns):
+                values.extend(column)
+        return selected
+
+    def iter_rows(self, after_id=0):
+        """Yield the (id, timestamp, speed, rpm, fuel_status, coolant_temp, dtc) rows above after_id, as stored before archiving"""
+        first = max(0, bisect.bisect_right(self.first_ids, after_id) - 1)
+        for block in self.blocks[first:]:
+            columns = [self._column(block, name) for name in COLUMNS]
+            # Ids are increasing, and timestamps only converted for the rows actually read
+            skip = bisect.bisect_right(columns[0], after_id)
+            for row in zip(*(column[skip:] for column in columns)):
+                yield (row[0], _from_microseconds(row[1])) + row[2:]
+
+
+def archive_session(connection, session_id, db_path):
+    """Move the readings of a session into its archive file, committing on connection.
+
+    The file is written first, then recorded and the readings deleted in one
+    transaction, so a failure in between leaves the readings where they were.
+    Returns (readings archived, file size), None if the session is already archived.
+    """
+    if connection.execute('SELECT 1 FROM session_archives WHERE session_id = ?', (session_id,)).fetchone():
+        return None
+    rows = connection.execute('''
+        SELECT id, timestamp, speed, rpm, fuel_status, coolant_temp, dtc
+        FROM readings WHERE session_id = ? ORDER BY id
+    ''', (session_id,)).fetchall()
+
+    data = encode_archive(rows, config.get_archive_codec(), config.get_archive_block_rows())
+    path = os.path.join(config.get_archive_directory(), f"session_{session_id}.obda")
+    location = archive_path(db_path, path)
+    os.makedirs(os.path.dirname(location) or ".", exist_ok=True)
+    temporary = f"{location}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as output:
+        output.write(data)
+        output.flush()
+        os.fsync(output.fileno())
+    os.replace(temporary, location)
+
+    with connection:
+        connection.execute('''
+            INSERT INTO session_archives (session_id, level, readings, archived_at, path, size)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (session_id, ARCHIVED, len(rows), datetime.datetime.now(), path, len(data)))
+        connection.execute('DELETE FROM readings WHERE session_id = ?', (session_id,))
+    return len(rows), len(data)
+
+
+def archive_location(connection, session_id, db_path):
+    """Location of the archive file of a session, None if it has none"""
+    row = connection.execute('SELECT path FROM session_archives WHERE session_id = ?', (session_id,)).fetchone()
+    return archive_path(db_path, row[0]) if row and row[0] else None
+
+
+def open_archive(connection, db_path, session_id):
+    """SessionArchive of a session, None if the session isn't archived with its readings"""
+    row = connection.execute('''
+        SELECT path FROM session_archives WHERE session_id = ? AND level = ?
+    ''', (session_id, ARCHIVED)).fetchone()
+    return SessionArchive(archive_path(db_path, row[0])) if row else None
+
+
+@contextlib.contextmanager
+def opened_archive(connection, db_path, session_id):
+    """Context manager around open_archive, closing the archive on exit"""
+    archive = open_archive(connection, db_path, session_id)
+    try:
+        yield archive
+    finally:
+        if archive is not None:
+            archive.close()
@@ -4,9 +4,13 @@ from enum import Enum
 from typing import Any, Union
 import sys
 from ..API.OBDManager import OBDManager 
-from ..UTILS.logger import Logger
+from .BinaryProtocol import BinaryEncoder, is_encodable
+from .RequestDispatcher import RequestDispatcher, DATABASE, OBD, SERVER_IDS, is_client_request_id
+from ..UTILS.logger import Logger, parse_level
 from ..UTILS.config import config_instance as config
+from ..UTILS.metrics import metrics_instance as metrics
 import threading
+import time
 from bless import (  # type: ignore
     BlessServer,
     BlessGATTCharacteristic,
@@ -15,9 +19,12 @@ from bless import (  # type: ignore
 )
 import json
 import logging
-logging.getLogger('bless').setLevel(logging.DEBUG)
+logging.getLogger('bless').setLevel(parse_level(config.get_bless_log_level(), logging.WARNING))
 logger = Logger("Bluetooth Server")
 
+# Largest value a BLE characteristic can hold
+MAX_RESPONSE_SIZE = 512
+
 # NOTE: Some systems require different synchronization methods.
 trigger: Union[asyncio.Event, threading.Event]
 if sys.platform in ["darwin", "win32"]:
@@ -34,23 +41,112 @@ class Request(Enum):
     GET_THROTTLE_POSITION = "get_throttle_position"
     GET_DTC = "get_dtc"
     GET_CURRENT_DRIVING_SESSION = "get_current_driving_session"
+    SUBSCRIBE = "subscribe"
+    UNSUBSCRIBE = "unsubscribe"
+    SET_FORMAT = "set_format"
+    GET_RECENT = "get_recent"
+    GET_HISTORY = "get_history"
+    GET_RANGE_AGGREGATES = "get_range_aggregates"
+    GET_FAULT_HISTORY = "get_fault_history"
+    GET_TRIP_METRICS = "get_trip_metrics"
+    METRICS = "metrics"
+    QUERY = "query"
+
+
+# Requests answered from the adapter, refused while OBD isn't connected
+OBD_REQUESTS = {
+	Request.GET_SPEED.value,
+	Request.GET_RPM.value,
+	Request.GET_COOLANT_TEMP.value,
+	Request.GET_THROTTLE_POSITION.value,
+	Request.GET_DTC.value,
+	Request.SUBSCRIBE.value,
+	Request.GET_RECENT.value,
+	Request.QUERY.value,
+}
+
+# Requests that don't answer from memory, with the worker pool they run on
+DISPATCHED_REQUESTS = {
+	Request.GET_CURRENT_DRIVING_SESSION.value: DATABASE,
+	Request.GET_HISTORY.value: DATABASE,
+	Request.GET_RANGE_AGGREGATES.value: DATABASE,
+	Request.GET_FAULT_HISTORY.value: DATABASE,
+	Request.GET_TRIP_METRICS.value: DATABASE,
+	Request.QUERY.value: OBD,
+}
+
+
+def parse_request(raw: str):
+	"""Split a request into its name and parameters.
+
+	Plain requests are just the request name, e.g. 'get_speed'. Requests that take
+	parameters are JSON objects, e.g. {"request": "subscribe", "pids": ["RPM"]}.
+	"""
+	raw = raw.strip()
+	if not raw.startswith("{"):
+		return raw, {}
+	params = json.loads(raw)
+	return str(params.pop("request", "")), params
+
+
+class Subscription:
+	"""Set of commands pushed to the client through indications"""
+	MAX_RATE = 20.0
+
+	def __init__(self, pids, max_rate: float = 1.0, deadband: float = 0.0):
+		self.pids = list(pids)
+		self.period = 1.0 / min(max(float(max_rate), 0.01), self.MAX_RATE)
+		self.deadband = abs(float(deadband))
+		self.last_seq = {}
+		self.last_value = {}
 
+	def changed_values(self, obd_manager):
+		"""Collect the values that changed by more than the deadband since the last push"""
+		changes = {}
+		for pid in self.pids:
+			value, age, seq = obd_manager.read_snapshot(pid)
+			if seq is None or seq == self.last_seq.get(pid):
+				continue
+			self.last_seq[pid] = seq
+			previous = self.last_value.get(pid)
+			if pid in self.last_value:
+				if isinstance(value, float) and isinstance(previous, float):
+					if abs(value - previous) <= self.deadband:
+						continue
+				elif value == previous:
+					continue
+			self.last_value[pid] = value
+			changes[pid] = {"value": value, "age": round(age, 3)}
+		return changes
 
 
 class BluetoothServer:
 
-	def __init__(self):
+	def __init__(self, start: bool = True):
 		self.server_name = config.get_bluetooth_server_name()
 		self.service_uuid = config.get_bluetooth_service_uuid()
 		self.char_uuid = config.get_bluetooth_char_uuid()
 		
 		self.server = None
+		self.loop = None
+		self.sample_event = None
+		self.stopping = None
 		self.running = False
+		self.subscription = None
+		# None while the client uses JSON, a BinaryEncoder once it negotiated binary frames
+		self.encoder = None
+		# Set once the server advertises, or once it gave up starting
+		self.started = threading.Event()
+		# Id of the request being handled by the current thread, echoed in its response
+		self.context = threading.local()
+		self.dispatcher = RequestDispatcher(self.handle_request, self.respond, config.get_bluetooth_request_workers())
 		
-		# Start daemon thread
-		self.thread = threading.Thread(target=self._run_daemon)
-		self.thread.daemon = True
-		self.thread.start()
+		# Start daemon thread (without it, requests can still be handled directly, e.g. by benchmarks)
+		self.thread = None
+		if start:
+			self.thread = threading.Thread(target=self._run_daemon)
+			self.thread.daemon = True
+			self.thread.start()
 
 	def _run_daemon(self):
 		"""Run the BLE server in daemon thread"""
@@ -62,11 +158,21 @@ class BluetoothServer:
 		except Exception as e:
 			logger.error(f"Daemon error: {e}")
 		finally:
+			self.running = False
+			self.started.set()
 			loop.close()
+
+	def wait_until_running(self, timeout: float = None) -> bool:
+		"""Wait for the server to advertise, returning False if it failed to start"""
+		self.started.wait(timeout)
+		return self.running
 	
 
 	async def run(self, loop):
 		# Instantiate the server
+		self.loop = loop
+		self.sample_event = asyncio.Event()
+		self.stopping = asyncio.Event()
 		self.server = BlessServer(name=self.server_name, loop=loop)
 		self.server.read_request_func = self.read_request
 		self.server.write_request_func = self.write_request
@@ -97,15 +203,72 @@ class BluetoothServer:
 		logger.debug(f"💡 Write '0xF' to the advertised characteristic to stop server")
 
 		self.running = True
+		self.started.set()
+		publisher = loop.create_task(self._publish_subscription())
 		# Keep server running until stopped
+		await self.stopping.wait()
+		publisher.cancel()
+
+	async def _publish_subscription(self):
+		"""Push changed values of the subscribed commands through indications"""
 		while self.running:
-			logger.debug("🔄 BLE Server running...")
-			await asyncio.sleep(1)
-		
+			subscription = self.subscription
+			# Wake up on every new pipeline sample, or at the subscription rate at the latest
+			try:
+				await asyncio.wait_for(self.sample_event.wait(), subscription.period if subscription else 1.0)
+			except asyncio.TimeoutError:
+				pass
+			self.sample_event.clear()
+			if subscription is None:
+				continue
+			obd_manager = OBDManager.get_instance()
+			if obd_manager is None or obd_manager.obd_connection is None:
+				continue
+			try:
+				changes = subscription.changed_values(obd_manager)
+				if changes and self.encoder:
+					binary = {pid: (change["value"], change["age"]) for pid, change in changes.items() if is_encodable(pid)}
+					if binary:
+						self.push(self.encoder.encode_values(binary))
+					changes = {pid: change for pid, change in changes.items() if pid not in binary}
+				if changes:
+					self.push(self.generate_response(True, changes, "Subscription update."))
+			except Exception as e:
+				logger.error(f"📣 Failed to publish subscription: {e}")
+			# Never push faster than the subscription's maximum rate
+			await asyncio.sleep(subscription.period)
+
+	def publish(self, sample: dict):
+		"""Notify the BLE loop that a new sample is available (callable from any thread)"""
+		if self.loop is not None and self.sample_event is not None:
+			self.loop.call_soon_threadsafe(self.sample_event.set)
+
+	def push(self, response: Union[str, bytes]):
+		"""Set the characteristic value and indicate it to subscribed clients"""
+		characteristic = self.server.get_characteristic(self.char_uuid)
+		characteristic.value = response.encode('utf-8') if isinstance(response, str) else response
+		self.server.update_value(self.service_uuid, self.char_uuid)
 
 
+	def fit_response(self, response: Union[str, bytes]) -> bytes:
+		"""Encode a response, replacing it with an error if it doesn't fit in the characteristic"""
+		if isinstance(response, str):
+			response = response.encode('utf-8')
+		# Ensure the response size is within BLE characteristic limits (512 bytes).
+		# A truncated response would be invalid JSON, so answer with an error instead.
+		if len(response) > MAX_RESPONSE_SIZE:
+			logger.error(f"Response size exceeds BLE characteristic limit ({MAX_RESPONSE_SIZE} bytes).")
+			response = self.generate_response(False, {}, "Response too large, use a paginated request.").encode('utf-8')
+		return response
+
+	def respond(self, request_id: int, response: Union[str, bytes]):
+		"""Indicate the response of a dispatched request (called from its worker thread)"""
+		response = self.fit_response(response)
+		if self.loop is not None and self.running:
+			self.loop.call_soon_threadsafe(self.push, response)
+
 	def write_request(self, characteristic: BlessGATTCharacteristic, value: Any, **kwargs):
-		logger.debug(f"✍️ BLE WRITE REQUEST received: {value}")
+		logger.debug("✍️ BLE WRITE REQUEST received: %s", value)
 		response = None
 		try:
 			# Handle both bytes and bytearray
@@ -113,24 +276,33 @@ class BluetoothServer:
 				decoded_value = value.decode('utf-8')
 			else:
 				decoded_value = str(value)
-			logger.debug(f"✍️ Decoded request: '{decoded_value}'")
-
-			# Handle the request and generate a response
-			response = self.handle_request(decoded_value)
+			logger.debug("✍️ Decoded request: '%s'", decoded_value)
 
-			# Ensure the response size is within BLE characteristic limits (512 bytes)
-			if len(response.encode('utf-8')) > 512:
-				logger.error("Response size exceeds BLE characteristic limit (512 bytes). Truncating response.")
-				response = response[:512]  # Truncate response to fit the limit
+			request_name, params = parse_request(decoded_value)
+			pool = DISPATCHED_REQUESTS.get(request_name)
+			request_id = params.get("id")
+			if request_id is not None and not is_client_request_id(request_id):
+				response = self.generate_response(False, {}, f"Invalid request id, expected an integer from 0 to {SERVER_IDS - 1}.")
+			elif pool is not None:
+				# Slow requests are answered later through an indication; the write only
+				# acknowledges the id the response will carry
+				if request_id is None:
+					request_id = self.dispatcher.next_request_id()
+				self.dispatcher.submit(pool, decoded_value, request_id)
+				response = self.generate_response(True, {"id": request_id, "pending": True}, "Request queued.")
+			else:
+				# Handle the request and generate a response
+				response = self.handle_request(decoded_value, request_id)
+			response = self.fit_response(response)
 
 		except Exception as e:
 			logger.error(f"✍️ Failed to decode request: {e}")
-			response = self.generate_response(False, {}, "Failed to decode request")
+			response = self.generate_response(False, {}, "Failed to decode request").encode('utf-8')
 
-		# Encode the response string to bytes for BLE characteristic
+		# Store the encoded response in the BLE characteristic
 		try:
-			characteristic.value = response.encode('utf-8')
-			logger.debug(f"✍️ Characteristic value updated to: {characteristic.value}")
+			characteristic.value = response
+			logger.debug("✍️ Characteristic value updated to: %s", characteristic.value)
 		except Exception as e:
 			logger.error(f"✍️ Failed to update characteristic value: {e}")
 
@@ -139,71 +311,261 @@ class BluetoothServer:
 		logger.debug("📖 BLE READ REQUEST received from client")
 
 		try:
-			# Ensure the characteristic value is a bytearray or bytes
-			if isinstance(characteristic.value, (bytes, bytearray)):
-				decoded_response = characteristic.value.decode('utf-8')
-			else:
-				decoded_response = str(characteristic.value)
-			logger.debug(f"📤 SENDING RESPONSE to client: '{decoded_response}'")
+			# Only decode the value when it is going to be logged (binary frames aren't UTF-8)
+			if logger.is_enabled(logging.DEBUG):
+				if isinstance(characteristic.value, (bytes, bytearray)):
+					decoded_response = characteristic.value.decode('utf-8', errors='replace')
+				else:
+					decoded_response = str(characteristic.value)
+				logger.debug("📤 SENDING RESPONSE to client: '%s'", decoded_response)
 			return characteristic.value
 		except Exception as e:
 			logger.error(f"📤 Failed to decode characteristic value: {e}")
 			return bytearray()
 
 
-	def generate_response(self, success: bool, data: Any, message: str = None) -> Any:
-		return json.dumps({
+	def generate_response(self, success: bool, data: Any, message: str = None, age: float = None) -> Any:
+		response = {
 			"status": "1" if success else "0",
 			"data": data,
 			"message": message if message else "No message specified",
-		}, separators=(',', ':'))
+		}
+		if age is not None:
+			response["age"] = round(age, 3)
+		request_id = getattr(self.context, "request_id", None)
+		if request_id is not None:
+			response["id"] = request_id
+		return json.dumps(response, separators=(',', ':'))
 
-	def handle_request(self, request: str) -> Any:
+	def generate_value_response(self, command_name: str, value: Any, message: str, age: float = None) -> Union[str, bytes]:
+		"""Answer with a binary values frame if negotiated, JSON otherwise"""
+		encoder = self.encoder
+		if encoder and is_encodable(command_name):
+			return encoder.encode_values({command_name: (value, age)}, getattr(self.context, "request_id", None))
+		return self.generate_response(True, str(value), message, age)
+
+	def generate_paged_response(self, header: dict, rows, message: str, key: str = "readings", cursor_of=lambda row: row[0]) -> str:
+		"""Pack as many rows as fit in one characteristic value.
+
+		The frame data holds the header fields, the rows under key, and "next",
+		the continuation token to send back as "cursor" to get the following
+		frame (null once every row has been sent). A row too large for any
+		frame is left out and its cursor listed under "skipped", so the
+		pagination always moves forward.
+		"""
+		empty = self.generate_response(True, {**header, "next": None, key: []}, message)
+		# Leave room for the continuation token replacing null
+		base_size = len(empty.encode('utf-8')) + 20
+		size = base_size
+		items = []
+		skipped = []
+		last_cursor = None
+		next_cursor = None
+		try:
+			for row in rows:
+				encoded = json.dumps(list(row), separators=(',', ':'))
+				row_size = len(encoded.encode('utf-8')) + (1 if items else 0)
+				if base_size + len(encoded.encode('utf-8')) > MAX_RESPONSE_SIZE:
+					# Room for ',"skipped":[]' the first time, then the cursor and a comma
+					cursor_size = len(json.dumps(cursor_of(row), separators=(',', ':'))) + (1 if skipped else 13)
+					if size + cursor_size > MAX_RESPONSE_SIZE:
+						next_cursor = last_cursor
+						break
+					logger.warning(f"Row {cursor_of(row)} doesn't fit in a frame, skipping it")
+					skipped.append(cursor_of(row))
+					size += cursor_size
+					last_cursor = cursor_of(row)
+					continue
+				if size + row_size > MAX_RESPONSE_SIZE:
+					next_cursor = last_cursor
+					break
+				items.append(row)
+				size += row_size
+				last_cursor = cursor_of(row)
+		finally:
+			if hasattr(rows, "close"):
+				rows.close()
+		data = {**header, "next": next_cursor, key: [list(row) for row in items]}
+		if skipped:
+			data["skipped"] = skipped
+		return self.generate_response(True, data, message)
+
+	def handle_request(self, request: str, request_id: int = None) -> Any:
+		"""Build the response to a request, carrying request_id if given (thread safe)"""
+		started = time.perf_counter()
+		self.context.request_id = request_id
 		try:
 				
-			print("Handling request:", str(request))
+			logger.debug("Handling request: %s", request)
 			response = None  # Initialize the response object
+			# Never connects: reconnecting is left to the startup retries and the supervisor
+			obd_manager = OBDManager.get_instance()
+			connected = obd_manager is not None and obd_manager.obd_connection is not None
+			encoder = self.encoder
 
-			match str(request):
+			request_name, params = parse_request(str(request))
+
+			match request_name:
+				case name if name in OBD_REQUESTS and not connected:
+					response = self.generate_response(False, {}, "OBD not connected.")
 				case Request.HEALTHCHECK.value:
-					response = self.generate_response(True, {}, "Server is healthy !")
+					link = obd_manager.supervisor.state.value if connected and obd_manager.supervisor else None
+					response = self.generate_response(True, {"obd": link}, "Server is healthy !")
 				case Request.GET_SPEED.value:
-					speed_data = str(OBDManager().get_speed())
-					response = self.generate_response(True, speed_data, "Fetched current speed.")
+					speed_data = obd_manager.get_speed()
+					response = self.generate_value_response("SPEED", speed_data, "Fetched current speed.", obd_manager.get_age("SPEED"))
 				case Request.GET_RPM.value:
-					rpm_data = str(OBDManager().get_rpm())
-					response = self.generate_response(True, rpm_data, "Fetched current RPM.")
+					rpm_data = obd_manager.get_rpm()
+					response = self.generate_value_response("RPM", rpm_data, "Fetched current RPM.", obd_manager.get_age("RPM"))
 				case Request.GET_COOLANT_TEMP.value:
-					coolant_temp_data = str(OBDManager().get_coolant_temp())
-					response = self.generate_response(True, coolant_temp_data, "Fetched current coolant temperature.")
+					coolant_temp_data = obd_manager.get_coolant_temp()
+					response = self.generate_value_response("COOLANT_TEMP", coolant_temp_data, "Fetched current coolant temperature.", obd_manager.get_age("COOLANT_TEMP"))
 				case Request.GET_THROTTLE_POSITION.value:
-					throttle_position_data = str(OBDManager().get_throttle_pos())
-					response = self.generate_response(True, throttle_position_data, "Fetched current throttle position.")
+					throttle_position_data = obd_manager.get_throttle_pos()
+					response = self.generate_value_response("THROTTLE_POS", throttle_position_data, "Fetched current throttle position.", obd_manager.get_age("THROTTLE_POS"))
 				case Request.GET_DTC.value:
-					dtc_data = str(OBDManager().get_dtc())
-					response = self.generate_response(True, dtc_data, "Fetched current DTC.")
+					dtc_data = obd_manager.get_dtc()
+					if dtc_data is None:
+						response = self.generate_response(False, {}, "No DTC reading yet.")
+					else:
+						response = self.generate_response(True, dtc_data, "Fetched current DTC.", obd_manager.get_age("GET_DTC"))
 				case Request.GET_CURRENT_DRIVING_SESSION.value:
 					from .DBManager import DatabaseManager
 					db_instance = DatabaseManager.get_instance()
-					if db_instance.session_id is None:
+					session_id = params.get("session_id", db_instance.session_id)
+					if session_id is None:
 						response = self.generate_response(False, {}, "No active driving session.")
 					else:
-						session_readings = db_instance.fetch_current_session()
-						session_data = {
-							"session_id": db_instance.session_id,
-							"readings": session_readings
+						# Readings are [id, timestamp, speed, rpm, fuel_status, coolant_temp, dtc]
+						session_readings = db_instance.iter_session_readings(session_id, after_id=params.get("cursor", 0))
+						if encoder:
+							response = encoder.encode_readings(session_readings, MAX_RESPONSE_SIZE, request_id)
+						else:
+							header = {"session_id": session_id, "seq": params.get("seq", 0)}
+							response = self.generate_paged_response(header, session_readings, "Fetched current driving session.")
+				case Request.SUBSCRIBE.value:
+					pids = params.get("pids") or []
+					unknown = [pid for pid in pids if pid not in obd_manager.watched_commands()]
+					if not pids or unknown:
+						response = self.generate_response(False, {"unknown": unknown}, "Subscription needs a list of watched PIDs.")
+					else:
+						self.subscription = Subscription(pids, params.get("max_rate", 1.0), params.get("deadband", 0.0))
+						response = self.generate_response(True, {"pids": pids}, "Subscribed.")
+				case Request.UNSUBSCRIBE.value:
+					self.subscription = None
+					response = self.generate_response(True, {}, "Unsubscribed.")
+				case Request.GET_RECENT.value:
+					# {"request": "get_recent", "pid": "RPM", "seconds": 60, "cursor": <last timestamp received>}
+					pid = params.get("pid")
+					if pid not in obd_manager.history.buffers:
+						response = self.generate_response(False, {}, f"No history kept for {pid}.")
+					else:
+						seconds = min(float(params.get("seconds", 60)), obd_manager.history.window_seconds)
+						samples = (
+							(round(timestamp, 3), round(value, 3))
+							for timestamp, value in obd_manager.history.iter_samples(pid, seconds, after=params.get("cursor"))
+						)
+						header = {"pid": pid, "stats": obd_manager.history.stats(pid, seconds)}
+						response = self.generate_paged_response(header, samples, "Fetched recent samples.", key="samples")
+				case Request.GET_HISTORY.value:
+					# {"request": "get_history", "session_id": 3, "signal": "rpm", "start": <epoch>, "end": <epoch>, "points": 300, "cursor": <last bucket received>}
+					from .DBManager import DatabaseManager
+					db_instance = DatabaseManager.get_instance()
+					session_id = params.get("session_id", db_instance.session_id)
+					resolution, history = db_instance.fetch_history(
+						session_id, params.get("signal"), params.get("start"), params.get("end"), int(params.get("points", 500))
+					)
+					# Rows are [bucket, min, max, avg, count]
+					cursor = params.get("cursor")
+					rows = (
+						[row[0], round(row[1], 3), round(row[2], 3), round(row[3], 3), row[4]]
+						for row in history if cursor is None or row[0] > cursor
+					)
+					header = {"session_id": session_id, "signal": params.get("signal"), "resolution": resolution}
+					response = self.generate_paged_response(header, rows, "Fetched history.", key="buckets")
+				case Request.GET_RANGE_AGGREGATES.value:
+					# {"request": "get_range_aggregates", "session_id": 3, "start": <epoch>, "end": <epoch>,
+					#  "signals": ["speed", "rpm"], "bucket": 60, "percentiles": [50, 95], "cursor": [<signal>, <bucket>]}
+					from .DBManager import DatabaseManager
+					db_instance = DatabaseManager.get_instance()
+					session_id = params.get("session_id", db_instance.session_id)
+					signals = params.get("signals") or ["speed", "rpm", "coolant_temp"]
+					aggregates = db_instance.fetch_range_aggregates(
+						session_id, signals, params["start"], params["end"], params.get("bucket", 60), params.get("percentiles") or ()
+					)
+					cursor = params.get("cursor")
+					after = (signals.index(cursor[0]), cursor[1]) if cursor else None
+					# Rows are [signal, bucket, min, max, avg, count, [percentiles]]
+					rows = (
+						[signal, start, round(low, 3), round(high, 3), round(average, 3), count, [round(p, 3) for p in values]]
+						for signal, start, low, high, average, count, values in aggregates
+						if after is None or (signals.index(signal), start) > after
+					)
+					header = {"session_id": session_id, "bucket": params.get("bucket", 60), "percentiles": params.get("percentiles") or []}
+					response = self.generate_paged_response(header, rows, "Fetched range aggregates.", key="aggregates", cursor_of=lambda row: row[:2])
+				case Request.GET_FAULT_HISTORY.value:
+					# {"request": "get_fault_history", "code": "P0301", "cursor": <last event id received>}
+					from .DBManager import DatabaseManager
+					# Events are [id, code, description, first_seen, cleared_at], newest first
+					events = DatabaseManager.get_instance().iter_dtc_events(params.get("code"), params.get("cursor"))
+					response = self.generate_paged_response({"code": params.get("code")}, events, "Fetched fault history.", key="events")
+				case Request.GET_TRIP_METRICS.value:
+					# {"request": "get_trip_metrics", "session_id": 3, "fields": ["distance", "idle_time"], "full": false}
+					from .DBManager import DatabaseManager
+					db_instance = DatabaseManager.get_instance()
+					session_id = params.get("session_id", db_instance.session_id)
+					trip_metrics = db_instance.compute_trip_metrics(session_id, incremental=not params.get("full", False))
+					if params.get("fields"):
+						trip_metrics = {field: trip_metrics[field] for field in params["fields"] if field in trip_metrics}
+					response = self.generate_response(True, trip_metrics, "Computed trip metrics.")
+				case Request.SET_FORMAT.value:
+					# {"request": "set_format", "format": "binary", "values": "int16" | "float32", "delta": true}
+					if params.get("format") == "binary":
+						self.encoder = BinaryEncoder(int16=params.get("values", "int16") == "int16", delta=bool(params.get("delta", False)))
+					else:
+						self.encoder = None
+					response = self.generate_response(True, {"format": "binary" if self.encoder else "json"}, "Response format updated.")
+				case Request.METRICS.value:
+					# {"request": "metrics", "prefix": "obd.query", "cursor": <last metric name received>}
+					cursor = params.get("cursor")
+					# Rows are [name, value]
+					rows = (
+						[name, value]
+						for name, value in metrics.snapshot(params.get("prefix", "")).items()
+						if cursor is None or name > cursor
+					)
+					response = self.generate_paged_response({"prefix": params.get("prefix", "")}, rows, "Fetched metrics.", key="metrics")
+				case Request.QUERY.value:
+					# {"request": "query", "commands": ["RPM", "SPEED", "INTAKE_TEMP", "VIN"]}
+					commands = params.get("commands") or []
+					values, unknown, unsupported, unavailable = obd_manager.read_values(commands)
+					if encoder and values and not (unknown or unsupported or unavailable) and all(is_encodable(name) for name in values):
+						response = encoder.encode_values(values, request_id)
+					else:
+						data = {
+							"values": {name: [value, round(age, 3) if age is not None else None] for name, (value, age) in values.items()},
+							"unknown": unknown,
+							"unsupported": unsupported,
+							"unavailable": unavailable,
 						}
-						response = self.generate_response(True, session_data, "Fetched current driving session.")
-			print("Response generated:", response)
+						response = self.generate_response(not (unknown or unsupported or unavailable), data, "Fetched values.")
+			logger.debug("Response generated: %s", response)
+			if response is not None:
+				metrics.observe(f"ble.request.{request_name}", time.perf_counter() - started)
 			return response
 		except Exception as e:
+			metrics.increment("ble.request_errors")
 			logger.error(f"Error handling request '{request}': {e}")
-			response = self.generate_response(False, {}, f"Error processing request: {e}")
-			return "error"
+			return self.generate_response(False, {}, f"Error processing request: {e}")
+		finally:
+			self.context.request_id = None
 
 	def shutdown(self):
 		"""Stop the daemon server"""
 		logger.debug("🛑 Stopping BLE daemon server...")
 		self.running = False
+		self.dispatcher.shutdown()
+		if self.loop is not None and self.stopping is not None:
+			self.loop.call_soon_threadsafe(self.stopping.set)
 
 
@@ -0,0 +1,168 @@
+import struct
+import datetime
+import threading
+
+# Frame layout (little endian):
+#   header  <BBBBI  magic, frame type, flags, item count, sequence number,
+#                   followed by the <I request id with FLAG_REQUEST
+#   VALUES  items   <BhH (int16) or <BfH (float32): pid id, value, age in ms
+#   READINGS        <dI base timestamp and continuation cursor (0 when done),
+#                   then items <Iihhh: id, ms since base (negative when the
+#                   clock went back), speed, rpm, coolant temp, NULL_VALUE
+#                   for a missing value
+MAGIC = 0xB1
+HEADER = struct.Struct("<BBBBI")
+REQUEST_ID = struct.Struct("<I")
+READINGS_HEADER = struct.Struct("<dI")
+INT16_ITEM = struct.Struct("<BhH")
+FLOAT32_ITEM = struct.Struct("<BfH")
+READING_ITEM = struct.Struct("<Iihhh")
+
+TYPE_VALUES = 0x01
+TYPE_READINGS = 0x02
+
+FLAG_INT16 = 0x01
+FLAG_DELTA = 0x02
+# Frame answering a numbered request; never delta encoded, as it may arrive out of order
+FLAG_REQUEST = 0x04
+
+# Commands are identified by their mode 01 PID number, and int16 values are
+# stored as round(value * scale). Non-numeric commands (FUEL_STATUS, GET_DTC)
+# are only available over JSON.
+PID_IDS = {
+    "COOLANT_TEMP": 0x05,
+    "RPM": 0x0C,
+    "SPEED": 0x0D,
+    "THROTTLE_POS": 0x11,
+}
+SCALES = {
+    "COOLANT_TEMP": 100,
+    "RPM": 2,
+    "SPEED": 100,
+    "THROTTLE_POS": 100,
+}
+
+INT16_MIN = -32768
+INT16_MAX = 32767
+# Reserved for missing values, so real values are clamped above it
+NULL_VALUE = INT16_MIN
+INT32_MIN = -2 ** 31
+INT32_MAX = 2 ** 31 - 1
+
+
+def is_encodable(command_name):
+    return command_name in PID_IDS
+
+
+def _scaled(command_name, value):
+    return max(NULL_VALUE + 1, min(INT16_MAX, round(value * SCALES[command_name])))
+
+
+def _scaled_or_null(command_name, value):
+    return NULL_VALUE if value is None else _scaled(command_name, value)
+
+
+def _age_ms(age):
+    return min(int((age or 0.0) * 1000), 0xFFFF)
+
+
+def _epoch(timestamp):
+    if isinstance(timestamp, str):
+        timestamp = datetime.datetime.fromisoformat(timestamp)
+    return timestamp.timestamp()
+
+
+class BinaryEncoder:
+    """Packs values into compact frames for a client that negotiated the binary format.
+
+    Frames are delta encoded against the previous values frame when delta is
+    enabled, with a full key frame every keyframe_interval frames so a client
+    that missed an indication can resynchronize.
+    """
+
+    def __init__(self, int16=True, delta=False, keyframe_interval=20):
+        self.int16 = int16
+        self.delta = delta and int16
+        self.keyframe_interval = keyframe_interval
+        self.seq = 0
+        self.previous = {}
+        self.frames_since_keyframe = 0
+        # Responses to dispatched requests are encoded on worker threads
+        self.lock = threading.Lock()
+
+    def _header(self, frame_type, flags, count, request_id=None):
+        with self.lock:
+            self.seq = (self.seq + 1) & 0xFFFFFFFF
+            seq = self.seq
+        if request_id is None:
+            return HEADER.pack(MAGIC, frame_type, flags, count, seq)
+        return HEADER.pack(MAGIC, frame_type, flags | FLAG_REQUEST, count, seq) + REQUEST_ID.pack(request_id & 0xFFFFFFFF)
+
+    def encode_values(self, values, request_id=None):
+        """Encode a {command name: (value, age)} dict, skipping non-numeric commands"""
+        items = [
+            (name, value, age) for name, (value, age) in values.items()
+            if is_encodable(name) and isinstance(value, (int, float))
+        ]
+        if not self.int16:
+            body = b"".join(FLOAT32_ITEM.pack(PID_IDS[name], value, _age_ms(age)) for name, value, age in items)
+            return self._header(TYPE_VALUES, 0, len(items), request_id) + body
+
+        scaled = {name: _scaled(name, value) for name, value, _ in items}
+        flags = FLAG_INT16
+        if request_id is not None:
+            # Full values, leaving the delta state of the other frames alone
+            body = b"".join(INT16_ITEM.pack(PID_IDS[name], scaled[name], _age_ms(age)) for name, _, age in items)
+            return self._header(TYPE_VALUES, flags, len(items), request_id) + body
+        use_delta = (
+            self.delta
+            and self.frames_since_keyframe < self.keyframe_interval
+            and all(name in self.previous for name in scaled)
+            and all(INT16_MIN <= scaled[name] - self.previous[name] <= INT16_MAX for name in scaled)
+        )
+        if use_delta:
+            flags |= FLAG_DELTA
+            encoded = {name: scaled[name] - self.previous[name] for name in scaled}
+            self.frames_since_keyframe += 1
+        else:
+            encoded = scaled
+            self.frames_since_keyframe = 0
+        self.previous.update(scaled)
+
+        body = b"".join(INT16_ITEM.pack(PID_IDS[name], encoded[name], _age_ms(age)) for name, _, age in items)
+        return self._header(TYPE_VALUES, flags, len(items)) + body
+
+    def encode_readings(self, rows, max_size, request_id=None):
+        """Pack (id, timestamp, speed, rpm, fuel_status, coolant_temp, dtc) rows up to max_size bytes"""
+        header_size = HEADER.size + (REQUEST_ID.size if request_id is not None else 0)
+        capacity = min(255, (max_size - header_size - READINGS_HEADER.size) // READING_ITEM.size)
+        items = []
+        base = None
+        next_cursor = 0
+        try:
+            for row in rows:
+                if len(items) >= capacity:
+                    next_cursor = items[-1][0]
+                    break
+                reading_id, timestamp, speed, rpm, _, coolant_temp, _ = row
+                epoch = _epoch(timestamp)
+                if base is None:
+                    base = epoch
+                offset = max(INT32_MIN, min(INT32_MAX, round((epoch - base) * 1000)))
+                items.append((reading_id, offset, speed, rpm, coolant_temp))
+        finally:
+            if hasattr(rows, "close"):
+                rows.close()
+
+        body = b"".join(
+            READING_ITEM.pack(
+                reading_id,
+                offset,
+                _scaled_or_null("SPEED", speed),
+                _scaled_or_null("RPM", rpm),
+                _scaled_or_null("COOLANT_TEMP", coolant_temp),
+            )
+            for reading_id, offset, speed, rpm, coolant_temp in items
+        )
+        header = self._header(TYPE_READINGS, FLAG_INT16, len(items), request_id)
+        return header + READINGS_HEADER.pack(base or 0.0, next_cursor) + body
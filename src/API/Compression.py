@@ -0,0 +1,171 @@
+import math
+from ..UTILS.config import config_instance as config
+from ..UTILS.logger import Logger
+
+logger = Logger("Compression")
+
+# Outcomes of feeding a value to a column filter
+KEEP_PREVIOUS = "previous"
+KEEP_CURRENT = "current"
+
+# Reading columns and the rule applied to each when none is configured
+DEFAULT_RULES = {
+    "speed": "sdt:0.5",
+    "rpm": "sdt:25",
+    "coolant_temp": "deadband:0.5",
+    "fuel_status": "change",
+}
+
+
+class ChangeFilter:
+    """Keeps a point whenever the value differs from the last archived one"""
+
+    def __init__(self):
+        self.archived = None
+
+    def reset(self, t, value):
+        self.archived = value
+
+    def update(self, t, value):
+        return KEEP_CURRENT if value != self.archived else None
+
+
+class DeadbandFilter(ChangeFilter):
+    """Keeps a point when it moves more than the tolerance away from the last archived value"""
+
+    def __init__(self, tolerance, percent=False):
+        super().__init__()
+        self.tolerance = tolerance
+        self.percent = percent
+
+    def _band(self, reference):
+        return abs(reference) * self.tolerance / 100 if self.percent else self.tolerance
+
+    def update(self, t, value):
+        if value is None or self.archived is None:
+            return super().update(t, value)
+        return KEEP_CURRENT if abs(value - self.archived) > self._band(self.archived) else None
+
+
+class SwingingDoorFilter(DeadbandFilter):
+    """Swinging door trending.
+
+    Two doors pivot on the last archived point, tolerance above and below it,
+    and close in on every new point. A point can end the segment from the
+    pivot as long as the line to it stays between the doors of all the points
+    received since. Once it doesn't, the previous point (which did) is
+    archived and becomes the new pivot.
+    """
+
+    def reset(self, t, value):
+        self.archived = value
+        self.t0 = t
+        self.upper = math.inf
+        self.lower = -math.inf
+
+    def update(self, t, value):
+        if value is None or self.archived is None:
+            return KEEP_CURRENT if value != self.archived else None
+        band = self._band(self.archived)
+        dt = t - self.t0
+        if dt <= 0:
+            return KEEP_CURRENT if abs(value - self.archived) > band else None
+        slope = (value - self.archived) / dt
+        if not self.lower <= slope <= self.upper:
+            return KEEP_PREVIOUS
+        self.upper = min(self.upper, (value + band - self.archived) / dt)
+        self.lower = max(self.lower, (value - band - self.archived) / dt)
+        return None
+
+
+def parse_rule(rule):
+    """Build a filter from a rule such as 'sdt:0.5', 'deadband:2%' or 'change'"""
+    method, _, tolerance = rule.strip().partition(":")
+    if method == "change":
+        return ChangeFilter()
+    percent = tolerance.endswith("%")
+    tolerance = float(tolerance.rstrip("%") or 0)
+    if method == "deadband":
+        return DeadbandFilter(tolerance, percent)
+    if method == "sdt":
+        return SwingingDoorFilter(tolerance, percent)
+    raise ValueError(f"Unknown compression rule: {rule}")
+
+
+class ReadingCompressor:
+    """Drops readings that can be rebuilt within tolerance from the readings kept.
+
+    Rows are fed in order, and add() returns the rows that must be stored. The
+    last row received is held back until the next one shows whether it is
+    needed, and a row is always kept after max_interval seconds as a heartbeat.
+    """
+
+    def __init__(self, filters, max_interval=30.0):
+        self.filters = filters
+        self.max_interval = max_interval
+        self.held = None
+        self.last_archived_t = None
+        self.received = 0
+        self.stored = 0
+
+    @property
+    def ratio(self):
+        """Readings received per reading stored"""
+        return self.received / self.stored if self.stored else 0.0
+
+    def _archive(self, row, kept):
+        timestamp, values = row
+        t = timestamp.timestamp()
+        for column, column_filter in self.filters.items():
+            column_filter.reset(t, values.get(column))
+        self.last_archived_t = t
+        self.stored += 1
+        kept.append(row)
+
+    def add(self, timestamp, values):
+        """Feed a reading ({column: value}) and return the list of (timestamp, values) to store"""
+        t = timestamp.timestamp()
+        row = (timestamp, values)
+        self.received += 1
+        kept = []
+
+        if self.last_archived_t is None:
+            self._archive(row, kept)
+            return kept
+
+        outcomes = {column_filter.update(t, values.get(column)) for column, column_filter in self.filters.items()}
+        if KEEP_PREVIOUS in outcomes and self.held is not None:
+            self._archive(self.held, kept)
+            self.held = None
+            outcomes = {column_filter.update(t, values.get(column)) for column, column_filter in self.filters.items()}
+
+        heartbeat = t - self.last_archived_t >= self.max_interval
+        if KEEP_CURRENT in outcomes or KEEP_PREVIOUS in outcomes or heartbeat:
+            # The rows dropped so far are only rebuilt within tolerance up to the
+            # held row, so it ends the segment before the current row is kept
+            if self.held is not None:
+                self._archive(self.held, kept)
+            self._archive(row, kept)
+            self.held = None
+        else:
+            self.held = row
+        return kept
+
+    def flush(self):
+        """Return the held reading, if any, so the end of the signal is kept"""
+        kept = []
+        if self.held is not None:
+            self._archive(self.held, kept)
+            self.held = None
+        return kept
+
+
+def build_compressor():
+    """Create a ReadingCompressor from the [Compression] config section, or None if disabled"""
+    if not config.get_compression_enabled():
+        return None
+    filters = {
+        column: parse_rule(config.get_compression_rule(column, fallback=rule))
+        for column, rule in DEFAULT_RULES.items()
+    }
+    return ReadingCompressor(filters, max_interval=config.get_compression_max_interval())
@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+import time
+import obd
+from obd import OBDStatus
+from ..UTILS.logger import Logger
+
+logger = Logger("Connection Profile")
+
+
+class ProfileStore:
+    """Last working connection settings of each vehicle, keyed by VIN, kept in a JSON file.
+
+    A profile holds the port, baud rate, protocol and supported commands, so
+    the next connection can skip the baud rate and protocol probing as well as
+    the supported-PID queries.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.profiles = {}
+        self.last_key = None
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as profiles:
+                data = json.load(profiles)
+            self.profiles = data.get("profiles", {})
+            self.last_key = data.get("last")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable connection profiles {self.path}: {e}")
+
+    def last(self):
+        """Profile of the vehicle connected to most recently"""
+        return self.profiles.get(self.last_key)
+
+    def for_port(self, port):
+        """Profile of the vehicle connected to most recently through port"""
+        profiles = [profile for profile in self.profiles.values() if profile.get("port") == port]
+        return max(profiles, key=lambda profile: profile.get("updated_at", 0), default=None)
+
+    def save(self, key, profile):
+        with self.lock:
+            # Pick up the profiles saved by other acquisition processes since loading
+            self._load()
+            self.profiles[key] = {**profile, "updated_at": time.time()}
+            self.last_key = key
+            # Write aside and rename so a power cut never leaves a truncated file
+            # (named per process, as several acquisition processes can share the file)
+            temporary = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with open(temporary, "w") as profiles:
+                    json.dump({"last": key, "profiles": self.profiles}, profiles, indent=1)
+                os.replace(temporary, self.path)
+            except OSError as e:
+                logger.warning(f"Failed to save connection profile: {e}")
+
+
+class ProfiledOBD(obd.OBD):
+    """obd.OBD taking its supported commands from a saved profile instead of the PID bitmaps"""
+
+    def __init__(self, portstr=None, baudrate=None, protocol=None, supported=None, **kwargs):
+        self.cached_supported = supported
+        super().__init__(portstr=portstr, baudrate=baudrate, protocol=protocol, **kwargs)
+
+    def _OBD__load_commands(self):
+        # Overrides the name-mangled obd.OBD.__load_commands called by its constructor
+        if self.cached_supported is None or self.status() != OBDStatus.CAR_CONNECTED:
+            return super()._OBD__load_commands()
+        self.supported_commands.update(
+            obd.commands[name] for name in self.cached_supported if obd.commands.has_name(name)
+        )
+        logger.debug(f"Loaded {len(self.supported_commands)} supported commands from the profile")
+
+    def reload_commands(self):
+        """Query the supported PIDs again, e.g. when another vehicle answered"""
+        self.cached_supported = None
+        super()._OBD__load_commands()
+
+    def baudrate(self):
+        # python-OBD doesn't expose the negotiated baud rate
+        port = getattr(self.interface, "_ELM327__port", None)
+        return port.baudrate if port is not None else None
+
+
+def read_vin(connection):
+    response = connection.query(obd.commands.VIN, force=True)
+    if response.is_null() or not response.value:
+        return None
+    value = response.value
+    if isinstance(value, (bytes, bytearray)):
+        value = bytes(value).decode("ascii", errors="ignore")
+    return str(value).strip("\x00 ") or None
+
+
+def profile_of(connection, vin):
+    return {
+        "vin": vin,
+        "port": connection.port_name(),
+        "baudrate": connection.baudrate(),
+        "protocol": connection.protocol_id(),
+        "supported": sorted(cmd.name for cmd in connection.supported_commands),
+    }
+
+
+def open_connection(store, portstr=None, baudrate=None):
+    """Connect with the last working profile first, falling back to full auto-detection.
+
+    Returns the connection (connected or not). The profile of the vehicle is
+    saved after every successful connection.
+    """
+    profile = store.last() if portstr is None else store.for_port(portstr)
+    if profile:
+        started = time.monotonic()
+        connection = ProfiledOBD(profile["port"], baudrate or profile["baudrate"], profile["protocol"], supported=profile["supported"])
+        if connection.is_connected():
+            vin = read_vin(connection)
+            if vin != profile["vin"] and vin is not None:
+                logger.info(f"Vehicle changed ({profile['vin']} -> {vin}), reloading supported commands")
+                connection.reload_commands()
+            _save(store, connection, vin)
+            logger.info(f"Connected with the saved profile in {time.monotonic() - started:.2f}s")
+            return connection
+        connection.close()
+        logger.info("Saved connection profile failed, auto-detecting the adapter")
+
+    connection = ProfiledOBD(portstr, baudrate)
+    if connection.is_connected():
+        _save(store, connection, read_vin(connection))
+    return connection
+
+
+def _save(store, connection, vin):
+    # Kept on the connection so the VIN isn't queried again after connecting
+    connection.vin = vin
+    # Vehicles without mode 09 support are told apart by their port
+    store.save(vin or f"port:{connection.port_name()}", profile_of(connection, vin))
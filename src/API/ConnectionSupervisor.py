@@ -0,0 +1,89 @@
+import threading
+import time
+from enum import Enum
+from obd import OBDStatus
+from ..UTILS.logger import Logger
+from ..UTILS.config import config_instance as config
+from ..UTILS.metrics import metrics_instance as metrics
+
+logger = Logger("Connection Supervisor")
+
+
+class LinkState(Enum):
+    CONNECTED = "connected"
+    RECONNECTING = "reconnecting"
+    STOPPED = "stopped"
+
+
+class ConnectionSupervisor:
+    """Watches the adapter link of an OBDManager and reopens it in the background when it drops.
+
+    The link is lost when python-OBD reports the port disconnected, or when no
+    polled command got an answer for stale_timeout seconds. Polling is then
+    stopped and the connection reopened with exponential backoff, while the
+    snapshot store keeps serving the last values received.
+    """
+
+    def __init__(self, manager, check_interval=1.0):
+        self.manager = manager
+        self.check_interval = check_interval
+        self.stale_timeout = config.get_obd_stale_timeout()
+        self.initial_backoff = config.get_obd_reconnect_initial_backoff()
+        self.max_backoff = config.get_obd_reconnect_max_backoff()
+        self.state = LinkState.CONNECTED
+        self.connected_at = time.monotonic()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="ConnectionSupervisor")
+        self.thread.daemon = True
+        metrics.gauge("obd.link_state", lambda: self.state.value)
+
+    @property
+    def connected(self):
+        return self.state == LinkState.CONNECTED
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.state = LinkState.STOPPED
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def is_link_alive(self):
+        if self.manager.obd_connection.status() != OBDStatus.CAR_CONNECTED:
+            return False
+        last_answer = max(self.connected_at, self.manager.snapshots.newest() or 0.0)
+        return time.monotonic() - last_answer < self.stale_timeout
+
+    def _run(self):
+        while not self.stopped.wait(self.check_interval):
+            try:
+                if not self.is_link_alive():
+                    self._reconnect()
+            except Exception as e:
+                logger.error(f"Supervision failed: {e}")
+
+    def _reconnect(self):
+        self.state = LinkState.RECONNECTING
+        metrics.increment("obd.disconnects")
+        logger.warning("OBD link lost, serving cached values while reconnecting")
+        self.manager.stop_polling()
+        delay = self.initial_backoff
+        attempts = 0
+        started = time.monotonic()
+        while not self.stopped.is_set():
+            attempts += 1
+            if self.manager.reopen():
+                break
+            logger.info(f"Reconnection attempt {attempts} failed, trying again in {delay:.1f} seconds")
+            self.stopped.wait(delay)
+            delay = min(delay * 2, self.max_backoff)
+        if self.stopped.is_set():
+            return
+        self.manager.start_polling()
+        self.connected_at = time.monotonic()
+        self.state = LinkState.CONNECTED
+        metrics.increment("obd.reconnects")
+        logger.info(f"OBD link restored after {time.monotonic() - started:.1f}s ({attempts} attempts)")
@@ -1,17 +1,194 @@
 import sqlite3
 import os
 import datetime
+import queue
+import threading
+import time
 from src.UTILS.logger import Logger
+from src.UTILS.config import config_instance as config
+from src.UTILS.metrics import metrics_instance as metrics
+from src.API.Archive import create_archive_tables, opened_archive
+from src.API.Compression import build_compressor
+from src.API.Spool import Spool
+from src.API.DTCEvents import create_dtc_tables, parse_dtcs, DTCTracker, iter_dtc_events
+from src.API.Rollups import create_rollup_tables, update_rollups, fetch_history, fetch_range_aggregates, to_epoch
 
 logger = Logger("DB Manager")
 
+INSERT_READING_SQL = '''
+    INSERT INTO readings (session_id, timestamp, speed, rpm, fuel_status, coolant_temp, dtc)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+# Bytes the WAL file is truncated to after a checkpoint
+WAL_SIZE_LIMIT = 8 * 1024 * 1024
+
+
+def configure_connection(connection):
+    """Apply the journaling settings shared by every connection to the database"""
+    # Lets the maintenance job give freed pages back in small steps. Only takes
+    # effect on a new database, so it must come before anything is written.
+    connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    # WAL lets readers run alongside the writer, and synchronous=NORMAL only
+    # fsyncs on checkpoints instead of on every commit.
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    # Truncate the WAL back to this size after checkpoints, so it can't keep the space of a burst
+    connection.execute(f"PRAGMA journal_size_limit={WAL_SIZE_LIMIT}")
+
+
+def open_read_only(db_path):
+    """Open the database read-only, for readers that must never block or alter the live writer"""
+    return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+
+
+def write_readings(connection, rows, spool=None):
+    """Insert reading rows and their rollups in one transaction.
+
+    With a spool, rows the database refuses are appended to it instead (the
+    error is still raised), and once the database accepts writes again the
+    spooled rows are replayed in the same transaction as the new ones.
+    Returns the number of rows committed.
+    """
+    if spool is not None and spool.pending and time.monotonic() < spool.retry_at:
+        # The database failed moments ago, don't stall on it for every batch
+        spool.append(rows)
+        return 0
+    spooled = list(spool.read()) if spool is not None and spool.pending else []
+    try:
+        with connection:
+            connection.executemany(INSERT_READING_SQL, spooled + rows)
+            update_rollups(connection, spooled + rows)
+    except sqlite3.Error:
+        if spool is not None:
+            spool.append(rows)
+            spool.retry_at = time.monotonic() + config.get_db_spool_retry_interval()
+            metrics.increment("db.spooled_readings", len(rows))
+        raise
+    if spooled:
+        spool.clear()
+        logger.info(f"Replayed {len(spooled)} spooled readings")
+    return len(spooled) + len(rows)
+
+
+def open_spool(db_path):
+    """Spool for the readings the database fails to take, None if disabled"""
+    path = config.get_db_spool_path()
+    if not path:
+        return None
+    # Kept next to the database, so a database elsewhere (e.g. a benchmark's) gets its own spool
+    path = os.path.join(os.path.dirname(db_path), path)
+    try:
+        spool = Spool(path)
+    except OSError as e:
+        logger.error(f"Failed to open spool {path}: {e}")
+        return None
+    metrics.gauge("db.spool_depth", lambda: spool.count)
+    return spool
+
+
+class BatchWriter:
+    """Background thread that group-commits queued readings with executemany"""
+    _STOP = object()
+
+    def __init__(self, db_path, batch_size=100, flush_interval=1.0, queue_size=5000, spool=None):
+        self.db_path = db_path
+        self.spool = spool
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        self.thread = threading.Thread(target=self._run, name="DBBatchWriter")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, row):
+        """Queue a reading row, blocking while the queue is full"""
+        self.queue.put(row)
+
+    def flush(self, timeout=None):
+        """Block until every row queued so far has been committed"""
+        if not self.thread.is_alive():
+            return False
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def stop(self):
+        """Flush pending rows and stop the writer thread"""
+        if self.thread.is_alive():
+            self.queue.put(self._STOP)
+            self.thread.join()
+
+    def _run(self):
+        connection = sqlite3.connect(self.db_path)
+        configure_connection(connection)
+        batch = []
+        deadline = None
+        try:
+            while True:
+                timeout = None if not batch else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    # Time limit reached for the oldest pending row
+                    batch = self._commit(connection, batch)
+                    continue
+
+                if item is self._STOP:
+                    self._commit(connection, batch)
+                    break
+                if isinstance(item, threading.Event):
+                    batch = self._commit(connection, batch)
+                    item.set()
+                    continue
+
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    batch = self._commit(connection, batch)
+        finally:
+            connection.close()
+
+    def _commit(self, connection, batch):
+        if batch:
+            try:
+                started = time.perf_counter()
+                committed = write_readings(connection, batch, self.spool)
+                if committed:
+                    metrics.observe("db.commit", time.perf_counter() - started)
+                    metrics.increment("db.committed_readings", committed)
+                    logger.debug("Committed batch of %d readings", committed)
+            except sqlite3.Error as e:
+                metrics.increment("db.errors")
+                logger.error(f"Error committing batch of {len(batch)} readings{' (spooled)' if self.spool else ''}: {e}")
+            except OSError as e:
+                metrics.increment("db.errors")
+                logger.critical(f"Lost {len(batch)} readings, the spool failed too: {e}")
+        return []
+
+
+class VehicleSession:
+    """State of the driving session open for one vehicle"""
+
+    def __init__(self, session_id, vehicle, adapter):
+        self.id = session_id
+        self.vehicle = vehicle
+        self.adapter = adapter
+        self.compressor = build_compressor()
+        self.dtc_tracker = DTCTracker(vehicle, adapter)
+
+
 class DatabaseManager:
     _instance = None
     
     @staticmethod
-    def get_instance(db_path="obd_data.db"):
+    def get_instance(db_path=None):
         """Static method to get or create the singleton instance"""
         if DatabaseManager._instance is None:
+            db_path = db_path or config.get_db_path()
             DatabaseManager._instance = DatabaseManager.__DatabaseManager(db_path)
         return DatabaseManager._instance
     
@@ -21,20 +198,70 @@ class DatabaseManager:
             self.db_path = db_path
             self.connection = None
             self.cursor = None
-            self.session_id = None
+            # Open session of each (vehicle, adapter); (None, None) in the single-adapter app
+            self.sessions = {}
+            self.writer = None
+            # Called with the id of every session ended, e.g. MaintenanceJob.session_ended
+            self.on_session_end = None
+            self.trip_metrics = {}
+            # Trip metrics of a session may be requested by several BLE clients at once
+            self.trip_metrics_lock = threading.Lock()
+            # The main connection is shared by the sampling, pipeline and main threads
+            self.lock = threading.RLock()
+            self._local = threading.local()
+            self.spool = open_spool(db_path)
             self.connect()
+            if config.get_db_write_mode() == "batched":
+                self.writer = BatchWriter(
+                    db_path,
+                    batch_size=config.get_db_batch_size(),
+                    flush_interval=config.get_db_flush_interval(),
+                    queue_size=config.get_db_queue_size(),
+                    spool=self.spool,
+                )
+                metrics.gauge("db.queue_depth", self.writer.queue.qsize)
+                logger.info("Batched write mode enabled")
         
         def connect(self):
             """Connect to the SQLite database"""
             try:
-                self.connection = sqlite3.connect(self.db_path)
+                self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
+                configure_connection(self.connection)
                 self.cursor = self.connection.cursor()
                 logger.info(f"Connected to database: {self.db_path}")
             except sqlite3.Error as e:
                 logger.error(f"Database connection error: {e}")
         
+        @property
+        def session_id(self):
+            """Id of the open session of the single-adapter vehicle"""
+            session = self.sessions.get((None, None))
+            return session.id if session else None
+
+        def active_session_ids(self):
+            return {session.id for session in list(self.sessions.values())}
+
+        def _flush_if_active(self, session_id):
+            # Rows of an open session may still be queued in the writer
+            if self.writer and session_id in self.active_session_ids():
+                self.writer.flush()
+
+        def _read_connection(self):
+            """Read-only connection owned by the calling thread, so readers never block each other nor the writer"""
+            connection = getattr(self._local, "connection", None)
+            if connection is None:
+                connection = open_read_only(self.db_path)
+                self._local.connection = connection
+            return connection
+
         def close(self):
             """Close the database connection"""
+            if self.writer:
+                self.writer.stop()
+                self.writer = None
+            if self.spool:
+                self.spool.close()
+                self.spool = None
             if self.connection:
                 self.connection.close()
                 logger.info("Database connection closed")
@@ -48,9 +275,20 @@ class DatabaseManager:
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
                         start_time TIMESTAMP,
                         end_time TIMESTAMP,
-                        vehicle_info TEXT
+                        vehicle_info TEXT,
+                        vehicle TEXT,
+                        adapter TEXT
                     )
                 ''')
+                # Databases created before sessions were tagged by vehicle and adapter
+                columns = {row[1] for row in self.cursor.execute("PRAGMA table_info(sessions)")}
+                for column in ("vehicle", "adapter"):
+                    if column not in columns:
+                        self.cursor.execute(f"ALTER TABLE sessions ADD COLUMN {column} TEXT")
+                self.cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_sessions_vehicle
+                    ON sessions (vehicle, start_time)
+                ''')
                 
                 # Create readings table to store OBD data
                 self.cursor.execute('''
@@ -66,6 +304,19 @@ class DatabaseManager:
                         FOREIGN KEY (session_id) REFERENCES sessions (id)
                     )
                 ''')
+                self.cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_readings_session_timestamp
+                    ON readings (session_id, timestamp)
+                ''')
+
+                # Create min/max/avg rollups at several resolutions for history queries
+                create_rollup_tables(self.cursor)
+
+                # Create DTC change events, stored once instead of on every reading
+                create_dtc_tables(self.cursor)
+
+                # Create the index of the compressed column archives of finished sessions
+                create_archive_tables(self.cursor)
                 
                 self.connection.commit()
                 logger.info("Database tables created or verified successfully")
@@ -73,69 +324,232 @@ class DatabaseManager:
                 logger.error(f"Error creating tables: {e}")
 
 
-        def start_session(self, vehicle_info="Unknown Vehicle"):
-            """Start a new driving session"""
+        def start_session(self, vehicle_info="Unknown Vehicle", vehicle=None, adapter=None):
+            """Start a new driving session for the vehicle (VIN) recorded through adapter"""
             try:
                 start_time = datetime.datetime.now()
-                self.cursor.execute('''
-                    INSERT INTO sessions (start_time, vehicle_info)
-                    VALUES (?, ?)
-                ''', (start_time, vehicle_info))
-                self.connection.commit()
-                self.session_id = self.cursor.lastrowid
-                logger.info(f"Started new session with ID: {self.session_id}")
+                with self.lock:
+                    self.cursor.execute('''
+                        INSERT INTO sessions (start_time, vehicle_info, vehicle, adapter)
+                        VALUES (?, ?, ?, ?)
+                    ''', (start_time, vehicle_info, vehicle, adapter))
+                    session = VehicleSession(self.cursor.lastrowid, vehicle, adapter)
+                    # Registered before the commit makes the session visible, so the
+                    # maintenance job never sees it without it being active
+                    previous = self.sessions.get((vehicle, adapter))
+                    self.sessions[(vehicle, adapter)] = session
+                    try:
+                        self.connection.commit()
+                    except sqlite3.Error:
+                        if previous is None:
+                            self.sessions.pop((vehicle, adapter), None)
+                        else:
+                            self.sessions[(vehicle, adapter)] = previous
+                        raise
+                logger.info(f"Started new session with ID: {session.id}" + (f" for {vehicle} on {adapter}" if adapter else ""))
             except sqlite3.Error as e:
                 logger.error(f"Error starting session: {e}")
 
-        def end_session(self):
-            """End the current driving session"""
+        def end_session(self, vehicle=None, adapter=None):
+            """End the current driving session of the vehicle recorded through adapter"""
             try:
-                if self.session_id is None:
+                session = self.sessions.get((vehicle, adapter))
+                if session is None:
                     logger.warning("No active session to end")
                     return
+                compressor = session.compressor
+                if compressor:
+                    for timestamp, values in compressor.flush():
+                        self._write_reading(session, timestamp, **values)
+                    logger.info(
+                        f"Session {session.id} compression: {compressor.received} readings received, "
+                        f"{compressor.stored} stored (ratio {compressor.ratio:.1f}:1)"
+                    )
+                if self.writer:
+                    self.writer.flush()
                 end_time = datetime.datetime.now()
-                self.cursor.execute('''
-                    UPDATE sessions
-                    SET end_time = ?
-                    WHERE id = ?
-                ''', (end_time, self.session_id))
-                self.connection.commit()
-                logger.info(f"Ended session with ID: {self.session_id}")
-                self.session_id = None
+                with self.lock:
+                    self.cursor.execute('''
+                        UPDATE sessions
+                        SET end_time = ?
+                        WHERE id = ?
+                    ''', (end_time, session.id))
+                    self.connection.commit()
+                logger.info(f"Ended session with ID: {session.id}")
+                self.sessions.pop((vehicle, adapter), None)
             except sqlite3.Error as e:
                 logger.error(f"Error ending session: {e}")
+                return
+            if self.on_session_end:
+                self.on_session_end(session.id)
 
-        def insert_reading(self, speed, rpm, fuel_status, coolant_temp, dtc):
-            """Insert a new OBD reading into the database"""
+        def insert_reading(self, speed, rpm, fuel_status, coolant_temp, dtc, timestamp=None, vehicle=None, adapter=None):
+            """Insert a new OBD reading into the open session of the vehicle recorded through adapter"""
+            started = time.perf_counter()
             try:
-                if self.session_id is None:
+                session = self.sessions.get((vehicle, adapter))
+                if session is None:
                     logger.warning("No active session. Cannot insert reading.")
                     return
-                timestamp = datetime.datetime.now()
-                self.cursor.execute('''
-                    INSERT INTO readings (session_id, timestamp, speed, rpm, fuel_status, coolant_temp, dtc)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (self.session_id, timestamp, speed, rpm, fuel_status, coolant_temp, dtc))
-                self.connection.commit()
-                logger.debug(f"Inserted reading at {timestamp} for session ID: {self.session_id}")
+                timestamp = timestamp or datetime.datetime.now()
+                # DTCs are stored as change events, the dtc column is no longer filled
+                self.record_dtcs(dtc, timestamp, vehicle, adapter)
+                dtc = None
+                if session.compressor:
+                    values = {"speed": speed, "rpm": rpm, "fuel_status": fuel_status, "coolant_temp": coolant_temp, "dtc": dtc}
+                    for kept_timestamp, kept_values in session.compressor.add(timestamp, values):
+                        self._write_reading(session, kept_timestamp, **kept_values)
+                else:
+                    self._write_reading(session, timestamp, speed, rpm, fuel_status, coolant_temp, dtc)
+                metrics.observe("db.insert", time.perf_counter() - started)
             except sqlite3.Error as e:
+                metrics.increment("db.errors")
                 logger.error(f"Error inserting reading: {e}")
 
+        def _write_reading(self, session, timestamp, speed, rpm, fuel_status, coolant_temp, dtc):
+            row = (session.id, timestamp, speed, rpm, fuel_status, coolant_temp, dtc)
+            if self.writer:
+                self.writer.put(row)
+                return
+            with self.lock:
+                started = time.perf_counter()
+                try:
+                    committed = write_readings(self.connection, [row], self.spool)
+                except OSError as e:
+                    metrics.increment("db.errors")
+                    logger.critical(f"Lost reading at {timestamp}, the spool failed too: {e}")
+                    return
+                if not committed:
+                    return
+                metrics.observe("db.commit", time.perf_counter() - started)
+            metrics.increment("db.committed_readings", committed)
+            logger.debug("Inserted reading at %s for session ID: %s", timestamp, session.id)
+
+        def record_dtcs(self, dtc, timestamp=None, vehicle=None, adapter=None):
+            """Diff the current DTC list of a vehicle against its open events, opening and clearing events as needed"""
+            session = self.sessions.get((vehicle, adapter))
+            # Without a DTC reading there is nothing to diff, the open events stay as they are
+            if session is None or dtc is None:
+                return
+            try:
+                codes = parse_dtcs(dtc)
+            except (ValueError, KeyError, TypeError) as e:
+                logger.error(f"Invalid DTC list {dtc!r}: {e}")
+                return
+            try:
+                with self.lock:
+                    if session.dtc_tracker.update(self.connection, session.id, codes, timestamp or datetime.datetime.now()):
+                        self.connection.commit()
+                        logger.info(f"Active DTCs changed: {sorted(codes) or 'none'}")
+            except sqlite3.Error as e:
+                self.connection.rollback()
+                session.dtc_tracker.active = None
+                logger.error(f"Error recording DTC events: {e}")
+
+        def iter_dtc_events(self, code=None, before_id=None):
+            """Yield (id, code, description, first_seen, cleared_at) DTC events, newest first"""
+            return iter_dtc_events(self._read_connection(), code, before_id)
+
+        def fetch_history(self, session_id, signal, start=None, end=None, max_points=500):
+            """Aggregated history of a signal, read from the finest rollup giving at most max_points points.
+
+            start and end are epoch seconds and default to the whole session.
+            Returns (resolution, rows), resolution being 0 for raw readings.
+            """
+            self._flush_if_active(session_id)
+            connection = self._read_connection()
+            with opened_archive(connection, self.db_path, session_id) as archive:
+                if start is None or end is None:
+                    if archive is not None:
+                        first, last = archive.start, archive.end
+                    else:
+                        first, last = (to_epoch(timestamp) if timestamp else None for timestamp in connection.execute('''
+                            SELECT MIN(timestamp), MAX(timestamp) FROM readings WHERE session_id = ?
+                        ''', (session_id,)).fetchone())
+                    if first is None:
+                        return 0, []
+                    start = first if start is None else start
+                    end = last if end is None else end
+                return fetch_history(connection, session_id, signal, start, end, max_points, archive)
+
+        def fetch_range_aggregates(self, session_id, signals, start, end, bucket, percentiles=()):
+            """Yield (signal, bucket, min, max, avg, count, percentiles) rows for each signal over start..end"""
+            self._flush_if_active(session_id)
+            connection = self._read_connection()
+            with opened_archive(connection, self.db_path, session_id) as archive:
+                for signal in signals:
+                    for row in fetch_range_aggregates(connection, session_id, signal, start, end, bucket, percentiles, archive):
+                        yield (signal,) + tuple(row)
+
+        def compute_trip_metrics(self, session_id, incremental=True):
+            """Derived trip metrics of a session, only processing readings added since the last call"""
+            # NumPy is only loaded once trip metrics are actually requested
+            from src.API.TripMetrics import TripMetrics
+
+            self._flush_if_active(session_id)
+            connection = self._read_connection()
+            with self.trip_metrics_lock:
+                metrics = self.trip_metrics.get(session_id) if incremental else None
+                if metrics is None:
+                    metrics = TripMetrics(session_id)
+                    self.trip_metrics[session_id] = metrics
+                with opened_archive(connection, self.db_path, session_id) as archive:
+                    if archive is not None:
+                        metrics.update_from_archive(archive)
+                    else:
+                        metrics.update_from(connection)
+                return metrics.to_dict()
+
+        def compression_stats(self, vehicle=None, adapter=None):
+            """Readings received and stored by the compression stage of the current session of a vehicle"""
+            session = self.sessions.get((vehicle, adapter))
+            if session is None or session.compressor is None:
+                return None
+            return {
+                "received": session.compressor.received,
+                "stored": session.compressor.stored,
+                "ratio": session.compressor.ratio,
+            }
+
         def fetch_current_session(self):
-            """Fetch the current active session details"""
+            """Fetch every reading of the current active session"""
+            if self.session_id is None:
+                logger.warning("No active session to fetch")
+                return None
             try:
-                if self.session_id is None:
-                    logger.warning("No active session to fetch")
-                    return None
-                self.cursor.execute('''
-                    SELECT * FROM readings WHERE session_id = ?
-                ''', (self.session_id,))
-                session = self.cursor.fetchone()
-                return session
+                return list(self.iter_session_readings(self.session_id))
             except sqlite3.Error as e:
                 logger.error(f"Error fetching current session: {e}")
                 return None
 
+        def iter_session_readings(self, session_id, after_id=0, batch_size=100):
+            """Yield the readings of a session with an id above after_id, in id order.
+
+            Rows are pulled from the cursor batch_size at a time, so memory stays
+            constant however long the session is. Archived sessions are read
+            from their column archive instead, one block at a time.
+            """
+            self._flush_if_active(session_id)
+            with opened_archive(self._read_connection(), self.db_path, session_id) as archive:
+                if archive is not None:
+                    yield from archive.iter_rows(after_id or 0)
+                    return
+            cursor = self._read_connection().cursor()
+            try:
+                cursor.execute('''
+                    SELECT id, timestamp, speed, rpm, fuel_status, coolant_temp, dtc
+                    FROM readings
+                    WHERE session_id = ? AND id > ?
+                    ORDER BY id
+                ''', (session_id, after_id or 0))
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield from rows
+            finally:
+                cursor.close()
+
 # Function to initialize database tables
 def create_tables():
     """Initialize database tables - standalone function for easy import"""
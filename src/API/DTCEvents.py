@@ -0,0 +1,124 @@
+import json
+
+
+def create_dtc_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dtc_descriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            description TEXT UNIQUE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dtc_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER,
+            vehicle TEXT,
+            adapter TEXT,
+            code TEXT,
+            description_id INTEGER,
+            first_seen TIMESTAMP,
+            cleared_at TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES sessions (id),
+            FOREIGN KEY (description_id) REFERENCES dtc_descriptions (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_dtc_events_code
+        ON dtc_events (code, first_seen)
+    ''')
+
+
+def parse_dtcs(dtc):
+    """Turn a DTC list (OBDManager.get_dtc JSON, dicts or (code, description) tuples) into {code: description}"""
+    if not dtc:
+        return {}
+    if isinstance(dtc, str):
+        dtc = json.loads(dtc)
+    codes = {}
+    for item in dtc:
+        if isinstance(item, dict):
+            codes[str(item["code"])] = str(item.get("description", ""))
+        else:
+            code, description = item
+            codes[str(code)] = str(description)
+    return codes
+
+
+class DTCTracker:
+    """Turns successive DTC sets of one vehicle into appeared/cleared events in dtc_events.
+
+    Events are tagged with the vehicle (VIN) they were read from, or with the
+    adapter when the VIN is unknown, so each tracker only resumes and clears
+    the events of its own vehicle. They outlive their session, which the
+    maintenance job may delete while a fault is still active.
+    """
+
+    def __init__(self, vehicle=None, adapter=None):
+        self.vehicle = vehicle
+        self.adapter = adapter
+        # code -> id of its open event
+        self.active = None
+
+    def load(self, connection):
+        """Resume the events of the vehicle left open by a previous run"""
+        if self.vehicle is not None:
+            rows = connection.execute('''
+                SELECT code, id FROM dtc_events WHERE cleared_at IS NULL AND vehicle = ?
+            ''', (self.vehicle,))
+        else:
+            rows = connection.execute('''
+                SELECT code, id FROM dtc_events WHERE cleared_at IS NULL AND vehicle IS NULL AND adapter IS ?
+            ''', (self.adapter,))
+        self.active = dict(rows.fetchall())
+
+    def update(self, connection, session_id, codes, timestamp):
+        """Record the changes between the active codes and codes. Returns True if anything changed."""
+        if self.active is None:
+            self.load(connection)
+        appeared = [code for code in codes if code not in self.active]
+        cleared = [code for code in self.active if code not in codes]
+        if not appeared and not cleared:
+            return False
+
+        for code in appeared:
+            connection.execute('''
+                INSERT OR IGNORE INTO dtc_descriptions (description) VALUES (?)
+            ''', (codes[code],))
+            cursor = connection.execute('''
+                INSERT INTO dtc_events (session_id, vehicle, adapter, code, description_id, first_seen)
+                SELECT ?, ?, ?, ?, id, ? FROM dtc_descriptions WHERE description = ?
+            ''', (session_id, self.vehicle, self.adapter, code, timestamp, codes[code]))
+            self.active[code] = cursor.lastrowid
+        for code in cleared:
+            connection.execute('''
+                UPDATE dtc_events SET cleared_at = ? WHERE id = ?
+            ''', (timestamp, self.active.pop(code)))
+        return True
+
+
+def iter_dtc_events(connection, code=None, before_id=None, batch_size=100):
+    """Yield (id, code, description, first_seen, cleared_at) events, newest first"""
+    conditions = []
+    params = []
+    if code:
+        conditions.append("e.code = ?")
+        params.append(code)
+    if before_id:
+        conditions.append("e.id < ?")
+        params.append(before_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor = connection.execute(f'''
+        SELECT e.id, e.code, d.description, e.first_seen, e.cleared_at
+        FROM dtc_events e
+        LEFT JOIN dtc_descriptions d ON d.id = e.description_id
+        {where}
+        ORDER BY e.id DESC
+    ''', params)
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
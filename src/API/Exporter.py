@@ -0,0 +1,118 @@
+import csv
+import datetime
+import itertools
+from ..UTILS.logger import Logger
+from .Archive import opened_archive
+from .DBManager import open_read_only
+
+logger = Logger("Exporter")
+
+FORMATS = ("csv", "arrow", "parquet")
+COLUMNS = ("session_id", "id", "timestamp", "speed", "rpm", "fuel_status", "coolant_temp", "dtc")
+
+
+def iter_batches(connection, session_ids=None, batch_size=10000, db_path=""):
+    """Yield lists of at most batch_size reading rows (COLUMNS order), session by session.
+
+    Archived sessions are read from their archive, found next to db_path.
+    """
+    if not session_ids:
+        session_ids = [row[0] for row in connection.execute("SELECT id FROM sessions ORDER BY id")]
+    for session_id in session_ids:
+        with opened_archive(connection, db_path, session_id) as archive:
+            if archive is not None:
+                rows = ((session_id,) + row for row in archive.iter_rows())
+                while True:
+                    batch = list(itertools.islice(rows, batch_size))
+                    if not batch:
+                        break
+                    yield batch
+                continue
+        cursor = connection.execute(f'''
+            SELECT {", ".join(COLUMNS)} FROM readings
+            WHERE session_id = ?
+            ORDER BY id
+        ''', (session_id,))
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+
+def _arrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Arrow and Parquet exports require pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+def _arrow_schema(pa):
+    return pa.schema([
+        ("session_id", pa.int64()),
+        ("id", pa.int64()),
+        ("timestamp", pa.timestamp("us")),
+        ("speed", pa.float64()),
+        ("rpm", pa.float64()),
+        ("fuel_status", pa.string()),
+        ("coolant_temp", pa.float64()),
+        ("dtc", pa.string()),
+    ])
+
+
+def _arrow_batch(pa, schema, rows):
+    columns = list(zip(*rows))
+    columns[2] = [datetime.datetime.fromisoformat(t) if t else None for t in columns[2]]
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+        schema=schema,
+    )
+
+
+def export_sessions(db_path, output_path, file_format="csv", session_ids=None, batch_size=10000):
+    """Stream the readings of session_ids (all sessions if empty) to output_path.
+
+    Rows are read and written batch_size at a time, so memory use depends on
+    the batch size and not on the size of the database. Each batch becomes one
+    Arrow record batch or one Parquet row group. Returns the number of rows written.
+    """
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown export format: {file_format} (expected one of {', '.join(FORMATS)})")
+
+    connection = open_read_only(db_path)
+    written = 0
+    try:
+        batches = iter_batches(connection, session_ids, batch_size, db_path)
+        if file_format == "csv":
+            with open(output_path, "w", newline="") as output:
+                writer = csv.writer(output)
+                writer.writerow(COLUMNS)
+                for rows in batches:
+                    writer.writerows(rows)
+                    written += len(rows)
+        else:
+            pa = _arrow()
+            schema = _arrow_schema(pa)
+            if file_format == "arrow":
+                import pyarrow.ipc
+                writer = pyarrow.ipc.new_file(output_path, schema)
+                write = writer.write_batch
+            else:
+                import pyarrow.parquet
+                writer = pyarrow.parquet.ParquetWriter(output_path, schema, compression="zstd")
+                write = lambda batch: writer.write_table(pa.Table.from_batches([batch]))
+            try:
+                for rows in batches:
+                    write(_arrow_batch(pa, schema, rows))
+                    written += len(rows)
+            finally:
+                writer.close()
+    finally:
+        connection.close()
+
+    logger.info(f"Exported {written} readings to {output_path} ({file_format})")
+    return written
@@ -0,0 +1,237 @@
+import contextlib
+import datetime
+import os
+import sqlite3
+import threading
+import time
+from ..UTILS.logger import Logger
+from ..UTILS.config import config_instance as config
+from ..UTILS.metrics import metrics_instance as metrics
+from .Archive import ARCHIVED, DOWNSAMPLED, archive_session, archive_location
+from .Rollups import RESOLUTIONS
+
+logger = Logger("Maintenance")
+
+# Sessions never ended (the app crashed) count as finished once this old
+STALE_SESSION = datetime.timedelta(days=1)
+
+FINISHED_SESSIONS_SQL = '''
+    SELECT s.id, a.level
+    FROM sessions s
+    LEFT JOIN session_archives a ON a.session_id = s.id
+    WHERE s.start_time < ? AND (s.end_time IS NOT NULL OR s.start_time < ?)
+    ORDER BY s.id
+'''
+
+
+def enable_incremental_vacuum(connection):
+    """Convert a database created before incremental vacuum was enabled.
+
+    VACUUM rewrites the whole file and holds writers back meanwhile, so this is
+    never run by the app: it is the maintenance.py --enable-incremental-vacuum
+    command, run with the app stopped.
+    """
+    # 0 = none, 2 = incremental
+    if connection.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        logger.info("Incremental vacuum is already enabled")
+        return
+    page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+    size = connection.execute("PRAGMA page_count").fetchone()[0] * page_size
+    connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    connection.execute("VACUUM")
+    logger.info(f"Enabled incremental vacuum ({size} bytes rewritten)")
+
+
+class MaintenanceJob:
+    """Background thread keeping the database within its storage budget.
+
+    Every interval seconds, finished sessions older than archive_after_days
+    have their readings moved to a compressed column archive file. When
+    sessions are archived as they end, all finished sessions are, and the job
+    runs early each time session_ended is called.
+    While the database and its archives are over budget, sessions are
+    archived, then downsampled (only their coarsest rollup is kept) and
+    finally deleted, oldest first. Freed pages are given back to the file
+    system with incremental vacuum.
+
+    All of it runs on the job's own connection in small transactions (one
+    session, or vacuum_step_pages pages, at a time) separated by step_pause
+    seconds, so the live writer is never held up for long and the SD card
+    never sees sustained bursts of I/O.
+    """
+
+    def __init__(self, db_path, active_sessions=lambda: set()):
+        self.db_path = db_path
+        self.active_sessions = active_sessions
+        self.interval = config.get_maintenance_interval()
+        self.archive_after = datetime.timedelta(days=config.get_maintenance_archive_after_days())
+        self.budget = int(config.get_maintenance_storage_budget_mb() * 1024 * 1024)
+        self.vacuum_step_pages = config.get_maintenance_vacuum_step_pages()
+        self.step_pause = config.get_maintenance_step_pause()
+        self.stopped = threading.Event()
+        # Set to run early, when a session to archive has ended
+        self.wakeup = threading.Event()
+        self.warned_auto_vacuum = False
+        self.thread = threading.Thread(target=self._run, name="Maintenance")
+        self.thread.daemon = True
+        metrics.gauge("db.size_bytes", self.used_bytes)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def used_bytes(self, connection=None):
+        """Bytes of the database in use, not counting free pages, plus its archive files"""
+        if connection is None:
+            with contextlib.closing(sqlite3.connect(self.db_path)) as connection:
+                return self.used_bytes(connection)
+        page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+        page_count = connection.execute("PRAGMA page_count").fetchone()[0]
+        free = connection.execute("PRAGMA freelist_count").fetchone()[0]
+        archives = connection.execute("SELECT COALESCE(SUM(size), 0) FROM session_archives").fetchone()[0]
+        return (page_count - free) * page_size + archives
+
+    def session_ended(self, session_id):
+        """Archive a session that just ended on the job's thread, rather than the caller's"""
+        if config.get_archive_on_end_session():
+            self.wakeup.set()
+
+    def _wait(self, timeout):
+        """Wait timeout seconds or until woken up, returning True if the job was stopped"""
+        self.wakeup.wait(timeout)
+        self.wakeup.clear()
+        return self.stopped.is_set()
+
+    def _run(self):
+        # Let the app finish starting up before the first run
+        if self._wait(min(self.interval, 60.0)):
+            return
+        while True:
+            started = time.monotonic()
+            try:
+                self.run_once()
+            except (sqlite3.Error, OSError) as e:
+                # e.g. no space left for an archive file: the next run tries again
+                logger.error(f"Maintenance failed: {e}")
+            metrics.observe("maintenance.run", time.monotonic() - started)
+            if self._wait(max(0.0, self.interval - (time.monotonic() - started))):
+                break
+
+    def _pause(self):
+        """Wait step_pause seconds, returning True if the job was stopped meanwhile"""
+        return self.stopped.wait(self.step_pause)
+
+    def run_once(self):
+        connection = sqlite3.connect(self.db_path)
+        try:
+            self._archive(connection)
+            self._enforce_budget(connection)
+            self._vacuum(connection)
+        finally:
+            connection.close()
+
+    def _finished_sessions(self, connection, started_before):
+        active = self.active_sessions()
+        stale = datetime.datetime.now() - STALE_SESSION
+        return [
+            (session_id, level)
+            for session_id, level in connection.execute(FINISHED_SESSIONS_SQL, (started_before, stale)).fetchall()
+            if session_id not in active
+        ]
+
+    def _archive(self, connection):
+        if config.get_archive_on_end_session():
+            # Every finished session, including those missed while the job was stopped
+            cutoff = datetime.datetime.now()
+        else:
+            cutoff = datetime.datetime.now() - self.archive_after
+        pending = [session_id for session_id, level in self._finished_sessions(connection, cutoff) if level is None]
+        for session_id in pending:
+            started = time.perf_counter()
+            archived = archive_session(connection, session_id, self.db_path)
+            if archived is not None:
+                metrics.observe("maintenance.archive", time.perf_counter() - started)
+                metrics.increment("maintenance.archived_sessions")
+                metrics.increment("maintenance.archived_readings", archived[0])
+                logger.info(f"Archived session {session_id}: {archived[0]} readings in {archived[1]} bytes")
+            if self._pause():
+                return
+
+    def _enforce_budget(self, connection):
+        if not self.budget:
+            return
+        while self.used_bytes(connection) > self.budget:
+            # Every session is archived, then downsampled, before the oldest is deleted
+            sessions = self._finished_sessions(connection, datetime.datetime.now())
+            session_id, level = next(
+                (session for wanted in (None, ARCHIVED, DOWNSAMPLED) for session in sessions if session[1] == wanted),
+                (None, None),
+            )
+            if session_id is None:
+                logger.warning("Database over its storage budget, but no finished session is left to reclaim")
+                return
+            if level is None:
+                archive_session(connection, session_id, self.db_path)
+                action = "archived"
+            else:
+                # The archive file is only removed once the session no longer points to it
+                location = archive_location(connection, session_id, self.db_path)
+                with connection:
+                    if level == ARCHIVED:
+                        self._downsample(connection, session_id)
+                        action = "downsampled"
+                    else:
+                        self._delete(connection, session_id)
+                        action = "deleted"
+                if location:
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(location)
+            metrics.increment(f"maintenance.{action}_sessions")
+            logger.info(f"Database over its storage budget, {action} session {session_id}")
+            if self._pause():
+                return
+
+    def _downsample(self, connection, session_id):
+        """Drop the raw readings of a session, keeping only its coarsest rollup"""
+        for resolution in RESOLUTIONS[:-1]:
+            connection.execute(f'DELETE FROM rollup_{resolution}s WHERE session_id = ?', (session_id,))
+        connection.execute('''
+            UPDATE session_archives SET level = ?, path = NULL, size = NULL WHERE session_id = ?
+        ''', (DOWNSAMPLED, session_id))
+
+    def _delete(self, connection, session_id):
+        for resolution in RESOLUTIONS:
+            connection.execute(f'DELETE FROM rollup_{resolution}s WHERE session_id = ?', (session_id,))
+        # Faults still active are kept, they belong to the vehicle more than to the session
+        connection.execute('DELETE FROM dtc_events WHERE session_id = ? AND cleared_at IS NOT NULL', (session_id,))
+        connection.execute('DELETE FROM readings WHERE session_id = ?', (session_id,))
+        connection.execute('DELETE FROM session_archives WHERE session_id = ?', (session_id,))
+        connection.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+
+    def _vacuum(self, connection):
+        """Give free pages back to the file system, vacuum_step_pages at a time"""
+        if connection.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            if not self.warned_auto_vacuum:
+                self.warned_auto_vacuum = True
+                logger.warning(
+                    "Incremental vacuum is disabled on this database, the file won't shrink "
+                    "(run python maintenance.py --enable-incremental-vacuum once, with the app stopped)"
+                )
+            return
+        free = connection.execute("PRAGMA freelist_count").fetchone()[0]
+        while free:
+            # The pragma frees one page per step of the statement, so it is run to completion
+            connection.execute(f"PRAGMA incremental_vacuum({self.vacuum_step_pages})").fetchall()
+            remaining = connection.execute("PRAGMA freelist_count").fetchone()[0]
+            metrics.increment("maintenance.vacuumed_pages", free - remaining)
+            if remaining >= free or self._pause():
+                return
+            free = remaining
+        # Copy the moved pages back into the database without waiting for the writer
+        connection.execute("PRAGMA wal_checkpoint(PASSIVE)")
@@ -0,0 +1,109 @@
+from obd.protocols.protocol import Message
+from ..UTILS.logger import Logger
+
+logger = Logger("OBD Batch")
+
+# The ELM327 accepts at most six PIDs in a single mode 01 request
+MAX_BATCH_PIDS = 6
+
+
+def is_batchable(cmd):
+    """Only fixed-length mode 01 PIDs can be packed into a multi-PID request"""
+    return len(cmd.command) == 4 and cmd.command[:2] == b"01" and cmd.bytes > 2
+
+
+def build_request(cmds):
+    """Build a single mode 01 request asking for every PID in cmds"""
+    return b"01" + b"".join(cmd.command[2:] for cmd in cmds)
+
+
+def split_response(cmds, messages):
+    """Split multi-PID reply messages into one OBDResponse per command.
+
+    A reply looks like 41 0C xx xx 0D xx 05 xx: the mode byte once, then every
+    PID followed by its data bytes. Each PID is re-wrapped as a single-PID
+    message so the command's own decoder can be reused unchanged.
+    """
+    by_pid = {cmd.command[2:].upper(): cmd for cmd in cmds}
+    per_command = {}
+
+    for message in messages:
+        data = message.data
+        if len(data) < 2 or data[0] != 0x41:
+            continue
+        i = 1
+        while i < len(data):
+            pid = b"%02X" % data[i]
+            cmd = by_pid.get(pid)
+            if cmd is None:
+                # Unknown PID: the rest of the payload can't be framed reliably
+                break
+            size = cmd.bytes - 2
+            payload = data[i + 1:i + 1 + size]
+            if len(payload) < size:
+                break
+            single = Message(message.frames)
+            single.ecu = message.ecu
+            single.data = bytearray([0x41, data[i]]) + payload
+            per_command.setdefault(cmd.name, (cmd, []))[1].append(single)
+            i += 1 + size
+
+    return {name: cmd(cmd_messages) for name, (cmd, cmd_messages) in per_command.items()}
+
+
+class BatchQuerier:
+    """Queries several commands at once, packing mode 01 PIDs into multi-PID requests.
+
+    Commands missing from a batched reply are re-queried one by one, and
+    batching is disabled for the connection once the ECU has rejected it
+    max_rejections times in a row.
+    """
+
+    def __init__(self, connection, lock, max_rejections=3):
+        self.connection = connection
+        self.lock = lock
+        self.max_rejections = max_rejections
+        self.rejections = 0
+        self.enabled = True
+
+    def query(self, cmds):
+        """Return a {command name: OBDResponse} dict for cmds"""
+        responses = {}
+        singles = []
+        batchable = []
+        for cmd in cmds:
+            (batchable if self.enabled and is_batchable(cmd) else singles).append(cmd)
+
+        for start in range(0, len(batchable), MAX_BATCH_PIDS):
+            chunk = batchable[start:start + MAX_BATCH_PIDS]
+            if len(chunk) == 1:
+                singles.extend(chunk)
+                continue
+            decoded = self._query_batch(chunk)
+            responses.update(decoded)
+            singles.extend(cmd for cmd in chunk if cmd.name not in decoded)
+
+        for cmd in singles:
+            with self.lock:
+                responses[cmd.name] = self.connection.query(cmd)
+        return responses
+
+    def _query_batch(self, cmds):
+        try:
+            with self.lock:
+                messages = self.connection.interface.send_and_parse(build_request(cmds))
+            decoded = split_response(cmds, messages or [])
+        except Exception as e:
+            logger.error(f"Batched query failed: {e}")
+            decoded = {}
+
+        decoded = {name: response for name, response in decoded.items() if not response.is_null()}
+        if decoded:
+            self.rejections = 0
+            return decoded
+
+        self.rejections += 1
+        if self.rejections >= self.max_rejections:
+            self.enabled = False
+            logger.warning("ECU rejected multi-PID requests, falling back to single-PID queries")
+        return {}
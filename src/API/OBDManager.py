@@ -1,39 +1,129 @@
 import obd
 import threading
-from ..UTILS.logger import Logger
+from ..UTILS.logger import Logger, parse_level
+from ..UTILS.config import config_instance as config
+from .PollScheduler import PollScheduler, record_query
+from .OBDBatch import BatchQuerier
+from .SnapshotStore import SnapshotStore
+from .ConnectionSupervisor import ConnectionSupervisor
+from .PIDDiscovery import loaded_commands, query_bitmaps, supported_commands
+from .TelemetryBuffer import TelemetryBuffer
 import json
 import time
 
-obd.logger.setLevel(obd.logging.DEBUG)  # Suppress obd library logs
+obd.logger.setLevel(parse_level(config.get_obd_log_level(), obd.logging.WARNING))  # Keep the obd library quiet unless asked
 
 logger = Logger("OBD Manager")
 
+
+def serialize_value(value):
+    """Convert a decoded OBD value to a plain JSON-serializable value"""
+    if value is None:
+        return None
+    if hasattr(value, "magnitude"):
+        return float(value.magnitude)
+    if isinstance(value, list):
+        # GET_DTC decodes to a list of (code, description) tuples
+        return [{"code": str(code), "description": str(desc)} for code, desc in value]
+    if isinstance(value, (bytes, bytearray)):
+        # Mode 09 strings such as the VIN
+        return bytes(value).decode("ascii", errors="ignore").strip("\x00 ")
+    return str(value)
+
+
+def build_command_table():
+    """Commands a client may read by name: the read-only modes (live data, DTCs, vehicle info) and the adapter voltage"""
+    table = {cmd.name: cmd for mode in (1, 3, 7, 9) for cmd in obd.commands[mode] if cmd is not None}
+    for cmd in obd.commands.pid_getters():
+        table.pop(cmd.name, None)
+    table[obd.commands.ELM_VOLTAGE.name] = obd.commands.ELM_VOLTAGE
+    return table
+
 class OBDManager:
     _instance = None
     _lock = threading.Lock()
     obd_connection = None
+    scheduler = None
+    batcher = None
+    snapshots = None
+    history = None
+    supervisor = None
+    # Names of the mode 01 commands the vehicle supports, None until discovered
+    supported_pids = None
+
+    # Default polling rates in Hz, overridable in the [OBD polling] config section
+    POLL_RATES = {
+        obd.commands.SPEED: 10.0,
+        obd.commands.RPM: 10.0,
+        obd.commands.THROTTLE_POS: 10.0,
+        obd.commands.COOLANT_TEMP: 0.2,
+        obd.commands.FUEL_STATUS: 0.2,
+        obd.commands.GET_DTC: 1 / 60,
+    }
+    # Commands whose values aren't numeric and are kept out of the history buffer
+    NON_NUMERIC = {"FUEL_STATUS", "GET_DTC"}
+    # Command name -> command, looked up by read_values
+    COMMANDS = build_command_table()
 
-    def __new__(cls, portstr=None, baudrate=None):
+    def __new__(cls, portstr=None, baudrate=None, connection=None):
         with cls._lock:
             if cls._instance is None:
                 cls._instance = super().__new__(cls)
-                cls._instance._init_connection(portstr, baudrate)
+                cls._instance._init_connection(portstr, baudrate, connection)
             return cls._instance
 
+    @classmethod
+    def get_instance(cls):
+        """The manager created at startup, or None before it exists. Never connects."""
+        return cls._instance
+
+    def connect(self):
+        """Try again to connect after a failed attempt, on the port and baudrate given first.
+
+        Only the startup retries call this; once connected, the ConnectionSupervisor
+        reopens a dropped link. Returns whether the manager is connected.
+        """
+        with self._lock:
+            if self.obd_connection is None:
+                self._init_connection(self.port, self.baudrate)
+        return self.obd_connection is not None
+
+
+    def _open_connection(self):
+        replay_trace = config.get_obd_replay_trace()
+        if replay_trace:
+            from .Replay import ReplayConnection
+            return ReplayConnection(replay_trace, config.get_obd_replay_speed())
+        profile_path = config.get_obd_profile_path()
+        if profile_path:
+            from .ConnectionProfile import ProfileStore, open_connection
+            connection = open_connection(ProfileStore(profile_path), self.port, self.baudrate)
+        else:
+            connection = obd.OBD(portstr=self.port, baudrate=self.baudrate)
+        record_trace = config.get_obd_record_trace()
+        if record_trace and connection.is_connected():
+            from .Replay import record
+            record(connection, record_trace)
+        return connection
 
-    def _init_connection(self, portstr, baudrate):
+    def _init_connection(self, portstr, baudrate, connection=None):
         self.port = portstr
         self.baudrate = baudrate
+        self.supervised = connection is None
+        self.serial_lock = threading.Lock()
+        self.snapshots = SnapshotStore()
+        self.history = TelemetryBuffer(config.get_history_window())
         logger.debug(f"Initializing OBD connection on port: {self.port or 'auto'} with baudrate: {self.baudrate or 'default'}")
         try:
-            self.obd_connection = obd.Async(portstr=self.port, baudrate=self.baudrate)
+            self.obd_connection = connection or self._open_connection()
             if not self.obd_connection.is_connected():
                 logger.error("❌ OBD connection failed")
                 raise Exception("OBD connection failed")
             logger.debug("✅ OBD connection established")
         except Exception as e:
             logger.error(f"Connection error: {e}")
-            self.connection = None
+            self.obd_connection = None
+            return
         self.main()
 
 
@@ -41,14 +131,40 @@ class OBDManager:
         if self.obd_connection is None:
             logger.error("OBD manager was not initialized.")
             return None
+        if not self.is_supported(cmd):
+            return None
         try:
-            response = self.obd_connection.query(cmd)
+            if self.scheduler and self.scheduler.is_watched(cmd):
+                # Watched commands are answered from the snapshot store
+                # without touching the serial port
+                snapshot = self.snapshots.get(cmd.name)
+                return snapshot.value if snapshot is not None else None
+            if not self.is_link_up():
+                return None
+            with self.serial_lock:
+                started = time.perf_counter()
+                response = self.obd_connection.query(cmd)
+                record_query(cmd.name, response, time.perf_counter() - started)
             return response.value
         except Exception as e:
             logger.error(f"Query failed: {e}")
             return None
 
 
+    def get_age(self, command_name):
+        """Seconds since the value of a watched command was last refreshed"""
+        return self.snapshots.age(command_name)
+
+    def read_snapshot(self, command_name):
+        """Return (value, age, seq) of a watched command with the value made JSON-serializable"""
+        snapshot = self.snapshots.get(command_name)
+        if snapshot is None:
+            return None, None, None
+        return serialize_value(snapshot.value), time.monotonic() - snapshot.monotonic, snapshot.seq
+
+    def watched_commands(self):
+        return [cmd.name for cmd in self.POLL_RATES]
+
     def get_speed(self):
         value = self.query(obd.commands.SPEED)
         return float(value.magnitude) if value is not None else 0.0
@@ -71,6 +187,9 @@ class OBDManager:
     
     def get_dtc(self):
         dtcs = self.query(obd.commands.GET_DTC)
+        if dtcs is None:
+            # No DTC reading yet, unlike an empty list which means no faults
+            return None
         if not dtcs:
             return json.dumps([])
         
@@ -83,12 +202,143 @@ class OBDManager:
         
         return json.dumps(dtc_list) 
 
+    def is_supported(self, cmd):
+        if cmd.mode == 1 and self.supported_pids is not None:
+            return cmd.name in self.supported_pids
+        return self.obd_connection.supports(cmd)
+
+    def discover_pids(self):
+        """Find the mode 01 PIDs the vehicle supports, as loaded by the connection or from the support bitmaps.
+
+        The connection profile is the only cache of supported PIDs: the
+        bitmaps are only queried when the connection didn't load any command.
+        Watched commands the vehicle doesn't support stop being polled.
+        """
+        if self.obd_connection is None:
+            return
+        vehicle = self.vehicle_key()
+        supported = loaded_commands(self.obd_connection)
+        if supported:
+            logger.debug("Supported PIDs of %s loaded by the connection", vehicle)
+        else:
+            with self.serial_lock:
+                bitmaps = query_bitmaps(lambda cmd: self.obd_connection.query(cmd, force=True))
+            if not bitmaps:
+                # Leave support checks to the connection (e.g. a replayed trace without 0100)
+                logger.warning("Vehicle didn't answer the supported PIDs request")
+                return
+            supported = supported_commands(bitmaps)
+        self.supported_pids = supported
+        logger.info(f"{vehicle} supports {len(self.supported_pids)} mode 01 commands")
+        for cmd in self.POLL_RATES:
+            if cmd.mode == 1 and cmd.name not in self.supported_pids:
+                logger.warning(f"{cmd.name} isn't supported by the vehicle, no longer polling it")
+                self.scheduler.unwatch(cmd)
+
+    def vehicle_key(self):
+        """VIN of the vehicle, or the port name when it has no mode 09 support"""
+        from .ConnectionProfile import read_vin
+        vin = getattr(self.obd_connection, "vin", None)
+        if vin is None:
+            with self.serial_lock:
+                vin = read_vin(self.obd_connection)
+        return vin or f"port:{self.obd_connection.port_name()}"
+
+    def read_values(self, names):
+        """Read several commands by name in one call.
+
+        Returns ({name: (value, age)}, unknown, unsupported, unavailable).
+        Watched commands come from the snapshot store, the others are queried
+        together, batched into multi-PID requests when possible. Commands that
+        couldn't be read (link down, failed query) are listed as unavailable.
+        """
+        values = {}
+        unknown = []
+        unsupported = []
+        to_query = []
+        for name in names:
+            cmd = self.COMMANDS.get(name)
+            if cmd is None:
+                unknown.append(name)
+            elif not self.is_supported(cmd):
+                unsupported.append(name)
+            elif self.scheduler and self.scheduler.is_watched(cmd):
+                value, age, _ = self.read_snapshot(name)
+                values[name] = (value, age)
+            else:
+                to_query.append(cmd)
+        unavailable = []
+        if to_query:
+            queried = self.query_many(to_query)
+            for cmd in to_query:
+                if cmd.name in queried:
+                    values[cmd.name] = (serialize_value(queried[cmd.name]), 0.0)
+                else:
+                    unavailable.append(cmd.name)
+        return values, unknown, unsupported, unavailable
+
+    def query_many(self, cmds):
+        """Query several commands in as few round trips as possible, returning {name: value}"""
+        if self.obd_connection is None:
+            logger.error("OBD manager was not initialized.")
+            return {}
+        if not self.is_link_up():
+            return {}
+        try:
+            responses = self.batcher.query(cmds)
+        except Exception as e:
+            logger.error(f"Batched query failed: {e}")
+            return {}
+        return {name: response.value if response is not None else None for name, response in responses.items()}
+
+    def is_link_up(self):
+        return self.supervisor is None or self.supervisor.connected
+
+    def reopen(self):
+        """Replace the lost connection with a new one, returning True once connected"""
+        try:
+            self.obd_connection.close()
+        except Exception as e:
+            logger.debug("Closing the lost connection failed: %s", e)
+        try:
+            connection = self._open_connection()
+        except Exception as e:
+            logger.error(f"Connection error: {e}")
+            return False
+        if not connection.is_connected():
+            connection.close()
+            return False
+        self.obd_connection = connection
+        return True
+
+    def stop_polling(self):
+        if self.scheduler:
+            self.scheduler.stop()
+
+    def start_polling(self):
+        """Poll the watched commands on the current connection"""
+        self.batcher = BatchQuerier(self.obd_connection, self.serial_lock)
+        scheduler_batcher = None
+        if config.get_obd_batch_queries():
+            scheduler_batcher = self.batcher
+            logger.debug("Multi-PID batched queries enabled")
+        self.scheduler = PollScheduler(self.obd_connection, lock=self.serial_lock, batcher=scheduler_batcher)
+        for cmd, rate in self.POLL_RATES.items():
+            if cmd.mode == 1 and self.supported_pids is not None and cmd.name not in self.supported_pids:
+                continue
+            rate = config.get_poll_rate(cmd.name, fallback=rate)
+            callbacks = [self.snapshots.watcher(cmd.name)]
+            if cmd.name not in self.NON_NUMERIC:
+                # The history survives reconnections
+                if cmd.name not in self.history.buffers:
+                    self.history.add(cmd.name, rate)
+                callbacks.append(self.history.watcher(cmd.name))
+            self.scheduler.watch(cmd, rate, *callbacks)
+        self.scheduler.start()
+
     def main(self):
-        self.obd_connection.watch(obd.commands.SPEED)
-        self.obd_connection.watch(obd.commands.RPM)
-        self.obd_connection.watch(obd.commands.COOLANT_TEMP)
-        self.obd_connection.watch(obd.commands.FUEL_STATUS)
-        self.obd_connection.watch(obd.commands.THROTTLE_POS)
-        self.obd_connection.watch(obd.commands.GET_DTC)
-        self.obd_connection.start()
+        self.start_polling()
+        # A connection handed in by the caller (e.g. a benchmark replay) can't be reopened here
+        if self.supervised:
+            self.supervisor = ConnectionSupervisor(self).start()
 
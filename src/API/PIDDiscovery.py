@@ -0,0 +1,53 @@
+import obd
+
+# Mode 01 PID-support commands: 0100 describes PIDs 01-20, 0120 PIDs 21-40, ...
+# The last bit of each bitmap tells whether the next range is supported.
+BITMAP_COMMANDS = [cmd for cmd in obd.commands.pid_getters() if cmd.mode == 1]
+# Commands python-OBD marks as supported before reading any bitmap
+ALWAYS_SUPPORTED = set(obd.commands.base_commands()) | set(obd.commands.pid_getters())
+
+
+def to_bitmap(bits):
+    """Pack a decoded PID-support response (32 booleans) into an integer, PID base+1 first"""
+    bitmap = 0
+    for bit in bits:
+        bitmap = bitmap << 1 | bool(bit)
+    return bitmap
+
+
+def query_bitmaps(query):
+    """Query the mode 01 support bitmaps with query(cmd) -> OBDResponse, returning {base: bitmap}"""
+    bitmaps = {}
+    for cmd in BITMAP_COMMANDS:
+        base = cmd.pid
+        if base and not bitmaps.get(base - 0x20, 0) & 1:
+            break
+        response = query(cmd)
+        if response is None or response.is_null():
+            break
+        bitmaps[base] = to_bitmap(response.value)
+    return bitmaps
+
+
+def supported_commands(bitmaps):
+    """Names of the mode 01 commands the bitmaps mark as supported"""
+    names = set()
+    for base, bitmap in bitmaps.items():
+        for i in range(32):
+            pid = base + i + 1
+            if bitmap & (1 << (31 - i)) and obd.commands.has_pid(1, pid):
+                names.add(obd.commands[1][pid].name)
+    return names
+
+
+
+def loaded_commands(connection):
+    """Names of the mode 01 commands a python-OBD connection loaded as supported, empty if it loaded none.
+
+    ProfiledOBD loads them from the connection profile of the vehicle, obd.OBD
+    from the bitmaps it queries while connecting.
+    """
+    return {
+        cmd.name for cmd in getattr(connection, "supported_commands", ())
+        if cmd.mode == 1 and cmd not in ALWAYS_SUPPORTED
+    }
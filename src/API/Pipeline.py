@@ -0,0 +1,118 @@
+import asyncio
+import math
+from enum import Enum
+from ..UTILS.logger import Logger
+from ..UTILS.metrics import metrics_instance as metrics
+
+logger = Logger("Pipeline")
+
+
+class OverflowPolicy(Enum):
+    DROP_OLDEST = "drop_oldest"
+    BLOCK = "block"
+
+
+class Consumer:
+    """Pipeline stage fed through its own bounded queue.
+
+    With DROP_OLDEST a full queue discards its oldest sample, so a slow consumer
+    only loses history and never holds the sampler back. With BLOCK the sampler
+    waits for room, which delays every consumer but loses nothing. Blocking
+    handlers run in the default executor so they don't stall the event loop.
+    """
+
+    def __init__(self, name, handler, maxsize=100, overflow=OverflowPolicy.DROP_OLDEST, blocking=False):
+        self.name = name
+        self.handler = handler
+        self.maxsize = maxsize
+        self.overflow = OverflowPolicy(overflow)
+        self.blocking = blocking
+        self.queue = None
+        self.dropped = 0
+
+    async def put(self, sample):
+        if self.overflow is OverflowPolicy.BLOCK:
+            await self.queue.put(sample)
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.queue.task_done()
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 100 == 0:
+                logger.warning(f"{self.name} consumer is lagging, {self.dropped} samples dropped")
+        self.queue.put_nowait(sample)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            sample = await self.queue.get()
+            try:
+                if self.blocking:
+                    await loop.run_in_executor(None, self.handler, sample)
+                else:
+                    self.handler(sample)
+            except Exception as e:
+                logger.error(f"{self.name} consumer failed: {e}")
+            finally:
+                self.queue.task_done()
+
+
+class Pipeline:
+    """Samples at a fixed rate and fans every sample out to the consumers.
+
+    Ticks are scheduled from the previous deadline rather than from the end of
+    the previous tick, so the sampling period doesn't drift. Ticks missed while
+    the loop was busy are skipped instead of being run back to back.
+    """
+
+    def __init__(self, sampler, interval=1.0):
+        self.sampler = sampler
+        self.interval = interval
+        self.consumers = []
+        self.running = False
+        self.missed_ticks = 0
+
+    def add_consumer(self, consumer):
+        self.consumers.append(consumer)
+        return consumer
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for consumer in self.consumers:
+            consumer.queue = asyncio.Queue(maxsize=consumer.maxsize)
+            metrics.gauge(f"pipeline.{consumer.name}.queue_depth", consumer.queue.qsize)
+            metrics.gauge(f"pipeline.{consumer.name}.dropped", lambda consumer=consumer: consumer.dropped)
+        metrics.gauge("pipeline.missed_ticks", lambda: self.missed_ticks)
+        tasks = [loop.create_task(consumer.run()) for consumer in self.consumers]
+
+        self.running = True
+        next_tick = loop.time()
+        try:
+            while self.running:
+                try:
+                    sample = self.sampler()
+                except Exception as e:
+                    logger.error(f"Sampling failed: {e}")
+                    sample = None
+                if sample is not None:
+                    metrics.mark("pipeline.samples")
+                    for consumer in self.consumers:
+                        await consumer.put(sample)
+
+                next_tick += self.interval
+                late = loop.time() - next_tick
+                if late > 0:
+                    skipped = math.ceil(late / self.interval)
+                    self.missed_ticks += skipped
+                    next_tick += skipped * self.interval
+                await asyncio.sleep(max(0.0, next_tick - loop.time()))
+        finally:
+            # Let consumers drain what was already sampled before stopping them
+            for consumer in self.consumers:
+                if consumer.overflow is OverflowPolicy.BLOCK:
+                    await consumer.queue.join()
+            for task in tasks:
+                task.cancel()
+
+    def stop(self):
+        self.running = False
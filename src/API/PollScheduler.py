@@ -0,0 +1,221 @@
+import heapq
+import itertools
+import threading
+import time
+from ..UTILS.logger import Logger
+from ..UTILS.metrics import metrics_instance as metrics
+from .OBDBatch import MAX_BATCH_PIDS, is_batchable
+
+logger = Logger("Poll Scheduler")
+
+# python-OBD's default serial timeout: an empty reply that took this long timed out
+QUERY_TIMEOUT = 0.1
+
+
+def record_query(name, response, latency):
+    """Record the latency and outcome of one adapter query in the metrics"""
+    metrics.observe(f"obd.query.{name}", latency)
+    if response is None or response.is_null():
+        metrics.increment(f"obd.timeout.{name}" if latency >= QUERY_TIMEOUT else f"obd.no_data.{name}")
+    else:
+        metrics.mark("obd.samples")
+
+
+class PollEntry:
+    """Scheduling state of a single watched command"""
+
+    def __init__(self, cmd, rate, callbacks=()):
+        self.cmd = cmd
+        self.target_interval = 1.0 / rate
+        self.interval = self.target_interval
+        self.latency = 0.0
+        self.failures = 0
+        self.callbacks = list(callbacks)
+        self.response = None
+
+
+class PollScheduler:
+    """Polls each watched command at its own target rate from a deadline priority queue.
+
+    Commands are queried one at a time on a synchronous obd.OBD connection.
+    The query latency of every command is tracked, and when the ECU answers
+    too slowly for all target rates to fit on the link, intervals are stretched
+    proportionally. Commands that keep failing back off exponentially.
+
+    With a batcher, mode 01 commands that fall due within half an interval of
+    each other are sent together as one multi-PID request.
+    """
+
+    def __init__(self, connection, lock=None, batcher=None, max_utilization=0.9, max_backoff=60.0, latency_smoothing=0.2):
+        self.connection = connection
+        self.lock = lock or threading.Lock()
+        self.batcher = batcher
+        self.max_utilization = max_utilization
+        self.max_backoff = max_backoff
+        self.latency_smoothing = latency_smoothing
+
+        self.entries = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._stretch = 1.0
+        self.running = False
+        self.thread = None
+
+    def watch(self, cmd, rate, *callbacks):
+        """Poll cmd at rate Hz, calling each callback(response) after every query"""
+        if rate <= 0:
+            logger.warning(f"Ignoring {cmd.name}: polling rate must be positive")
+            return
+        with self._condition:
+            entry = self.entries.get(cmd.name)
+            if entry is None:
+                entry = PollEntry(cmd, rate, callbacks)
+                self.entries[cmd.name] = entry
+                heapq.heappush(self._heap, (time.monotonic(), next(self._counter), cmd.name))
+            else:
+                entry.target_interval = 1.0 / rate
+                entry.interval = entry.target_interval
+                entry.callbacks.extend(callbacks)
+            self._condition.notify()
+
+    def unwatch(self, cmd):
+        """Stop polling cmd"""
+        with self._condition:
+            self.entries.pop(cmd.name, None)
+
+    def is_watched(self, cmd):
+        return cmd.name in self.entries
+
+    def get_response(self, cmd):
+        """Return the last response received for a watched command"""
+        entry = self.entries.get(cmd.name)
+        return entry.response if entry else None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="PollScheduler")
+        self.thread.daemon = True
+        self.thread.start()
+        logger.debug(f"Polling {len(self.entries)} commands")
+
+    def stop(self):
+        with self._condition:
+            self.running = False
+            self._condition.notify()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def _next_due(self):
+        """Pop the next due command, waiting until its deadline"""
+        with self._condition:
+            while self.running:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                deadline, _, name = self._heap[0]
+                if name not in self.entries:
+                    heapq.heappop(self._heap)
+                    continue
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                return deadline, self.entries[name]
+            return None, None
+
+    def _pop_companions(self):
+        """Pop batchable commands falling due soon so they can share the current request"""
+        now = time.monotonic()
+        companions = []
+        with self._condition:
+            remaining = []
+            for item in sorted(self._heap):
+                deadline, _, name = item
+                entry = self.entries.get(name)
+                if (
+                    entry is not None
+                    and len(companions) < MAX_BATCH_PIDS - 1
+                    and is_batchable(entry.cmd)
+                    and deadline - now <= entry.interval / 2
+                ):
+                    companions.append((deadline, entry))
+                else:
+                    remaining.append(item)
+            if companions:
+                self._heap = remaining
+                heapq.heapify(self._heap)
+        return companions
+
+    def _run(self):
+        while self.running:
+            deadline, entry = self._next_due()
+            if entry is None:
+                break
+
+            due = [(deadline, entry)]
+            if self.batcher and self.batcher.enabled and is_batchable(entry.cmd):
+                due += self._pop_companions()
+
+            started = time.monotonic()
+            try:
+                if len(due) > 1:
+                    responses = self.batcher.query([e.cmd for _, e in due])
+                else:
+                    with self.lock:
+                        responses = {entry.cmd.name: self.connection.query(entry.cmd)}
+            except Exception as e:
+                logger.error(f"Polling {', '.join(e.cmd.name for _, e in due)} failed: {e}")
+                responses = {}
+            finished = time.monotonic()
+
+            latency = (finished - started) / len(due)
+            for due_deadline, due_entry in due:
+                self._complete(due_entry, due_deadline, responses.get(due_entry.cmd.name), latency, finished)
+
+    def _complete(self, entry, deadline, response, latency, finished):
+        self._record(entry, response, latency)
+        entry.response = response
+        for callback in entry.callbacks:
+            try:
+                callback(response)
+            except Exception as e:
+                logger.error(f"Callback for {entry.cmd.name} failed: {e}")
+
+        # Late commands are rescheduled from now rather than from their
+        # missed deadline so a slow reply doesn't cause a burst of catch-up queries.
+        next_deadline = max(deadline + entry.interval, finished)
+        with self._condition:
+            if entry.cmd.name in self.entries:
+                heapq.heappush(self._heap, (next_deadline, next(self._counter), entry.cmd.name))
+
+    def _record(self, entry, response, latency):
+        """Update latency statistics and adapt the polling interval of entry"""
+        record_query(entry.cmd.name, response, latency)
+        if entry.latency == 0.0:
+            entry.latency = latency
+        else:
+            entry.latency += self.latency_smoothing * (latency - entry.latency)
+
+        if response is None or response.is_null():
+            entry.failures += 1
+            backoff = entry.target_interval * (2 ** min(entry.failures, 16))
+            entry.interval = min(backoff, max(self.max_backoff, entry.target_interval))
+            return
+
+        entry.failures = 0
+        self._rebalance()
+
+    def _rebalance(self):
+        """Stretch all intervals when the link can't keep up with the target rates"""
+        entries = [entry for entry in list(self.entries.values()) if not entry.failures]
+        utilization = sum(entry.latency / entry.target_interval for entry in entries)
+        stretch = max(1.0, utilization / self.max_utilization)
+        if abs(stretch - self._stretch) > 0.1:
+            logger.debug(f"Link utilization {utilization:.2f}, stretching polling intervals by {stretch:.2f}")
+        self._stretch = stretch
+        for entry in entries:
+            entry.interval = entry.target_interval * stretch
@@ -0,0 +1,168 @@
+import json
+import threading
+import time
+from obd import OBDResponse, OBDStatus
+from obd.elm327 import ELM327
+from ..UTILS.logger import Logger
+
+logger = Logger("Replay")
+
+# Traces are JSONL files: a header line, then one line per adapter exchange
+TRACE_VERSION = 1
+# Used when a trace was recorded before the protocol could be detected
+DEFAULT_PROTOCOL = "6"
+
+
+def normalize_request(request):
+    """Strip the response count python-OBD appends in fast mode (010D1 -> 010D)"""
+    request = request.decode() if isinstance(request, bytes) else str(request)
+    request = request.strip().upper()
+    if len(request) % 2:
+        request = request[:-1]
+    return request
+
+
+def frame_lines(messages):
+    """Raw adapter lines behind parsed messages, enough for the protocol to parse them again"""
+    return [frame.raw for message in messages or () for frame in message.frames]
+
+
+class RecordingInterface:
+    """Wraps an ELM327 interface and appends every exchange to a trace file"""
+
+    def __init__(self, interface, output):
+        self.interface = interface
+        self.output = output
+        self.lock = threading.Lock()
+        self.last_request = None
+
+    def __getattr__(self, name):
+        return getattr(self.interface, name)
+
+    def send_and_parse(self, cmd):
+        start = time.monotonic()
+        messages = self.interface.send_and_parse(cmd)
+        latency = time.monotonic() - start
+        # An empty command repeats the previous one
+        request = normalize_request(cmd) if cmd else self.last_request
+        self.last_request = request
+        self.write({"request": request, "lines": frame_lines(messages), "latency": round(latency, 6)})
+        return messages
+
+    def write(self, entry):
+        with self.lock:
+            self.output.write(json.dumps(entry) + "\n")
+            self.output.flush()
+
+
+def record(connection, path):
+    """Start recording the traffic of an obd.OBD connection to path"""
+    output = open(path, "w")
+    interface = connection.interface
+    init_lines = frame_lines(interface.send_and_parse(b"0100"))
+    recorder = RecordingInterface(interface, output)
+    recorder.write({
+        "version": TRACE_VERSION,
+        "protocol": connection.protocol_id() or DEFAULT_PROTOCOL,
+        "init": init_lines,
+        "recorded_at": time.time(),
+    })
+    connection.interface = recorder
+    logger.info(f"Recording adapter traffic to {path}")
+    return recorder
+
+
+def load_trace(path):
+    """Return (header, {request: [(lines, latency), ...]}) from a trace file"""
+    exchanges = {}
+    with open(path) as trace:
+        header = json.loads(trace.readline())
+        if header.get("version") != TRACE_VERSION:
+            raise ValueError(f"Unsupported trace version: {header.get('version')}")
+        for line in trace:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            exchanges.setdefault(entry["request"], []).append((entry["lines"], entry["latency"]))
+    return header, exchanges
+
+
+class ReplayInterface:
+    """Answers requests with the adapter lines recorded for them, in recorded order.
+
+    The responses recorded for each request are cycled through, so a trace can
+    be replayed for longer than it was recorded. speed scales the recorded
+    latencies: 1.0 replays in real time, 0 as fast as possible.
+    """
+
+    def __init__(self, header, exchanges, speed=1.0):
+        self.exchanges = exchanges
+        self.speed = speed
+        self.positions = {}
+        self.last_request = None
+        self.protocol = ELM327._SUPPORTED_PROTOCOLS[header["protocol"]](header["init"])
+
+    def send_and_parse(self, cmd):
+        request = normalize_request(cmd) if cmd else self.last_request
+        self.last_request = request
+        responses = self.exchanges.get(request)
+        if not responses:
+            return []
+        position = self.positions.get(request, 0)
+        self.positions[request] = position + 1
+        lines, latency = responses[position % len(responses)]
+        if self.speed > 0 and latency > 0:
+            time.sleep(latency / self.speed)
+        return self.protocol(lines)
+
+    def protocol_id(self):
+        return self.protocol.ELM_ID
+
+    def protocol_name(self):
+        return self.protocol.ELM_NAME
+
+    def status(self):
+        return OBDStatus.CAR_CONNECTED
+
+    def close(self):
+        pass
+
+
+class ReplayConnection:
+    """Stands in for obd.OBD, answering queries from a recorded trace"""
+
+    def __init__(self, path, speed=1.0):
+        self.path = path
+        header, exchanges = load_trace(path)
+        self.interface = ReplayInterface(header, exchanges, speed)
+        self.requests = set(exchanges)
+        logger.info(f"Replaying {sum(len(r) for r in exchanges.values())} exchanges from {path}")
+
+    def query(self, cmd, force=False):
+        if not force and not self.supports(cmd):
+            return OBDResponse()
+        messages = self.interface.send_and_parse(cmd.command)
+        if not messages:
+            return OBDResponse()
+        return cmd(messages)
+
+    def supports(self, cmd):
+        return normalize_request(cmd.command) in self.requests
+
+    def status(self):
+        return self.interface.status()
+
+    def is_connected(self):
+        return True
+
+    def protocol_id(self):
+        return self.interface.protocol_id()
+
+    def protocol_name(self):
+        return self.interface.protocol_name()
+
+    def port_name(self):
+        return self.path
+
+    def close(self):
+        self.interface.close()
@@ -0,0 +1,75 @@
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ..UTILS.logger import Logger
+from ..UTILS.metrics import metrics_instance as metrics
+
+logger = Logger("Request Dispatcher")
+
+# Worker pools of the requests that don't answer from memory
+DATABASE = "database"
+OBD = "obd"
+
+# Ids sent by clients are below SERVER_IDS; the ids the server gives have this high bit set
+SERVER_IDS = 0x80000000
+
+
+def is_client_request_id(value):
+    """Whether value is an id a client may number its request with"""
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value < SERVER_IDS
+
+
+class RequestDispatcher:
+    """Runs slow BLE requests on worker threads, so the GATT callbacks return at once.
+
+    Database requests share a pool of workers, each reading through its own
+    SQLite connection, so several clients never wait for each other. Requests
+    going to the adapter run one at a time on a single worker: the serial link
+    answers one query at a time anyway, and the polling thread gets its turn
+    between them. Requests complete in any order, each response carrying the
+    id of its request.
+    """
+
+    def __init__(self, handler, respond, database_workers=4):
+        # handler(request, request_id) builds the response, respond(request_id, response) sends it
+        self.handler = handler
+        self.respond = respond
+        self.pools = {
+            DATABASE: ThreadPoolExecutor(database_workers, thread_name_prefix="BLE database"),
+            OBD: ThreadPoolExecutor(1, thread_name_prefix="BLE OBD"),
+        }
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.pending = 0
+        metrics.gauge("ble.pending_requests", lambda: self.pending)
+
+    def next_request_id(self):
+        """Id given to a request the client didn't number itself, never one a client may use"""
+        return SERVER_IDS | next(self.ids) % SERVER_IDS
+
+    def submit(self, pool, request, request_id):
+        with self.lock:
+            self.pending += 1
+        try:
+            self.pools[pool].submit(self._run, request, request_id)
+        except RuntimeError:
+            # Shutting down
+            with self.lock:
+                self.pending -= 1
+            raise
+
+    def _run(self, request, request_id):
+        try:
+            response = self.handler(request, request_id)
+            if response is not None:
+                self.respond(request_id, response)
+        except Exception as e:
+            logger.error(f"Request {request_id} failed: {e}")
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def shutdown(self):
+        """Drop the queued requests, letting the running ones finish in the background"""
+        for pool in self.pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,214 @@
+import datetime
+
+# Rollup resolutions in seconds, from the finest to the coarsest
+RESOLUTIONS = (1, 10, 60)
+# Numeric reading columns aggregated in the rollup tables, with their row index
+SIGNALS = {
+    "speed": 2,
+    "rpm": 3,
+    "coolant_temp": 5,
+}
+
+UPSERT_ROLLUP_SQL = '''
+    INSERT INTO rollup_{resolution}s (session_id, signal, bucket, min, max, sum, count)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (session_id, signal, bucket) DO UPDATE SET
+        min = MIN(min, excluded.min),
+        max = MAX(max, excluded.max),
+        sum = sum + excluded.sum,
+        count = count + excluded.count
+'''
+
+
+def to_epoch(timestamp):
+    """Epoch seconds of a stored timestamp, matching SQLite's strftime('%s', timestamp, 'utc')
+
+    Timestamps are stored as naive local time, so they are converted with the local zone.
+    """
+    if isinstance(timestamp, str):
+        timestamp = datetime.datetime.fromisoformat(timestamp)
+    return timestamp.timestamp()
+
+
+def from_epoch(epoch):
+    """Timestamp text comparable with the stored timestamps"""
+    return str(datetime.datetime.fromtimestamp(epoch))
+
+
+def create_rollup_tables(cursor):
+    for resolution in RESOLUTIONS:
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS rollup_{resolution}s (
+                session_id INTEGER,
+                signal TEXT,
+                bucket INTEGER,
+                min REAL,
+                max REAL,
+                sum REAL,
+                count INTEGER,
+                PRIMARY KEY (session_id, signal, bucket)
+            ) WITHOUT ROWID
+        ''')
+
+
+def update_rollups(connection, rows):
+    """Fold reading rows into every rollup table, inside the caller's transaction.
+
+    rows are (session_id, timestamp, speed, rpm, fuel_status, coolant_temp, dtc)
+    tuples. They are pre-aggregated per bucket so each bucket costs one upsert.
+    """
+    for resolution in RESOLUTIONS:
+        buckets = {}
+        for row in rows:
+            bucket = int(to_epoch(row[1]) // resolution * resolution)
+            for signal, index in SIGNALS.items():
+                value = row[index]
+                if value is None:
+                    continue
+                key = (row[0], signal, bucket)
+                current = buckets.get(key)
+                if current is None:
+                    buckets[key] = [value, value, value, 1]
+                else:
+                    current[0] = min(current[0], value)
+                    current[1] = max(current[1], value)
+                    current[2] += value
+                    current[3] += 1
+        connection.executemany(
+            UPSERT_ROLLUP_SQL.format(resolution=resolution),
+            [key + tuple(aggregate) for key, aggregate in buckets.items()],
+        )
+
+
+def choose_resolution(span, max_points):
+    """Finest rollup resolution giving at most max_points points over span seconds, else the coarsest"""
+    for resolution in RESOLUTIONS:
+        if span / resolution <= max_points:
+            return resolution
+    return RESOLUTIONS[-1]
+
+
+def _raw_history(connection, session_id, signal, start, end, limit, archive=None):
+    if archive is not None:
+        timestamps, values = archive.select(("timestamp", signal), start, end)
+        rows = [(timestamp, value, value, value, 1) for timestamp, value in zip(timestamps, values) if value is not None]
+        return rows[:limit]
+    cursor = connection.execute(f'''
+        SELECT timestamp, {signal} FROM readings
+        WHERE session_id = ? AND timestamp BETWEEN ? AND ? AND {signal} IS NOT NULL
+        ORDER BY timestamp
+        LIMIT ?
+    ''', (session_id, from_epoch(start), from_epoch(end), limit))
+    return [(to_epoch(timestamp), value, value, value, 1) for timestamp, value in cursor]
+
+
+def fetch_history(connection, session_id, signal, start, end, max_points, archive=None):
+    """Return (resolution, rows) with rows as (bucket, min, max, avg, count) tuples.
+
+    Raw readings are returned as single-sample buckets when there are no more
+    than max_points of them, which is only looked for over spans the 1 s rollup
+    covers in max_points buckets. They are read from archive instead of the
+    readings table when the session is archived. Otherwise rows come from the
+    finest rollup within max_points, or a coarser one when a downsampled
+    session no longer has it.
+    """
+    if signal not in SIGNALS:
+        raise ValueError(f"Unknown signal: {signal}")
+    resolution = choose_resolution(end - start, max_points)
+    if end - start <= max_points * RESOLUTIONS[0]:
+        rows = _raw_history(connection, session_id, signal, start, end, max_points + 1, archive)
+        if len(rows) <= max_points:
+            return 0, rows
+
+    rows = []
+    for resolution in RESOLUTIONS[RESOLUTIONS.index(resolution):]:
+        rows = connection.execute(f'''
+            SELECT bucket, min, max, sum / count, count FROM rollup_{resolution}s
+            WHERE session_id = ? AND signal = ? AND bucket BETWEEN ? AND ?
+            ORDER BY bucket
+        ''', (session_id, signal, int(start // resolution * resolution), int(end))).fetchall()
+        if rows:
+            break
+    return resolution, rows
+
+
+def percentile(sorted_values, p):
+    """Linearly interpolated p-th percentile of an already sorted list"""
+    position = (len(sorted_values) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def _archive_aggregates(archive, signal, first, last, bucket, percentiles):
+    values = {}
+    for columns in archive.iter_columns(("timestamp", signal), first, last):
+        for timestamp, value in zip(*columns):
+            if value is not None and timestamp < last:
+                values.setdefault(int(timestamp) // bucket * bucket, []).append(value)
+    rows = []
+    for bucket_start in sorted(values):
+        bucket_values = sorted(values[bucket_start])
+        rows.append((
+            bucket_start, bucket_values[0], bucket_values[-1], sum(bucket_values) / len(bucket_values), len(bucket_values),
+            [percentile(bucket_values, p) for p in percentiles],
+        ))
+    return rows
+
+
+def fetch_range_aggregates(connection, session_id, signal, start, end, bucket, percentiles=(), archive=None):
+    """Aggregate a signal over start..end (epoch seconds) in buckets of bucket seconds.
+
+    Returns (bucket start, min, max, avg, count, [percentiles...]) rows. Every
+    path aggregates whole buckets, from the start of the bucket holding start to
+    the end of the bucket holding end, since rollups can't split one. Without
+    percentiles, buckets that are a multiple of a rollup resolution are merged
+    from the rollup tables. Otherwise min/max/avg are computed by SQLite over
+    the indexed readings, and percentiles from the values it returns sorted per
+    bucket, or all of them from the decoded columns of archive.
+    """
+    if signal not in SIGNALS:
+        raise ValueError(f"Unknown signal: {signal}")
+    bucket = max(1, int(bucket))
+    # Bucket aligned bounds, the last one excluded
+    first = int(start // bucket * bucket)
+    last = int(end // bucket * bucket) + bucket
+
+    resolution = next((r for r in reversed(RESOLUTIONS) if bucket % r == 0), None)
+    if not percentiles and resolution is not None:
+        cursor = connection.execute(f'''
+            SELECT bucket / :bucket * :bucket AS start, MIN(min), MAX(max), SUM(sum) / SUM(count), SUM(count)
+            FROM rollup_{resolution}s
+            WHERE session_id = :session_id AND signal = :signal AND bucket >= :first AND bucket < :last
+            GROUP BY start
+            ORDER BY start
+        ''', {"bucket": bucket, "session_id": session_id, "signal": signal, "first": first, "last": last})
+        return [row + ([],) for row in cursor]
+    if archive is not None:
+        return _archive_aggregates(archive, signal, first, last, bucket, percentiles)
+
+    bounds = (session_id, from_epoch(first), from_epoch(last))
+    bucket_sql = "CAST(strftime('%s', timestamp, 'utc') AS INTEGER) / ? * ?"
+    rows = connection.execute(f'''
+        SELECT {bucket_sql} AS start, MIN({signal}), MAX({signal}), AVG({signal}), COUNT({signal})
+        FROM readings
+        WHERE session_id = ? AND timestamp >= ? AND timestamp < ? AND {signal} IS NOT NULL
+        GROUP BY start
+        ORDER BY start
+    ''', (bucket, bucket) + bounds).fetchall()
+    if not percentiles:
+        return [row + ([],) for row in rows]
+
+    values = {}
+    cursor = connection.execute(f'''
+        SELECT {bucket_sql} AS start, {signal}
+        FROM readings
+        WHERE session_id = ? AND timestamp >= ? AND timestamp < ? AND {signal} IS NOT NULL
+        ORDER BY start, {signal}
+    ''', (bucket, bucket) + bounds)
+    for bucket_start, value in cursor:
+        values.setdefault(bucket_start, []).append(value)
+    return [
+        row + ([percentile(values[row[0]], p) for p in percentiles],)
+        for row in rows
+    ]
@@ -0,0 +1,47 @@
+import itertools
+import time
+from collections import namedtuple
+
+Snapshot = namedtuple("Snapshot", ["value", "timestamp", "monotonic", "seq"])
+
+
+class SnapshotStore:
+    """Latest value of every polled command, readable from any thread without locking.
+
+    Every update replaces the command's entry with a new immutable Snapshot.
+    Dict assignment is atomic under the GIL, so readers always get a complete
+    (value, timestamp, seq) triple and never wait on the sampler.
+    """
+
+    def __init__(self):
+        self._snapshots = {}
+        self._seq = itertools.count(1)
+
+    def update(self, name, value):
+        """Store a new value for command name"""
+        self._snapshots[name] = Snapshot(value, time.time(), time.monotonic(), next(self._seq))
+
+    def get(self, name):
+        """Return the latest Snapshot of command name, or None if it was never received"""
+        return self._snapshots.get(name)
+
+    def age(self, name):
+        """Seconds elapsed since command name was last updated, or None"""
+        snapshot = self._snapshots.get(name)
+        if snapshot is None:
+            return None
+        return time.monotonic() - snapshot.monotonic
+
+    def newest(self):
+        """Monotonic time of the most recent update of any command, or None"""
+        return max((snapshot.monotonic for snapshot in list(self._snapshots.values())), default=None)
+
+    def names(self):
+        return list(self._snapshots)
+
+    def watcher(self, name):
+        """Build a poll callback that stores every non-null response of command name"""
+        def callback(response):
+            if response is not None and not response.is_null():
+                self.update(name, response.value)
+        return callback
@@ -0,0 +1,99 @@
+import json
+import mmap
+import os
+import struct
+from ..UTILS.logger import Logger
+
+logger = Logger("Spool")
+
+# File layout: header <8sQ (magic, bytes of records), then the records, each a
+# <I length followed by a JSON encoded row. The header is only updated once a
+# record is completely written, so a crash never exposes a partial record.
+MAGIC = b"OBDSPOOL"
+HEADER = struct.Struct("<8sQ")
+RECORD = struct.Struct("<I")
+INITIAL_SIZE = 1 << 20
+
+
+class Spool:
+    """Append-only file of rows, memory-mapped, holding readings the database couldn't take.
+
+    Appending is a memory copy plus an msync, so spooling never waits on the
+    database. The file doubles in size whenever it is full. It is not thread
+    safe: callers serialize access (the batch writer thread, or the manager lock).
+    """
+
+    def __init__(self, path, initial_size=INITIAL_SIZE):
+        self.path = path
+        # Monotonic time before which the database isn't retried (set by the writer after a failure)
+        self.retry_at = 0.0
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = os.fstat(self.fd).st_size
+        if size < HEADER.size:
+            size = max(initial_size, HEADER.size)
+            os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size)
+        magic, self.end = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or HEADER.size + self.end > size:
+            if magic != b"\0" * len(MAGIC):
+                logger.warning(f"Ignoring corrupted spool {path}")
+            self.end = 0
+            self._write_header()
+        self.count = sum(1 for _ in self._records())
+        if self.count:
+            logger.warning(f"{self.count} readings are waiting in the spool {path}")
+
+    @property
+    def pending(self):
+        return self.count > 0
+
+    def append(self, rows):
+        data = b"".join(
+            RECORD.pack(len(encoded)) + encoded
+            for encoded in (json.dumps(row, default=str, separators=(',', ':')).encode("utf-8") for row in rows)
+        )
+        needed = HEADER.size + self.end + len(data)
+        if needed > len(self.map):
+            self._grow(needed)
+        start = HEADER.size + self.end
+        self.map[start:start + len(data)] = data
+        self.end += len(data)
+        self._write_header()
+        self.count += len(rows)
+
+    def read(self):
+        """Yield the spooled rows, oldest first"""
+        for start, length in self._records():
+            yield json.loads(self.map[start:start + length])
+
+    def clear(self):
+        self.end = 0
+        self.count = 0
+        self._write_header()
+
+    def close(self):
+        self.map.close()
+        os.close(self.fd)
+
+    def _records(self):
+        offset = HEADER.size
+        limit = HEADER.size + self.end
+        while offset + RECORD.size <= limit:
+            (length,) = RECORD.unpack_from(self.map, offset)
+            offset += RECORD.size
+            if offset + length > limit:
+                break
+            yield offset, length
+            offset += length
+
+    def _write_header(self):
+        HEADER.pack_into(self.map, 0, MAGIC, self.end)
+        self.map.flush()
+
+    def _grow(self, needed):
+        size = len(self.map)
+        while size < needed:
+            size *= 2
+        self.map.close()
+        os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size)
@@ -0,0 +1,121 @@
+import math
+import time
+from array import array
+
+
+class RingBuffer:
+    """Fixed-capacity ring of (timestamp, value) samples stored in flat arrays.
+
+    Timestamps are float64 epoch seconds and values float32, so a sample costs
+    12 bytes whatever its type, and nothing is allocated after construction.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = max(1, int(capacity))
+        self.timestamps = array("d", bytes(8 * self.capacity))
+        self.values = array("f", bytes(4 * self.capacity))
+        self._timestamps_view = memoryview(self.timestamps)
+        self._values_view = memoryview(self.values)
+        self.head = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, timestamp, value):
+        head = self.head
+        self.timestamps[head] = timestamp
+        self.values[head] = value
+        self.head = (head + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    def _physical(self, index):
+        """Physical position of the index-th oldest sample"""
+        return (self.head - self.size + index) % self.capacity
+
+    def _first_after(self, since):
+        """Logical index of the oldest sample with a timestamp >= since"""
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamps[self._physical(middle)] < since:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def window(self, seconds, now=None):
+        """Return the samples of the last seconds as (timestamps, values) memoryview segments.
+
+        The views share memory with the buffer (no copy), so the window is split
+        in two segments when it wraps around the end of the arrays. They are
+        overwritten by later appends and should be consumed right away.
+        """
+        now = time.time() if now is None else now
+        first = self._first_after(now - seconds)
+        count = self.size - first
+        if count <= 0:
+            return []
+        start = self._physical(first)
+        end = start + count
+        if end <= self.capacity:
+            return [(self._timestamps_view[start:end], self._values_view[start:end])]
+        end -= self.capacity
+        return [
+            (self._timestamps_view[start:], self._values_view[start:]),
+            (self._timestamps_view[:end], self._values_view[:end]),
+        ]
+
+
+class TelemetryBuffer:
+    """Per-command ring buffers holding the last window_seconds of numeric samples"""
+
+    def __init__(self, window_seconds=600.0):
+        self.window_seconds = window_seconds
+        self.buffers = {}
+
+    def add(self, name, rate):
+        """Allocate a buffer for command name polled at rate Hz"""
+        capacity = math.ceil(self.window_seconds * rate * 1.2) + 1
+        self.buffers[name] = RingBuffer(capacity)
+
+    def record(self, name, value, timestamp=None):
+        buffer = self.buffers.get(name)
+        if buffer is not None:
+            buffer.append(time.time() if timestamp is None else timestamp, value)
+
+    def watcher(self, name):
+        """Build a poll callback that records every numeric response of command name"""
+        def callback(response):
+            if response is not None and not response.is_null() and hasattr(response.value, "magnitude"):
+                self.record(name, float(response.value.magnitude))
+        return callback
+
+    def window(self, name, seconds):
+        buffer = self.buffers.get(name)
+        return buffer.window(seconds) if buffer is not None else []
+
+    def iter_samples(self, name, seconds, after=None):
+        """Yield (timestamp, value) samples of the last seconds newer than after"""
+        for timestamps, values in self.window(name, seconds):
+            for timestamp, value in zip(timestamps, values):
+                if after is None or timestamp > after:
+                    yield timestamp, value
+
+    def stats(self, name, seconds):
+        """Count, min, max and mean of command name over the last seconds"""
+        count = 0
+        total = 0.0
+        low = math.inf
+        high = -math.inf
+        for _, values in self.window(name, seconds):
+            if not len(values):
+                continue
+            count += len(values)
+            total += sum(values)
+            low = min(low, min(values))
+            high = max(high, max(values))
+        if not count:
+            return {"count": 0, "min": None, "max": None, "avg": None}
+        return {"count": count, "min": low, "max": high, "avg": total / count}
@@ -0,0 +1,138 @@
+import numpy as np
+
+# Acceleration thresholds for harsh events, in m/s²
+HARSH_ACCELERATION = 3.0
+HARSH_BRAKING = -3.0
+# Intervals longer than this (in seconds) are treated as gaps in the recording
+MAX_GAP = 60.0
+
+RPM_BINS = np.array([0, 1000, 2000, 3000, 4000, 5000, 6000, 7000, np.inf])
+SPEED_BINS = np.array([0, 10, 30, 50, 70, 90, 110, 130, np.inf])
+# Coolant temperature bands in °C: cold, warming up, normal, hot, overheating
+TEMPERATURE_BANDS = np.array([-np.inf, 60, 80, 100, 110, np.inf])
+
+LOAD_COLUMNS_SQL = '''
+    SELECT id, (julianday(timestamp) - 2440587.5) * 86400.0, speed, rpm, coolant_temp
+    FROM readings
+    WHERE session_id = ? AND id > ?
+    ORDER BY id
+'''
+
+
+def _rising_edges(mask, previous):
+    """Count the False -> True transitions of mask, previous being the state before mask[0]"""
+    if not len(mask):
+        return 0
+    before = np.concatenate(([previous], mask[:-1]))
+    return int(np.count_nonzero(mask & ~before))
+
+
+class TripMetrics:
+    """Derived metrics of one session, computed over NumPy columns of its readings.
+
+    update() only processes readings newer than the last one seen. The last
+    sample and the harsh-event state are carried over, so feeding a session in
+    several chunks gives the same result as processing it at once.
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.last_id = 0
+        self.last_sample = None
+        self.harsh_acceleration_active = False
+        self.harsh_braking_active = False
+
+        self.samples = 0
+        self.duration = 0.0
+        self.distance = 0.0
+        self.idle_time = 0.0
+        self.max_acceleration = 0.0
+        self.max_deceleration = 0.0
+        self.harsh_accelerations = 0
+        self.harsh_brakings = 0
+        self.rpm_histogram = np.zeros(len(RPM_BINS) - 1)
+        self.speed_histogram = np.zeros(len(SPEED_BINS) - 1)
+        self.temperature_bands = np.zeros(len(TEMPERATURE_BANDS) - 1)
+
+    def update_from(self, connection, chunk_size=50000):
+        """Load and process the readings added since the last update, chunk_size rows at a time"""
+        cursor = connection.execute(LOAD_COLUMNS_SQL, (self.session_id, self.last_id))
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                columns = np.array(rows, dtype=float)
+                self.update(columns[:, 1], columns[:, 2], columns[:, 3], columns[:, 4])
+                self.last_id = int(columns[-1, 0])
+        finally:
+            cursor.close()
+        return self
+
+    def update_from_archive(self, archive):
+        """Process the archived readings added since the last update, one archive block at a time"""
+        for ids, timestamps, speed, rpm, coolant_temp in archive.iter_columns(
+            ("id", "timestamp", "speed", "rpm", "coolant_temp"), after_id=self.last_id
+        ):
+            columns = np.array([timestamps, speed, rpm, coolant_temp], dtype=float)
+            self.update(*columns)
+            self.last_id = ids[-1]
+        return self
+
+    def update(self, timestamps, speed, rpm, coolant_temp):
+        """Fold new samples (epoch seconds, km/h, rpm, °C arrays) into the metrics"""
+        if not len(timestamps):
+            return
+        self.samples += len(timestamps)
+        speed = np.nan_to_num(speed)
+        rpm = np.nan_to_num(rpm)
+        if self.last_sample is not None:
+            timestamps, speed, rpm, coolant_temp = (
+                np.concatenate(([previous], column))
+                for previous, column in zip(self.last_sample, (timestamps, speed, rpm, coolant_temp))
+            )
+        self.last_sample = (timestamps[-1], speed[-1], rpm[-1], coolant_temp[-1])
+        if len(timestamps) < 2:
+            return
+
+        dt = np.diff(timestamps)
+        valid = (dt > 0) & (dt <= MAX_GAP)
+        dt = np.where(valid, dt, 0.0)
+        self.duration += dt.sum()
+
+        # Trapezoidal integration of speed, converted to m/s
+        velocity = speed / 3.6
+        self.distance += float(np.sum((velocity[1:] + velocity[:-1]) / 2 * dt))
+
+        acceleration = np.divide(np.diff(velocity), dt, out=np.zeros_like(dt), where=valid)
+        self.max_acceleration = max(self.max_acceleration, float(acceleration.max(initial=0.0)))
+        self.max_deceleration = min(self.max_deceleration, float(acceleration.min(initial=0.0)))
+        accelerating = valid & (acceleration >= HARSH_ACCELERATION)
+        braking = valid & (acceleration <= HARSH_BRAKING)
+        self.harsh_accelerations += _rising_edges(accelerating, self.harsh_acceleration_active)
+        self.harsh_brakings += _rising_edges(braking, self.harsh_braking_active)
+        self.harsh_acceleration_active = bool(accelerating[-1])
+        self.harsh_braking_active = bool(braking[-1])
+
+        # Every interval is attributed to the state at its start
+        self.idle_time += float(dt[(speed[:-1] == 0) & (rpm[:-1] > 0)].sum())
+        self.rpm_histogram += np.histogram(rpm[:-1], bins=RPM_BINS, weights=dt)[0]
+        self.speed_histogram += np.histogram(speed[:-1], bins=SPEED_BINS, weights=dt)[0]
+        known = ~np.isnan(coolant_temp[:-1])
+        self.temperature_bands += np.histogram(coolant_temp[:-1][known], bins=TEMPERATURE_BANDS, weights=dt[known])[0]
+
+    def to_dict(self):
+        return {
+            "session_id": self.session_id,
+            "samples": self.samples,
+            "duration": round(float(self.duration), 1),
+            "distance": round(self.distance / 1000, 3),
+            "idle_time": round(self.idle_time, 1),
+            "max_acceleration": round(self.max_acceleration, 2),
+            "max_deceleration": round(self.max_deceleration, 2),
+            "harsh_accelerations": self.harsh_accelerations,
+            "harsh_brakings": self.harsh_brakings,
+            "rpm_histogram": [round(float(s), 1) for s in self.rpm_histogram],
+            "speed_histogram": [round(float(s), 1) for s in self.speed_histogram],
+            "temperature_bands": [round(float(s), 1) for s in self.temperature_bands],
+        }
@@ -26,12 +26,152 @@ class Config:
     def get_bluetooth_char_uuid(self):
         return self.config.get('Bluetooth server', 'char_uuid')
 
+    def get_bluetooth_request_workers(self, fallback=4):
+        return self.config.getint('Bluetooth server', 'request_workers', fallback=fallback)
+
     # OBD connection configuration
     def get_obd_portstr(self):
-        return self.config.get('OBD connection', 'obd_portstr')
+        # Empty means scan the serial ports
+        return self.config.get('OBD connection', 'obd_portstr') or None
 
     def get_obd_baudrate(self, fallback=None):
-        return self.config.getint('OBD connection', 'obd_baudrate', fallback=fallback)
+        # Left empty in the template, meaning auto-detect
+        baudrate = self.config.get('OBD connection', 'obd_baudrate', fallback=None)
+        return int(baudrate) if baudrate else fallback
+
+    def get_obd_batch_queries(self, fallback=False):
+        return self.config.getboolean('OBD connection', 'batch_queries', fallback=fallback)
+
+    def get_obd_profile_path(self, fallback=None):
+        return self.config.get('OBD connection', 'profile_path', fallback=fallback) or fallback
+
+    def get_obd_record_trace(self, fallback=None):
+        return self.config.get('OBD connection', 'record_trace', fallback=fallback) or fallback
+
+    def get_obd_replay_trace(self, fallback=None):
+        return self.config.get('OBD connection', 'replay_trace', fallback=fallback) or fallback
+
+    def get_obd_replay_speed(self, fallback=1.0):
+        return self.config.getfloat('OBD connection', 'replay_speed', fallback=fallback)
+
+    def get_obd_stale_timeout(self, fallback=5.0):
+        return self.config.getfloat('OBD connection', 'stale_timeout', fallback=fallback)
+
+    def get_obd_reconnect_initial_backoff(self, fallback=0.5):
+        return self.config.getfloat('OBD connection', 'reconnect_initial_backoff', fallback=fallback)
+
+    def get_obd_reconnect_max_backoff(self, fallback=30.0):
+        return self.config.getfloat('OBD connection', 'reconnect_max_backoff', fallback=fallback)
+
+    def get_poll_rate(self, command_name, fallback=None):
+        return self.config.getfloat('OBD polling', command_name.lower(), fallback=fallback)
+
+    def get_history_window(self, fallback=600.0):
+        return self.config.getfloat('OBD polling', 'history_window', fallback=fallback)
+
+    # Database configuration
+    def get_db_path(self, fallback="obd_data.db"):
+        return self.config.get('Database', 'db_path', fallback=fallback)
+
+    def get_db_write_mode(self, fallback="direct"):
+        return self.config.get('Database', 'write_mode', fallback=fallback)
+
+    def get_db_batch_size(self, fallback=100):
+        return self.config.getint('Database', 'batch_size', fallback=fallback)
+
+    def get_db_flush_interval(self, fallback=1.0):
+        return self.config.getfloat('Database', 'flush_interval', fallback=fallback)
+
+    def get_db_queue_size(self, fallback=5000):
+        return self.config.getint('Database', 'queue_size', fallback=fallback)
+
+    def get_db_spool_path(self, fallback=None):
+        return self.config.get('Database', 'spool_path', fallback=fallback) or fallback
+
+    def get_db_spool_retry_interval(self, fallback=5.0):
+        return self.config.getfloat('Database', 'spool_retry_interval', fallback=fallback)
+
+    # Compression configuration
+    def get_compression_enabled(self, fallback=False):
+        return self.config.getboolean('Compression', 'enabled', fallback=fallback)
+
+    def get_compression_max_interval(self, fallback=30.0):
+        return self.config.getfloat('Compression', 'max_interval', fallback=fallback)
+
+    def get_compression_rule(self, column, fallback=None):
+        return self.config.get('Compression', column, fallback=fallback)
+
+    # Acquisition pipeline configuration
+    def get_pipeline_interval(self, fallback=1.0):
+        return self.config.getfloat('Pipeline', 'sample_interval', fallback=fallback)
+
+    def get_pipeline_queue_size(self, consumer, fallback=100):
+        return self.config.getint('Pipeline', f'{consumer}_queue_size', fallback=fallback)
+
+    def get_pipeline_overflow(self, consumer, fallback="drop_oldest"):
+        return self.config.get('Pipeline', f'{consumer}_overflow', fallback=fallback)
+
+    # Startup configuration
+    def get_startup_initial_backoff(self, fallback=0.5):
+        return self.config.getfloat('Startup', 'initial_backoff', fallback=fallback)
+
+    def get_startup_max_backoff(self, fallback=30.0):
+        return self.config.getfloat('Startup', 'max_backoff', fallback=fallback)
+
+    # Maintenance configuration
+    def get_maintenance_enabled(self, fallback=True):
+        return self.config.getboolean('Maintenance', 'enabled', fallback=fallback)
+
+    def get_maintenance_interval(self, fallback=3600.0):
+        return self.config.getfloat('Maintenance', 'interval', fallback=fallback)
+
+    def get_maintenance_archive_after_days(self, fallback=7.0):
+        return self.config.getfloat('Maintenance', 'archive_after_days', fallback=fallback)
+
+    def get_maintenance_storage_budget_mb(self, fallback=4096.0):
+        return self.config.getfloat('Maintenance', 'storage_budget_mb', fallback=fallback)
+
+    def get_maintenance_vacuum_step_pages(self, fallback=256):
+        return self.config.getint('Maintenance', 'vacuum_step_pages', fallback=fallback)
+
+    def get_maintenance_step_pause(self, fallback=0.5):
+        return self.config.getfloat('Maintenance', 'step_pause', fallback=fallback)
+
+    # Archive configuration
+    def get_archive_on_end_session(self, fallback=True):
+        return self.config.getboolean('Archive', 'on_end_session', fallback=fallback)
+
+    def get_archive_directory(self, fallback="archives"):
+        return self.config.get('Archive', 'directory', fallback=fallback) or fallback
+
+    def get_archive_codec(self, fallback="zlib"):
+        return self.config.get('Archive', 'codec', fallback=fallback) or fallback
+
+    def get_archive_block_rows(self, fallback=1024):
+        return self.config.getint('Archive', 'block_rows', fallback=fallback)
+
+    # Logging configuration
+    def get_log_level(self, fallback="INFO"):
+        return self.config.get('Logging', 'level', fallback=fallback)
+
+    def get_obd_log_level(self, fallback="WARNING"):
+        return self.config.get('Logging', 'obd_level', fallback=fallback)
+
+    def get_bless_log_level(self, fallback="WARNING"):
+        return self.config.get('Logging', 'bless_level', fallback=fallback)
+
+    def get_log_rate_limit(self, fallback=10):
+        return self.config.getint('Logging', 'rate_limit', fallback=fallback)
+
+    def get_log_rate_interval(self, fallback=60.0):
+        return self.config.getfloat('Logging', 'rate_interval', fallback=fallback)
+
+    # Metrics configuration
+    def get_metrics_snapshot_path(self, fallback=None):
+        return self.config.get('Metrics', 'snapshot_path', fallback=fallback) or fallback
+
+    def get_metrics_snapshot_interval(self, fallback=10.0):
+        return self.config.getfloat('Metrics', 'snapshot_interval', fallback=fallback)
 
 
     # Generic getter methods
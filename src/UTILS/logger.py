@@ -1,34 +1,149 @@
+import atexit
 import logging
-from datetime import datetime
+import queue
+import sys
+import threading
+import time
+from .config import config_instance as config
+
+LEVELS = {
+    "DEBUG": logging.DEBUG,
+    "INFO": logging.INFO,
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR,
+    "CRITICAL": logging.CRITICAL,
+}
+
+
+def parse_level(name, fallback=logging.INFO):
+    return LEVELS.get(str(name).strip().upper(), fallback)
+
+
+class LogWriter:
+    """Background thread writing queued log lines to the console.
+
+    Logging only formats the line and puts it on a queue; the console write
+    happens here, with every line queued in the meantime joined into a
+    single write, so a slow terminal or serial console never blocks callers.
+    """
+
+    def __init__(self, stream=None):
+        # None follows sys.stdout, even when it is replaced later
+        self.stream = stream
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, name="LogWriter")
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def write(self, line):
+        self.queue.put(line)
+
+    def flush(self, timeout=1.0):
+        """Wait until the lines queued so far are written"""
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait(timeout)
+
+    def _run(self):
+        while True:
+            lines = [self.queue.get()]
+            while True:
+                try:
+                    lines.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            events = [line for line in lines if isinstance(line, threading.Event)]
+            text = "".join(line + "\n" for line in lines if isinstance(line, str))
+            stream = self.stream or sys.stdout
+            try:
+                stream.write(text)
+                stream.flush()
+            except (OSError, ValueError):
+                pass
+            for event in events:
+                event.set()
 
 
 class Logger:
+    # Shared by every logger; created with the first one
+    writer = None
+    _writer_lock = threading.Lock()
+    # The timestamp text only changes once per second, so it is formatted once per second
+    _timestamp_second = None
+    _timestamp_text = ""
+
     def __init__(self, service_name: str):
         self.service_name = service_name
-        self.log_level = logging.DEBUG
-    
+        self.log_level = parse_level(config.get_log_level())
+        self.rate_limit = config.get_log_rate_limit()
+        self.rate_interval = config.get_log_rate_interval()
+        # message -> [window start, messages logged in the window, suppressed]
+        self._repeats = {}
+        with Logger._writer_lock:
+            if Logger.writer is None:
+                Logger.writer = LogWriter()
+
+    def is_enabled(self, level: int) -> bool:
+        return level >= self.log_level
+
+    @classmethod
+    def _timestamp(cls) -> str:
+        now = int(time.time())
+        if now != cls._timestamp_second:
+            cls._timestamp_text = time.strftime("%d/%m/%Y %H:%M:%S", time.localtime(now))
+            cls._timestamp_second = now
+        return cls._timestamp_text
+
     def _format_message(self, level: str, content: str) -> str:
         """Format message with timestamp and service name"""
-        timestamp = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-        return f"[{timestamp}][{self.service_name}][{level}] : {content}"
-    
-    def debug(self, content: str):
+        return f"[{self._timestamp()}][{self.service_name}][{level}] : {content}"
+
+    def _allow(self, content: str) -> bool:
+        """Let at most rate_limit identical messages through per rate_interval seconds"""
+        if not self.rate_limit:
+            return True
+        now = time.monotonic()
+        repeats = self._repeats.get(content)
+        if repeats is None or now - repeats[0] >= self.rate_interval:
+            if repeats is not None and repeats[2]:
+                self.writer.write(self._format_message("INFO", f"{repeats[2]} repeats of the previous message suppressed: {content}"))
+            if len(self._repeats) > 1000:
+                self._repeats.clear()
+            self._repeats[content] = [now, 1, 0]
+            return True
+        if repeats[1] < self.rate_limit:
+            repeats[1] += 1
+            return True
+        repeats[2] += 1
+        return False
+
+    def log(self, level: int, level_name: str, content: str, *args):
+        if level < self.log_level:
+            return
+        if args:
+            content = content % args
+        if self._allow(content):
+            self.writer.write(self._format_message(level_name, content))
+
+    def debug(self, content: str, *args):
         """Log debug message"""
-        print(self._format_message("DEBUG", content))
-    
-    def info(self, content: str):
+        if logging.DEBUG >= self.log_level:
+            self.log(logging.DEBUG, "DEBUG", content, *args)
+
+    def info(self, content: str, *args):
         """Log info message"""
-        print(self._format_message("INFO", content))
-    
-    def warning(self, content: str):
+        if logging.INFO >= self.log_level:
+            self.log(logging.INFO, "INFO", content, *args)
+
+    def warning(self, content: str, *args):
         """Log warning message"""
-        print(self._format_message("WARNING", content))
-    
-    def error(self, content: str):
+        self.log(logging.WARNING, "WARNING", content, *args)
+
+    def error(self, content: str, *args):
         """Log error message"""
-        print(self._format_message("ERROR", content))
-    
-    def critical(self, content: str):
-        """Log critical message"""
-        print(self._format_message("CRITICAL", content))
+        self.log(logging.ERROR, "ERROR", content, *args)
 
+    def critical(self, content: str, *args):
+        """Log critical message"""
+        self.log(logging.CRITICAL, "CRITICAL", content, *args)
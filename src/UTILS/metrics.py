@@ -0,0 +1,190 @@
+import json
+import os
+import threading
+import time
+from .logger import Logger
+
+logger = Logger("Metrics")
+
+# Latency histograms split every power of two of microseconds in four
+# buckets, so a bucket is at most 25% wider than its lower bound. The last
+# bucket holds everything from ~29 s up.
+HISTOGRAM_BUCKETS = 96
+# Rates are counted per second over a sliding window of this many seconds
+RATE_WINDOW = 10
+
+
+def bucket_index(microseconds):
+    if microseconds < 4:
+        return microseconds
+    exponent = microseconds.bit_length()
+    index = (exponent - 2) * 4 + ((microseconds >> (exponent - 3)) & 3)
+    return index if index < HISTOGRAM_BUCKETS else HISTOGRAM_BUCKETS - 1
+
+
+def bucket_upper_bound(index):
+    """Exclusive upper bound in microseconds of a bucket"""
+    if index < 4:
+        return index + 1
+    return (5 + index % 4) << (index // 4 - 1)
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def percentile(self, p):
+        """Upper bound in seconds of the bucket holding the p-th percentile"""
+        rank = self.count * p / 100
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(bucket_upper_bound(i) / 1e6, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50) * 1000, 3),
+            "p95_ms": round(self.percentile(95) * 1000, 3),
+            "p99_ms": round(self.percentile(99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class RateMeter:
+    __slots__ = ("stamps", "counts", "total")
+
+    def __init__(self):
+        self.stamps = [0] * RATE_WINDOW
+        self.counts = [0] * RATE_WINDOW
+        self.total = 0
+
+    def rate(self):
+        """Events per second over the last RATE_WINDOW complete seconds"""
+        now = int(time.monotonic())
+        return sum(c for s, c in zip(self.stamps, self.counts) if now - RATE_WINDOW <= s < now) / RATE_WINDOW
+
+
+class Metrics:
+    """In-process counters, latency histograms, rates and gauges.
+
+    Recording is a dict lookup and a few integer operations, without locks:
+    under contention an increment can occasionally be lost, which is fine for
+    monitoring and keeps the cost well under a microsecond per event. Gauges
+    are callables evaluated only when a snapshot is taken.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self.rates = {}
+        self.gauges = {}
+
+    def increment(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, seconds):
+        """Record a latency in seconds in the histogram of name"""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms.setdefault(name, Histogram())
+        microseconds = int(seconds * 1e6)
+        if microseconds < 4:
+            histogram.counts[microseconds] += 1
+        else:
+            # Same as bucket_index(), inlined as this runs on every event
+            exponent = microseconds.bit_length()
+            index = (exponent - 2) * 4 + ((microseconds >> (exponent - 3)) & 3)
+            histogram.counts[index if index < HISTOGRAM_BUCKETS else HISTOGRAM_BUCKETS - 1] += 1
+        histogram.count += 1
+        histogram.total += seconds
+        if seconds > histogram.max:
+            histogram.max = seconds
+
+    def mark(self, name):
+        """Count one event towards the per-second rate of name"""
+        meter = self.rates.get(name)
+        if meter is None:
+            meter = self.rates.setdefault(name, RateMeter())
+        now = int(time.monotonic())
+        slot = now % RATE_WINDOW
+        if meter.stamps[slot] != now:
+            meter.stamps[slot] = now
+            meter.counts[slot] = 0
+        meter.counts[slot] += 1
+        meter.total += 1
+
+    def gauge(self, name, read):
+        """Report the value returned by read() in every snapshot"""
+        self.gauges[name] = read
+
+    def snapshot(self, prefix=""):
+        """Return {name: value} for every metric whose name starts with prefix"""
+        values = {}
+        for name, count in list(self.counters.items()):
+            if name.startswith(prefix):
+                values[name] = count
+        for name, histogram in list(self.histograms.items()):
+            if name.startswith(prefix):
+                values[name] = histogram.to_dict()
+        for name, meter in list(self.rates.items()):
+            if name.startswith(prefix):
+                values[name] = {"per_sec": round(meter.rate(), 2), "total": meter.total}
+        for name, read in list(self.gauges.items()):
+            if name.startswith(prefix):
+                try:
+                    values[name] = read()
+                except Exception:
+                    values[name] = None
+        return dict(sorted(values.items()))
+
+
+class MetricsReporter:
+    """Writes a metrics snapshot to a JSON file every interval seconds"""
+
+    def __init__(self, metrics, path, interval=10.0):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="MetricsReporter")
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.write()
+
+    def write(self):
+        snapshot = {
+            "timestamp": time.time(),
+            "uptime": round(time.time() - self.metrics.started, 1),
+            "metrics": self.metrics.snapshot(),
+        }
+        # Write aside and rename so readers never see a partial file
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as output:
+            json.dump(snapshot, output, indent=1)
+        os.replace(temporary, self.path)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                logger.error(f"Failed to write metrics snapshot to {self.path}: {e}")
+
+
+metrics_instance = Metrics()
@@ -0,0 +1,50 @@
+import datetime
+from src.API.Archive import SessionArchive, encode_archive
+
+START = datetime.datetime(2026, 1, 1, 8, 0, 0)
+
+
+def readings(offsets):
+    """Reading rows taken offsets seconds after START, in id order"""
+    return [
+        (i + 1, START + datetime.timedelta(seconds=offset), float(i % 120), 800.0 + i, None, 90.0, None)
+        for i, offset in enumerate(offsets)
+    ]
+
+
+def expected(rows, start, end, after_id=0):
+    epoch = START.timestamp()
+    return [
+        (row[0], row[2]) for row, offset in ((row, (row[1] - START).total_seconds()) for row in rows)
+        if row[0] > after_id and start <= epoch + offset <= end
+    ]
+
+
+def selected(archive, start, end, after_id=0):
+    epoch = START.timestamp()
+    ids, speeds = archive.select(("id", "speed"), epoch + start, epoch + end, after_id)
+    return list(zip(ids, speeds))
+
+
+def check_ranges(rows, ranges):
+    archive = SessionArchive(encode_archive(rows, block_rows=16))
+    epoch = START.timestamp()
+    for start, end, after_id in ranges:
+        assert selected(archive, start, end, after_id) == expected(rows, epoch + start, epoch + end, after_id)
+    return archive
+
+
+def test_range_queries_of_sorted_timestamps():
+    rows = readings([i * 0.5 for i in range(200)])
+    archive = check_ranges(rows, [(0, 100, 0), (10.2, 30.7, 0), (40, 60, 90), (99.5, 200, 0), (-10, -1, 0)])
+    assert archive.sorted
+
+
+def test_range_queries_when_the_clock_goes_back():
+    # The clock is set back an hour after 60 readings, e.g. synced once the network is up
+    offsets = [3600 + i * 0.5 for i in range(60)] + [i * 0.5 for i in range(140)]
+    rows = readings(offsets)
+    archive = check_ranges(rows, [(0, 10, 0), (20, 3620, 0), (3600, 3700, 0), (0, 5000, 30), (50, 60, 0)])
+    assert not archive.sorted
+    assert archive.start == START.timestamp()
+    assert archive.end == START.timestamp() + offsets[59]
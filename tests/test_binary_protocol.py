@@ -0,0 +1,109 @@
+import datetime
+from src.API.BinaryProtocol import (
+    BinaryEncoder, FLAG_DELTA, FLAG_INT16, FLAG_REQUEST, FLOAT32_ITEM, HEADER, INT16_ITEM, NULL_VALUE, PID_IDS,
+    READING_ITEM, READINGS_HEADER, REQUEST_ID, SCALES, TYPE_READINGS, TYPE_VALUES,
+)
+
+START = datetime.datetime(2026, 1, 1, 8, 0, 0)
+NAMES = {pid: name for name, pid in PID_IDS.items()}
+
+
+def decode(frame):
+    """Split a frame into its header fields, request id (or None) and the offset of its body"""
+    magic, frame_type, flags, count, seq = HEADER.unpack_from(frame, 0)
+    offset = HEADER.size
+    request_id = None
+    if flags & FLAG_REQUEST:
+        (request_id,) = REQUEST_ID.unpack_from(frame, offset)
+        offset += REQUEST_ID.size
+    return frame_type, flags, count, request_id, offset
+
+
+def decode_values(frame, previous=None):
+    frame_type, flags, count, request_id, offset = decode(frame)
+    assert frame_type == TYPE_VALUES
+    item = INT16_ITEM if flags & FLAG_INT16 else FLOAT32_ITEM
+    values = {}
+    for i in range(count):
+        pid, value, age = item.unpack_from(frame, offset + i * item.size)
+        name = NAMES[pid]
+        if flags & FLAG_DELTA:
+            value += previous[name]
+        values[name] = value
+    return values, flags, request_id
+
+
+def decode_readings(frame):
+    frame_type, flags, count, request_id, offset = decode(frame)
+    assert frame_type == TYPE_READINGS
+    base, next_cursor = READINGS_HEADER.unpack_from(frame, offset)
+    offset += READINGS_HEADER.size
+    rows = []
+    for i in range(count):
+        reading_id, ms, speed, rpm, coolant = READING_ITEM.unpack_from(frame, offset + i * READING_ITEM.size)
+        values = [
+            None if value == NULL_VALUE else value / SCALES[name]
+            for name, value in (("SPEED", speed), ("RPM", rpm), ("COOLANT_TEMP", coolant))
+        ]
+        rows.append((reading_id, base + ms / 1000, *values))
+    return rows, next_cursor, request_id
+
+
+def reading(reading_id, seconds, speed, rpm, coolant_temp):
+    return (reading_id, START + datetime.timedelta(seconds=seconds), speed, rpm, None, coolant_temp, None)
+
+
+def test_values_round_trip_through_delta_frames():
+    encoder = BinaryEncoder(int16=True, delta=True, keyframe_interval=2)
+    samples = [{"SPEED": 50.25, "RPM": 2000.0}, {"SPEED": 51.0, "RPM": 2100.5}, {"SPEED": 49.5, "RPM": 1900.0}]
+    scaled = {}
+    flags_seen = []
+    for sample in samples:
+        frame = encoder.encode_values({name: (value, 0.1) for name, value in sample.items()})
+        values, flags, _ = decode_values(frame, scaled)
+        scaled = values
+        flags_seen.append(flags & FLAG_DELTA)
+        assert {name: value / SCALES[name] for name, value in values.items()} == sample
+    assert flags_seen == [0, FLAG_DELTA, FLAG_DELTA]
+
+
+def test_values_answering_a_request_carry_its_id_and_are_never_deltas():
+    encoder = BinaryEncoder(int16=True, delta=True)
+    encoder.encode_values({"SPEED": (50.0, 0.0)})
+    values, flags, request_id = decode_values(encoder.encode_values({"SPEED": (60.0, 0.0)}, request_id=0x80000001))
+    assert request_id == 0x80000001
+    assert not flags & FLAG_DELTA
+    assert values == {"SPEED": 6000}
+
+
+def test_float32_values_and_non_numeric_commands():
+    frame = BinaryEncoder(int16=False).encode_values({"RPM": (812.5, 0.0), "FUEL_STATUS": ("Closed loop", 0.0)})
+    values, _, _ = decode_values(frame)
+    assert values == {"RPM": 812.5}
+
+
+def test_readings_round_trip_with_missing_values():
+    rows = [reading(1, 0.0, 50.0, 2000.0, 90.0), reading(2, 0.5, None, 0.0, None), reading(3, 1.0, 0.0, None, 91.5)]
+    decoded, next_cursor, _ = decode_readings(BinaryEncoder().encode_readings(rows, 512))
+    base = START.timestamp()
+    assert [(row[0], row[1] - base, *row[2:]) for row in decoded] == [
+        (1, 0.0, 50.0, 2000.0, 90.0),
+        (2, 0.5, None, 0.0, None),
+        (3, 1.0, 0.0, None, 91.5),
+    ]
+    assert next_cursor == 0
+
+
+def test_readings_with_timestamps_going_backwards():
+    rows = [reading(1, 1.0, 10.0, 800.0, 80.0), reading(2, 0.0, 20.0, 900.0, 81.0)]
+    decoded, _, request_id = decode_readings(BinaryEncoder().encode_readings(rows, 512, request_id=7))
+    assert [round(row[1] - START.timestamp(), 3) for row in decoded] == [1.0, 0.0]
+    assert request_id == 7
+
+
+def test_readings_stop_at_the_frame_size_with_a_cursor():
+    rows = [reading(i, i * 0.1, 30.0, 1000.0, 85.0) for i in range(1, 101)]
+    max_size = HEADER.size + READINGS_HEADER.size + 10 * READING_ITEM.size
+    decoded, next_cursor, _ = decode_readings(BinaryEncoder().encode_readings(iter(rows), max_size))
+    assert [row[0] for row in decoded] == list(range(1, 11))
+    assert next_cursor == 10
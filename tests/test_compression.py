@@ -0,0 +1,55 @@
+import datetime
+import random
+import numpy as np
+from src.API.Compression import ChangeFilter, ReadingCompressor, SwingingDoorFilter
+
+START = datetime.datetime(2026, 1, 1, 8, 0, 0)
+
+
+def compress(rows, filters, max_interval=30.0):
+    compressor = ReadingCompressor(filters, max_interval=max_interval)
+    kept = []
+    for t, values in rows:
+        kept += compressor.add(START + datetime.timedelta(seconds=t), values)
+    kept += compressor.flush()
+    return kept
+
+
+def rebuild_error(rows, kept, column="speed"):
+    """Largest distance between the signal and its linear interpolation through the kept rows"""
+    times = np.array([(timestamp - START).total_seconds() for timestamp, _ in kept])
+    values = np.array([row_values[column] for _, row_values in kept])
+    original_times = np.array([t for t, _ in rows])
+    original = np.array([row_values[column] for _, row_values in rows])
+    return float(np.max(np.abs(np.interp(original_times, times, values) - original)))
+
+
+def random_walk(samples=3600, seed=1):
+    rng = random.Random(seed)
+    speed = 50.0
+    rows = []
+    for i in range(samples):
+        speed = max(0.0, speed + rng.uniform(-1.0, 1.0))
+        rows.append((i * 0.5, {"speed": speed}))
+    return rows
+
+
+def test_swinging_door_rebuilds_random_walk_within_tolerance():
+    rows = random_walk()
+    kept = compress(rows, {"speed": SwingingDoorFilter(0.5)})
+    assert rebuild_error(rows, kept) <= 0.5 + 1e-9
+    assert len(kept) < len(rows)
+
+
+def test_swinging_door_rebuilds_ramp_then_flat_within_tolerance():
+    rows = [(i * 0.1, {"speed": min(i * 0.37, 30.0) + (0.3 if i % 7 == 0 else 0.0)}) for i in range(600)]
+    kept = compress(rows, {"speed": SwingingDoorFilter(0.5)})
+    assert rebuild_error(rows, kept) <= 0.5 + 1e-9
+    assert len(kept) < len(rows) / 5
+
+
+def test_rows_kept_for_other_columns_or_heartbeats_keep_the_tolerance():
+    rng = random.Random(2)
+    rows = [(t, {**values, "fuel_status": rng.choice(["OL", "CL"]) if rng.random() < 0.05 else "CL"}) for t, values in random_walk(seed=3)]
+    kept = compress(rows, {"speed": SwingingDoorFilter(0.5), "fuel_status": ChangeFilter()}, max_interval=5.0)
+    assert rebuild_error(rows, kept) <= 0.5 + 1e-9
@@ -0,0 +1,68 @@
+import datetime
+import sqlite3
+from src.API.DTCEvents import DTCTracker, create_dtc_tables, iter_dtc_events, parse_dtcs
+
+START = datetime.datetime(2026, 1, 1, 8, 0, 0)
+
+
+def connect():
+    connection = sqlite3.connect(":memory:")
+    create_dtc_tables(connection.cursor())
+    return connection
+
+
+def at(minutes):
+    return START + datetime.timedelta(minutes=minutes)
+
+
+def events(connection):
+    return [(code, first_seen, cleared_at) for _, code, _, first_seen, cleared_at in reversed(list(iter_dtc_events(connection)))]
+
+
+def test_parse_dtcs_accepts_the_get_dtc_json_and_tuples():
+    assert parse_dtcs('[{"code": "P0301", "description": "Misfire"}]') == {"P0301": "Misfire"}
+    assert parse_dtcs([("P0420", "Catalyst")]) == {"P0420": "Catalyst"}
+    assert parse_dtcs("[]") == {}
+
+
+def test_codes_are_stored_as_appeared_and_cleared_events():
+    connection = connect()
+    tracker = DTCTracker()
+    assert tracker.update(connection, 1, {"P0301": "Misfire"}, at(0))
+    assert not tracker.update(connection, 1, {"P0301": "Misfire"}, at(1))
+    assert tracker.update(connection, 1, {"P0301": "Misfire", "P0420": "Catalyst"}, at(2))
+    assert tracker.update(connection, 1, {"P0420": "Catalyst"}, at(3))
+    assert tracker.update(connection, 1, {"P0301": "Misfire", "P0420": "Catalyst"}, at(4))
+    assert events(connection) == [
+        ("P0301", str(at(0)), str(at(3))),
+        ("P0420", str(at(2)), None),
+        ("P0301", str(at(4)), None),
+    ]
+
+
+def test_open_events_are_resumed_by_a_new_tracker():
+    connection = connect()
+    DTCTracker().update(connection, 1, {"P0301": "Misfire"}, at(0))
+    tracker = DTCTracker()
+    assert not tracker.update(connection, 2, {"P0301": "Misfire"}, at(1))
+    assert tracker.update(connection, 2, {}, at(2))
+    assert events(connection) == [("P0301", str(at(0)), str(at(2)))]
+
+
+def test_each_vehicle_only_clears_its_own_events():
+    connection = connect()
+    vehicle_a = DTCTracker("VIN_A", "/dev/rfcomm0")
+    vehicle_b = DTCTracker("VIN_B", "/dev/rfcomm1")
+    assert vehicle_b.update(connection, 2, {"P0301": "Misfire"}, at(0))
+    # VIN_A reports no fault: VIN_B's misfire must stay open
+    assert not vehicle_a.update(connection, 1, {}, at(1))
+    assert not vehicle_b.update(connection, 2, {"P0301": "Misfire"}, at(2))
+    assert vehicle_a.update(connection, 1, {"P0420": "Catalyst"}, at(3))
+    assert vehicle_b.update(connection, 2, {}, at(4))
+    assert events(connection) == [("P0301", str(at(0)), str(at(4))), ("P0420", str(at(3)), None)]
+
+    # After a restart, each tracker resumes only the events of its vehicle
+    vehicle_b = DTCTracker("VIN_B", "/dev/rfcomm1")
+    assert not vehicle_b.update(connection, 4, {}, at(5))
+    vehicle_a = DTCTracker("VIN_A", "/dev/rfcomm1")
+    assert not vehicle_a.update(connection, 3, {"P0420": "Catalyst"}, at(5))
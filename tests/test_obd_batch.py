@@ -0,0 +1,86 @@
+import json
+import threading
+import obd
+from src.API.OBDBatch import BatchQuerier, build_request
+from src.API.Replay import ReplayConnection
+
+# CAN 11 bit / 500 kbaud, as the emulator and the synthetic trace
+INIT = ["7E8064100BE3FA813"]
+SINGLE_PID_LINES = {
+    "010D": ["7E803410D3C"],
+    "0105": ["7E80341055A"],
+    "010C": ["7E804410C1F40"],
+}
+
+
+def write_trace(path, exchanges):
+    with open(path, "w") as trace:
+        trace.write(json.dumps({"version": 1, "protocol": "6", "init": INIT, "recorded_at": 0}) + "\n")
+        for request, lines in exchanges.items():
+            trace.write(json.dumps({"request": request, "lines": lines, "latency": 0}) + "\n")
+    return ReplayConnection(str(path), speed=0)
+
+
+def test_batched_reply_is_split_per_command(tmp_path):
+    connection = write_trace(tmp_path / "batch.jsonl", {
+        **SINGLE_PID_LINES,
+        # 41 0D 3C 05 5A: speed and coolant temperature in a single frame
+        "010D05": ["7E805410D3C055A"],
+    })
+    querier = BatchQuerier(connection, threading.Lock())
+
+    assert build_request([obd.commands.SPEED, obd.commands.COOLANT_TEMP]) == b"010D05"
+    responses = querier.query([obd.commands.SPEED, obd.commands.COOLANT_TEMP])
+
+    assert responses["SPEED"].value.magnitude == 60
+    assert responses["COOLANT_TEMP"].value.magnitude == 50
+    assert querier.enabled and querier.rejections == 0
+
+
+def test_commands_missing_from_the_reply_are_queried_alone(tmp_path):
+    connection = write_trace(tmp_path / "partial.jsonl", {
+        **SINGLE_PID_LINES,
+        # The ECU only answers the speed part of the request
+        "010D0C": ["7E803410D3C"],
+    })
+    querier = BatchQuerier(connection, threading.Lock())
+
+    responses = querier.query([obd.commands.SPEED, obd.commands.RPM])
+
+    assert responses["SPEED"].value.magnitude == 60
+    assert responses["RPM"].value.magnitude == 2000
+    assert querier.enabled
+
+
+def test_falls_back_to_single_pids_when_the_ecu_rejects_batches(tmp_path):
+    # NO DATA to the multi-PID request
+    connection = write_trace(tmp_path / "rejected.jsonl", {**SINGLE_PID_LINES, "010D05": []})
+    querier = BatchQuerier(connection, threading.Lock(), max_rejections=2)
+
+    for _ in range(2):
+        responses = querier.query([obd.commands.SPEED, obd.commands.COOLANT_TEMP])
+        assert responses["SPEED"].value.magnitude == 60
+        assert responses["COOLANT_TEMP"].value.magnitude == 50
+    assert not querier.enabled
+
+    # Batching is no longer attempted
+    connection.interface.exchanges.pop("010D05")
+    responses = querier.query([obd.commands.SPEED, obd.commands.COOLANT_TEMP])
+    assert responses["SPEED"].value.magnitude == 60
+    assert querier.rejections == 2
+
+
+def test_commands_not_read_while_the_link_is_down_are_unavailable(tmp_path):
+    from types import SimpleNamespace
+    from src.API.OBDManager import OBDManager
+
+    # A manager built by hand, so the singleton and its polling are left alone
+    manager = object.__new__(OBDManager)
+    manager.obd_connection = write_trace(tmp_path / "down.jsonl", SINGLE_PID_LINES)
+    manager.batcher = BatchQuerier(manager.obd_connection, threading.Lock())
+    manager.supervisor = SimpleNamespace(connected=False)
+
+    assert manager.read_values(["SPEED", "NOT_A_COMMAND"]) == ({}, ["NOT_A_COMMAND"], [], ["SPEED"])
+    manager.supervisor.connected = True
+    values, _, _, unavailable = manager.read_values(["SPEED"])
+    assert values["SPEED"] == (60.0, 0.0) and unavailable == []
@@ -0,0 +1,39 @@
+import threading
+from src.API.RequestDispatcher import DATABASE, OBD, SERVER_IDS, RequestDispatcher, is_client_request_id
+
+
+def test_client_request_ids():
+    assert is_client_request_id(0)
+    assert is_client_request_id(SERVER_IDS - 1)
+    for value in (SERVER_IDS, -1, "12", 1.0, True, None):
+        assert not is_client_request_id(value)
+
+
+def test_server_ids_never_collide_with_client_ids():
+    dispatcher = RequestDispatcher(lambda request, request_id: None, lambda request_id, response: None)
+    try:
+        ids = [dispatcher.next_request_id() for _ in range(3)]
+    finally:
+        dispatcher.shutdown()
+    assert len(set(ids)) == 3
+    assert all(request_id >= SERVER_IDS and not is_client_request_id(request_id) for request_id in ids)
+
+
+def test_responses_carry_the_id_of_their_request():
+    responses = {}
+    done = threading.Event()
+
+    def respond(request_id, response):
+        responses[request_id] = response
+        if len(responses) == 3:
+            done.set()
+
+    dispatcher = RequestDispatcher(lambda request, request_id: f"{request} answered", respond, database_workers=2)
+    try:
+        dispatcher.submit(DATABASE, "history", 1)
+        dispatcher.submit(DATABASE, "aggregates", 0)
+        dispatcher.submit(OBD, "query", 5)
+        assert done.wait(5)
+    finally:
+        dispatcher.shutdown()
+    assert responses == {1: "history answered", 0: "aggregates answered", 5: "query answered"}
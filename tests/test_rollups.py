@@ -0,0 +1,51 @@
+import datetime
+import sqlite3
+from src.API.Rollups import choose_resolution, create_rollup_tables, fetch_history, fetch_range_aggregates, update_rollups
+
+START = datetime.datetime(2026, 1, 1, 8, 0, 0)
+
+
+def recorded_session(seconds=600, interval=0.5):
+    """Connection holding session 1, sampled every interval seconds, and its epoch start"""
+    connection = sqlite3.connect(":memory:")
+    connection.execute('''
+        CREATE TABLE readings (
+            id INTEGER PRIMARY KEY, session_id INTEGER, timestamp TIMESTAMP,
+            speed REAL, rpm REAL, fuel_status TEXT, coolant_temp REAL, dtc TEXT
+        )
+    ''')
+    create_rollup_tables(connection.cursor())
+    rows = [
+        (1, START + datetime.timedelta(seconds=i * interval), float(i % 90), 800.0 + i, None, 90.0, None)
+        for i in range(int(seconds / interval))
+    ]
+    connection.executemany('''
+        INSERT INTO readings (session_id, timestamp, speed, rpm, fuel_status, coolant_temp, dtc) VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    update_rollups(connection, rows)
+    return connection, START.timestamp()
+
+
+def test_choose_resolution_is_the_finest_within_max_points():
+    assert choose_resolution(100, 500) == 1
+    assert choose_resolution(1000, 500) == 10
+    assert choose_resolution(10000, 500) == 60
+    assert choose_resolution(100000, 500) == 60
+
+
+def test_history_returns_raw_readings_only_when_they_fit():
+    connection, start = recorded_session()
+    resolution, rows = fetch_history(connection, 1, "speed", start, start + 20, 100)
+    assert resolution == 0 and len(rows) == 41
+    resolution, rows = fetch_history(connection, 1, "speed", start, start + 600, 100)
+    assert resolution == 10 and len(rows) <= 100
+    assert sum(row[4] for row in rows) == 1200
+
+
+def test_rollup_and_raw_aggregates_agree():
+    connection, start = recorded_session()
+    for bucket in (60, 20, 7):
+        merged = fetch_range_aggregates(connection, 1, "rpm", start + 25, start + 400, bucket)
+        raw = fetch_range_aggregates(connection, 1, "rpm", start + 25, start + 400, bucket, percentiles=(50,))
+        assert [row[:5] for row in merged] == [row[:5] for row in raw]
+        assert all(len(row[5]) == 1 and row[1] <= row[5][0] <= row[2] for row in raw)
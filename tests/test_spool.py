@@ -0,0 +1,49 @@
+import datetime
+import sqlite3
+from src.API.DBManager import write_readings
+from src.API.Rollups import create_rollup_tables
+from src.API.Spool import Spool
+
+START = datetime.datetime(2026, 1, 1, 8, 0, 0)
+
+
+def rows(first, count):
+    return [(1, START + datetime.timedelta(seconds=i), float(i), 800.0, None, 90.0, None) for i in range(first, first + count)]
+
+
+def test_spool_keeps_rows_across_reopening(tmp_path):
+    path = str(tmp_path / "spool.bin")
+    spool = Spool(path, initial_size=64)
+    spool.append([[1, "2026-01-01 08:00:00", 50.0, None]])
+    spool.append([[1, "2026-01-01 08:00:01", 51.0, 900.0]] * 10)
+    spool.close()
+    spool = Spool(path)
+    assert spool.count == 11
+    assert next(spool.read()) == [1, "2026-01-01 08:00:00", 50.0, None]
+    spool.clear()
+    spool.close()
+    assert not Spool(path).pending
+
+
+def test_rows_refused_by_the_database_are_replayed_once_it_accepts_writes(tmp_path):
+    connection = sqlite3.connect(str(tmp_path / "obd.db"))
+    create_rollup_tables(connection.cursor())
+    spool = Spool(str(tmp_path / "spool.bin"))
+    # The readings table doesn't exist yet, so the first batch is refused
+    try:
+        write_readings(connection, rows(0, 3), spool)
+    except sqlite3.Error:
+        pass
+    assert spool.count == 3
+    connection.execute('''
+        CREATE TABLE readings (
+            id INTEGER PRIMARY KEY, session_id INTEGER, timestamp TIMESTAMP,
+            speed REAL, rpm REAL, fuel_status TEXT, coolant_temp REAL, dtc TEXT
+        )
+    ''')
+    spool.retry_at = 0.0
+    assert write_readings(connection, rows(3, 2), spool) == 5
+    assert not spool.pending
+    speeds = [row[0] for row in connection.execute("SELECT speed FROM readings ORDER BY id")]
+    assert speeds == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert connection.execute("SELECT SUM(count) FROM rollup_60s WHERE signal = 'speed'").fetchone()[0] == 5